@@ -2,75 +2,152 @@ import sys
 import os
 from dotenv import load_dotenv
 
-from tg_bot.constants import CATEGORIES
+from tg_bot.constants import AGENT_CONTACT, MAX_PHOTOS
+from tg_bot.flows import (
+    BUY_FLOW,
+    SELL_FLOW,
+    TEXT_STEP_STATES,
+    InvalidInput,
+    Step,
+    get_step,
+    next_step,
+    prev_step,
+)
+from tg_bot.listing import build_buy_preview, get_rendered_listing
 from tg_bot.keyboards.markup import (
 
     make_mod_inline,
     make_confirm_agent_keyboard,
-    make_categories_keyboard,
+    make_agent_invite_keyboard,
+    make_preview_keyboard,
     make_done_back_restart_keyboard,
-    make_skip_back_restart_keyboard,
     make_restart_only_keyboard,
-    make_back_restart_keyboard,
     make_ready_keyboard,
     make_subscribe_keyboard,
     make_start_keyboard,
 
 )
 from tg_bot.states import SellStates, BuyStates, ModStates
-from tg_bot.utils import check_subscription, safe_int, escape_html, format_number
+from tg_bot.utils import (
+    check_subscription,
+    init_subscription_cache,
+    update_subscription_status,
+    escape_html,
+)
 
 # from init_db import init_db
 
-load_dotenv()
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+import asyncio
 import logging
-import html
 import uuid
-import json
+import time
+from datetime import datetime
 
-from typing import List, Optional, Dict, Any
+from typing import Awaitable, Callable, List, Optional, Dict, Set
 
 from aiogram.dispatcher import FSMContext
-from aiogram import Bot, Dispatcher, types, executor
+from aiogram import Dispatcher, types
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
-    InputMediaPhoto, InputMediaVideo, ParseMode
+    ParseMode
 )
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from redis_db import RedisClient
+from tg_bot.redis_db import RedisClient
+from tg_bot.fsm_storage import RedisHashStorage
+from tg_bot.serialization import Serializer
+from tg_bot.webhook import answer_inline, run as run_bot
+from tg_bot.albums import AlbumCollector
+from tg_bot.config import Config
+from tg_bot.callback_router import CallbackRouter
+from tg_bot.idempotency import Claims, UpdateDedupeMiddleware
+from tg_bot.metrics import REGISTRY, MetricsMiddleware, start_metrics_server
+from tg_bot.sender import ScheduledBot, ChatPipeline
+from tg_bot.stats import StatsMiddleware, UsageStats, format_report
+from tg_bot.sharding import IngressDispatcher, ShardWorker, UpdatePublisher, run_worker, worker_partitions
+from tg_bot.db import create_engine, create_session_factory, init_db
+from tg_bot.submissions import SubmissionStore
+from tg_bot.moderation_queue import ModerationQueue
+from tg_bot.search import ListingSearch, build_inline_results
+from tg_bot.keyspace import KeySweeper, key_schema
+from tg_bot.matching import (
+    MatchIndex, MatchNotifier, format_listing_for_buyer, format_listings_for_buyer, format_matches_for_moderators,
+)
+from aiogram.bot.api import TelegramAPIServer
 
-redis_client = RedisClient()
 # ✅ КОНСТАНТЫ
-TOKEN = os.getenv("BOT_TOKEN")
-CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
-MOD_CHAT_ID = int(os.getenv("MOD_CHAT_ID"))
-MAX_PHOTOS = 10
-AGENT_CONTACT = "@Ultanovr"
+QUEUE_PAGE_SIZE = 10
+REFERRAL_THRESHOLD = 5
 CHANNEL_USERNAME = "goodbiz54"  # Без @
+MOD_CLAIM_TTL = 60  # аренда заявки на публикацию
+MOD_REJECT_CLAIM_TTL = 15 * 60  # аренда на время ввода причины отклонения
 
-
-# ✅ ЛОГИРОВАНИЕ
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# ✅ БОТ И ДИСПЕТЧЕР
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+# ✅ ПРИЛОЖЕНИЕ
+# Всё, что зависит от окружения, создаёт create_app(): импорт модуля ничего не подключает
+# и не регистрирует, поэтому его можно импортировать из бенчмарков и утилит.
+config: Optional[Config] = None
+redis_client: Optional[RedisClient] = None
+bot: Optional[ScheduledBot] = None
+dp: Optional[Dispatcher] = None
+callback_router: Optional[CallbackRouter] = None
+update_dedupe: Optional[UpdateDedupeMiddleware] = None
+send_pipeline: Optional[ChatPipeline] = None
+db_engine = None
+submission_store: Optional[SubmissionStore] = None
+moderation_queue: Optional[ModerationQueue] = None
+submission_claims: Optional[Claims] = None
+subscription_cache = None
+album_collector: Optional[AlbumCollector] = None
+usage_stats: Optional[UsageStats] = None
+match_index: Optional[MatchIndex] = None
+match_notifier: Optional[MatchNotifier] = None
+listing_search: Optional[ListingSearch] = None
+key_sweeper: Optional[KeySweeper] = None
+publish_tasks: Set[asyncio.Task] = set()  # фоновые публикации одобренных заявок (ждём при остановке)
+channel_info: Optional[types.Chat] = None  # прогревается в warm_up
+metrics_runner = None
+
+# Время от импорта модуля: сборка приложения и готовность принимать апдейты
+IMPORTED_AT = time.perf_counter()
+startup_timings: Dict[str, float] = {}
+
+def channel_username() -> str:
+    """Username канала из прогретого getChat, иначе — захардкоженный"""
+    if channel_info is not None and channel_info.username:
+        return channel_info.username
+    return CHANNEL_USERNAME
+
 
 # =======================
 # Команды
 # =======================
 
 
+async def complete_invites(user_id: int, state: FSMContext) -> bool:
+    """
+    Отправляет на модерацию объявление, ждущее приглашений, если их набралось REFERRAL_THRESHOLD.
+    Раунд засчитывается атомарно — при параллельных /start объявление уходит ровно один раз.
+    Вызывать и при переходе в ожидание приглашений (waiting_for_invites): друзья могли прийти раньше.
+    """
+    if not await redis_client.claim_referrals(user_id, REFERRAL_THRESHOLD):
+        return False
+    await bot.send_message(
+        user_id,
+        f"🎉 Поздравляем! {REFERRAL_THRESHOLD} друзей подписались.\n"
+        "Ваше объявление автоматически отправлено на модерацию!"
+    )
+    await finalize_and_send_to_moderation(user_id, state, invited=True)
+    return True
+
+
 # ✅ ИСПРАВЛЕННЫЙ обработчик /start с реферальной системой
 
 
 
 
-@dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     args = message.get_args()
@@ -85,17 +162,22 @@ async def cmd_start(message: types.Message, state: FSMContext):
 
             if not is_subscribed:
                 await message.answer(
-                    f"❌ Сначала подпишитесь на канал: https://t.me/{CHANNEL_USERNAME}\n"
+                    f"❌ Сначала подпишитесь на канал: https://t.me/{channel_username()}\n"
                     f"После подписки нажмите /start снова с той же ссылкой"
                 )
                 return
 
-            # ✅ Получаем текущий список приглашений
-            invites_key = f'referral_invites_{referrer_id}'
-            invites_data = await redis_client.redis_client.lrange(invites_key, 0, -1)
+            if referrer_id == user_id:
+                await message.answer(
+                    "Добро пожаловать! Выберите действие:",
+                    reply_markup=make_start_keyboard()
+                )
+                return
+
+            # ✅ Атомарно учитываем приглашение (дубликаты не считаются)
+            added, count = await redis_client.add_referral(referrer_id, user_id)
 
-            # ✅ Проверяем, не добавлен ли уже этот пользователь
-            if user_id in invites_data:
+            if not added:
                 await message.answer(
                     "✅ Вы уже учтены в приглашениях!\n\n"
                     "Добро пожаловать! Выберите действие:",
@@ -103,31 +185,21 @@ async def cmd_start(message: types.Message, state: FSMContext):
                 )
                 return
 
-            # ✅ Добавляем пользователя в список
-            count = await redis_client.redis_client.rpush(invites_key, f'{user_id}')
-
             # ✅ Проверяем, ждет ли пригласивший приглашений
             referrer_state = dp.current_state(chat=referrer_id, user=referrer_id)
             referrer_data = await referrer_state.get_data()
 
             waiting_for_invites = referrer_data.get("waiting_for_invites", False)
 
-            # ✅ Уведомляем пригласившего ТОЛЬКО если он ждет
+            # ✅ Уведомляем пригласившего ТОЛЬКО если он ждет; иначе приглашения копятся до его объявления
             if waiting_for_invites:
                 await bot.send_message(
                     referrer_id,
                     f"✅ Ваш друг подписался на канал!\n"
-                    f"Приглашено: {count}/5"
+                    f"Приглашено: {min(count, REFERRAL_THRESHOLD)}/{REFERRAL_THRESHOLD}"
                 )
-
-                # ✅ Если достигнут порог — автоматически отправляем на модерацию
-                if count >= 5:
-                    await bot.send_message(
-                        referrer_id,
-                        "🎉 Поздравляем! 5 друзей подписались.\n"
-                        "Ваше объявление автоматически отправлено на модерацию!"
-                    )
-                    await finalize_and_send_to_moderation(referrer_id, referrer_state, invited=True)
+                if count >= REFERRAL_THRESHOLD:
+                    await complete_invites(referrer_id, referrer_state)
 
             # ✅ Благодарим пользователя
             await message.answer(
@@ -151,15 +223,44 @@ async def cmd_start(message: types.Message, state: FSMContext):
         return
 
     # ✅ Обычный /start (без реферальной ссылки)
-    await message.answer(
+    return await answer_inline(
+        message,
         "Добро пожаловать! Выберите действие:",
         reply_markup=make_start_keyboard()
     )
+# =======================
+# Подписка на канал: обновление кэша
+# =======================
+
+async def channel_member_updated(update: types.ChatMemberUpdated):
+    """Обновляет кэш подписок по событиям канала (бот должен быть админом канала)"""
+    if update.chat.id != config.channel_id:
+        return
+    member = update.new_chat_member
+    await update_subscription_status(member.user.id, member.status)
+    logger.info(f"chat_member: user {member.user.id} -> {member.status}")
+
+
 # =======================
 # Обработчики навигации: Назад Начать сначала
 # =======================
 
-@dp.callback_query_handler(lambda c: c.data == "nav:back", state="*")
+async def ask_step(chat_id: int, step: Step, state: FSMContext, ack: str = ""):
+    """Переводит опрос на шаг step и задаёт его вопрос новым сообщением"""
+    await state.set_state(step.state)
+    data = await state.get_data() if step.needs_data else None
+    text, kb = step.render(data)
+    await bot.send_message(chat_id, ack + text, reply_markup=kb)
+
+
+async def answer_step(message: types.Message, step: Step, state: FSMContext, ack: str = ""):
+    """То же, что ask_step, но ответом на сообщение (в режиме webhook — прямо в ответе на апдейт)"""
+    await state.set_state(step.state)
+    data = await state.get_data() if step.needs_data else None
+    text, kb = step.render(data)
+    return await answer_inline(message, ack + text, reply_markup=kb)
+
+
 async def nav_back_handler(callback_query: types.CallbackQuery, state: FSMContext):
     """Обработчик кнопки 'Назад' - дублирует предыдущий шаг"""
     try:
@@ -169,10 +270,9 @@ async def nav_back_handler(callback_query: types.CallbackQuery, state: FSMContex
             await callback_query.answer("Нет предыдущего шага")
             return
 
-        # Получаем предыдущее состояние
-        previous_state = await get_previous_state(current_state)
+        previous_step = prev_step(get_step(current_state))
 
-        if previous_state is None:
+        if previous_step is None:
             await callback_query.answer("Это первый шаг, назад вернуться нельзя")
             return
 
@@ -185,15 +285,8 @@ async def nav_back_handler(callback_query: types.CallbackQuery, state: FSMContex
         except Exception:
             pass  # Если не удалось удалить - не страшно
 
-        # Устанавливаем предыдущее состояние
-        await previous_state.set()
-
         # ✅ ИЗМЕНЕНО: отправляем вопрос как новое сообщение (дублируем шаг)
-        await send_state_question(
-            callback_query.from_user.id,
-            str(previous_state),
-            state
-        )
+        await ask_step(callback_query.from_user.id, previous_step, state)
 
         await callback_query.answer("◀️ Возврат назад")
 
@@ -202,7 +295,6 @@ async def nav_back_handler(callback_query: types.CallbackQuery, state: FSMContex
         await callback_query.answer("Ошибка при возврате назад")
 
 
-@dp.callback_query_handler(lambda c: c.data == "nav:restart", state="*")
 async def nav_restart_handler(callback_query: types.CallbackQuery, state: FSMContext):
     """Обработчик кнопки 'Начать сначала'"""
     try:
@@ -222,28 +314,16 @@ async def nav_restart_handler(callback_query: types.CallbackQuery, state: FSMCon
         await callback_query.answer("Ошибка при перезапуске")
 
 
-@dp.callback_query_handler(lambda c: c.data == "sell:skip_current", state=SellStates)
 async def sell_skip_current_handler(callback_query: types.CallbackQuery, state: FSMContext):
     try:
-        current_state = await state.get_state()
+        step = get_step(await state.get_state())
 
-        if current_state == "SellStates:SELL_MARKETING":
-            await state.update_data(marketing="")
-            await SellStates.SELL_EMPLOYEES.set()
-            await bot.send_message(
-                callback_query.from_user.id,
-                "Заполните информацию про сотрудников (количество, ФОТ, стаж, должности):",
-                reply_markup=make_back_restart_keyboard()
-            )
+        if step is None or not step.skippable:
+            await callback_query.answer("Этот шаг нельзя пропустить")
+            return
 
-        elif current_state == "SellStates:SELL_EXTRA":
-            await state.update_data(extra="")
-            await SellStates.SELL_TABLE.set()
-            await bot.send_message(
-                callback_query.from_user.id,
-                "Прикрепите таблицу доходности (файл) или нажмите 'Пропустить'.",
-                reply_markup=make_done_back_restart_keyboard("sell:photos_done")
-            )
+        await state.update_data({step.key: step.skip_value})
+        await ask_step(callback_query.from_user.id, next_step(step), state)
 
         await callback_query.answer("⏭️ Пропущено")
 
@@ -257,9 +337,8 @@ async def sell_skip_current_handler(callback_query: types.CallbackQuery, state:
 # Обработка выбора Sell/Buy
 # =======================
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("start:"))
-async def process_start_choice(callback_query: types.CallbackQuery, state: FSMContext):
-    action = callback_query.data.split(":")[1]
+async def process_start_choice(callback_query: types.CallbackQuery, state: FSMContext, arg: Optional[str]):
+    action = arg
     user_id = callback_query.from_user.id
 
     if action == "sell":
@@ -321,8 +400,8 @@ async def process_start_choice(callback_query: types.CallbackQuery, state: FSMCo
                 return
             else:
                 # Запускаем FSM опроса покупки
-                await bot.send_message(user_id, "Отлично! Какой у вас бюджет?")
-                await BuyStates.BUY_BUDGET.set()
+                await ask_step(user_id, BUY_FLOW[BuyStates.BUY_BUDGET.state], state)
+                usage_stats.incr("flows_started_buy")
                 await callback_query.answer()
                 return
         except Exception as e:
@@ -335,11 +414,11 @@ async def process_start_choice(callback_query: types.CallbackQuery, state: FSMCo
 # Кнопка "Проверить подписку"
 
 # Кнопка "Проверить подписку"
-@dp.callback_query_handler(lambda c: c.data == "check_sub")
 async def process_check_sub(callback_query: types.CallbackQuery, state: FSMContext):
     user_id = callback_query.from_user.id
     try:
-        subscribed = await check_subscription(user_id)
+        # Пользователь говорит, что подписался — кэшу не верим
+        subscribed = await check_subscription(user_id, force_refresh=True)
         if subscribed:
             # ✅ ИСПРАВЛЕНО: получаем данные из состояния
             data = await state.get_data()
@@ -370,8 +449,8 @@ async def process_check_sub(callback_query: types.CallbackQuery, state: FSMConte
 
             elif action == "buy":
                 # Логика для покупки
-                await bot.send_message(user_id, "Отлично! Какой у вас бюджет?")
-                await BuyStates.BUY_BUDGET.set()
+                await ask_step(user_id, BUY_FLOW[BuyStates.BUY_BUDGET.state], state)
+                usage_stats.incr("flows_started_buy")
 
             else:
                 # Если действие не определено - показываем главное меню
@@ -397,14 +476,13 @@ async def process_check_sub(callback_query: types.CallbackQuery, state: FSMConte
 # =======================
 # Начало опроса Sell
 # =======================
-@dp.callback_query_handler(lambda c: c.data == "info:ready")
 async def info_ready(callback_query: types.CallbackQuery, state: FSMContext):
     user_id = callback_query.from_user.id
     try:
         # Инициализируем контекст
         await state.update_data(photos=[], photos_metas=[], video=None)
-        await bot.send_message(user_id, "Тогда начнём с названия объявления:")
-        await SellStates.SELL_TITLE.set()
+        await ask_step(user_id, SELL_FLOW[SellStates.SELL_TITLE.state], state)
+        usage_stats.incr("flows_started_sell")
         await callback_query.answer()
     except Exception as e:
         logger.exception("Ошибка info_ready: %s", e)
@@ -412,310 +490,63 @@ async def info_ready(callback_query: types.CallbackQuery, state: FSMContext):
 
 
 # =======================
-# Навигация: Назад Начать сначала
-# =======================
-
-# Маппинг состояний для кнопки "Назад"
-SELL_STATES_ORDER = [
-    None,  # нет предыдущего для SELL_TITLE
-    SellStates.SELL_TITLE,
-    SellStates.SELL_PROFIT,
-    SellStates.SELL_MARKETING,
-    SellStates.SELL_EMPLOYEES,
-    SellStates.SELL_PREMISES,
-    SellStates.SELL_INCLUDED,
-    SellStates.SELL_EXTRA,
-    SellStates.SELL_TABLE,
-    SellStates.SELL_PHOTOS,
-    SellStates.SELL_CITY,
-    SellStates.SELL_PRICE,
-    SellStates.SELL_CATEGORY,
-]
-
-BUY_STATES_ORDER = [
-    None,  # нет предыдущего для BUY_BUDGET
-    BuyStates.BUY_BUDGET,
-    BuyStates.BUY_CITY,
-    BuyStates.BUY_CATEGORY,
-    BuyStates.BUY_EXPERIENCE,
-    BuyStates.BUY_PHONE,
-    BuyStates.BUY_WHEN_CONTACT,
-]
-
-
-async def get_previous_state(current_state_name: str):
-    """
-    Возвращает предыдущее состояние для кнопки 'Назад'
-    """
-    # Определяем, в каком flow находимся
-    if "SELL" in current_state_name:
-        states_map = {
-            "SellStates:SELL_PROFIT": SellStates.SELL_TITLE,
-            "SellStates:SELL_MARKETING": SellStates.SELL_PROFIT,
-            "SellStates:SELL_EMPLOYEES": SellStates.SELL_MARKETING,
-            "SellStates:SELL_PREMISES": SellStates.SELL_EMPLOYEES,
-            "SellStates:SELL_INCLUDED": SellStates.SELL_PREMISES,
-            "SellStates:SELL_EXTRA": SellStates.SELL_INCLUDED,
-            "SellStates:SELL_TABLE": SellStates.SELL_EXTRA,
-            "SellStates:SELL_PHOTOS": SellStates.SELL_TABLE,
-            "SellStates:SELL_CITY": SellStates.SELL_PHOTOS,
-            "SellStates:SELL_PRICE": SellStates.SELL_CITY,
-            "SellStates:SELL_CATEGORY": SellStates.SELL_PRICE,
-            "SellStates:SELL_ADDRESS": SellStates.SELL_CITY,
-        }
-    elif "BUY" in current_state_name:
-        states_map = {
-            "BuyStates:BUY_CITY": BuyStates.BUY_BUDGET,
-            "BuyStates:BUY_CATEGORY": BuyStates.BUY_CITY,
-            "BuyStates:BUY_EXPERIENCE": BuyStates.BUY_CATEGORY,
-            "BuyStates:BUY_PHONE": BuyStates.BUY_EXPERIENCE,
-            "BuyStates:BUY_WHEN_CONTACT": BuyStates.BUY_PHONE,
-        }
-    else:
-        return None
-
-    return states_map.get(current_state_name)
-
-
-async def send_state_question(user_id: int, state_name: str, state: FSMContext):
-    """
-    Отправляет вопрос для текущего состояния
-    """
-    data = await state.get_data()
-
-    # SELL states
-    if state_name == "SellStates:SELL_TITLE":
-        await bot.send_message(user_id, "Тогда начнём с названия объявления:",
-                               reply_markup=make_restart_only_keyboard())
-
-    elif state_name == "SellStates:SELL_PROFIT":
-        await bot.send_message(user_id, "Какая чистая прибыль? (Должна совпадать с таблицей)", reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_MARKETING":
-        await bot.send_message(user_id, "Расскажите, как привлекаете клиентов (активные источники привлечения клиентов):",
-                               reply_markup=make_skip_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_EMPLOYEES":
-        await bot.send_message(user_id, "Заполните информацию про сотрудников (колличество, ФОТ, стаж, должности):",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_PREMISES":
-        await bot.send_message(user_id, "Информация о помещении ((суб)аренда/собственность, площадь,коммунальные, ремонт и т.д.):",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_INCLUDED":
-        await bot.send_message(user_id, "Что входит в стоимость бизнеса? (Материальное и не материальное, обеспечительный платеж, товарные остатки, ваше сопровождение и т.д.)", reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_EXTRA":
-        await bot.send_message(user_id, "Дополнительная информация (история бизнеса, причина продажи, доп. инвестиции):",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_TABLE":
-        kb = InlineKeyboardMarkup(row_width=2)
-        kb.add(InlineKeyboardButton("⏭️ Пропустить", callback_data="sell:skip_table"))
-        kb.add(
-            InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-            InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-        )
-        await bot.send_message(user_id, "Прикрепите таблицу доходности (файл) или нажмите 'Пропустить'.",
-                               reply_markup=kb)
-
-    elif state_name == "SellStates:SELL_PHOTOS":
-        photos_count = len(data.get("photos", []))
-        await bot.send_message(
-            user_id,
-            f"Прикрепите фото (до 10) и/или видео. Загружено фото: {photos_count}/{MAX_PHOTOS}\n\nПосле загрузки нажмите 'Готово'.",
-            reply_markup=make_done_back_restart_keyboard("sell:photos_done")
-        )
-
-    elif state_name == "SellStates:SELL_CITY":
-        await bot.send_message(user_id, "Напишите город с большой буквы (например: Новосибирск):",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_PRICE":
-        await bot.send_message(user_id, "Укажите стоимость бизнеса целым числом (например: 1250700):",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "SellStates:SELL_CATEGORY":
-        kb = make_categories_keyboard()
-        kb.row(
-            InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-            InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-        )
-        await bot.send_message(user_id, "Выберите категорию:", reply_markup=kb)
-
-    # BUY states
-    elif state_name == "BuyStates:BUY_BUDGET":
-        await bot.send_message(user_id, "Отлично! Какой у вас бюджет?", reply_markup=make_restart_only_keyboard())
-
-    elif state_name == "BuyStates:BUY_CITY":
-        await bot.send_message(user_id, "В каком городе? (Напишите с большой буквы)",
-                               reply_markup=make_back_restart_keyboard())
-
-    elif state_name == "BuyStates:BUY_CATEGORY":
-        kb = make_categories_keyboard(prefix="buycat")
-        kb.row(
-            InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-            InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-        )
-        await bot.send_message(user_id, "Какой вид деятельности рассматриваете? Выберите категорию:", reply_markup=kb)
-
-
-    elif state_name == "BuyStates:BUY_EXPERIENCE":
-
-        await bot.send_message(user_id, "Есть ли опыт в бизнесе? Расскажите кратко:",
-
-                               reply_markup=make_back_restart_keyboard())
-
-
-    elif state_name == "BuyStates:BUY_PHONE":
-
-        await bot.send_message(user_id, "Номер телефона:", reply_markup=make_back_restart_keyboard())
-
-
-    elif state_name == "BuyStates:BUY_WHEN_CONTACT":
-
-        await bot.send_message(user_id, "Когда лучше связаться?", reply_markup=make_back_restart_keyboard())
-
-
-# =======================
-# Обработка вопросов продажи (по состояниям)
+# Обработка вопросов опроса (по таблице шагов tg_bot.flows)
 # =======================
-@dp.message_handler(state=SellStates.SELL_TITLE, content_types=types.ContentTypes.TEXT)
-async def sell_title(message: types.Message, state: FSMContext):
-    await state.update_data(title=message.text.strip())
-    await SellStates.SELL_PROFIT.set()
-    await message.answer(
-        "Какая чистая прибыль? (Должна совпадать с таблицей)",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-@dp.message_handler(state=SellStates.SELL_PROFIT, content_types=types.ContentTypes.TEXT)
-async def sell_profit(message: types.Message, state: FSMContext):
-    val = message.text.strip()
-    # Проверим, что введено число
-    if safe_int(val) is None:
-        await message.answer("Пожалуйста, укажите целое число — пример: 150000")
-        return
-
-    await state.update_data(profit=int(val))
-    await SellStates.SELL_MARKETING.set()
-    await message.answer(
-        "Расскажите, как привлекаете клиентов (активные источники привлечения клиентов):",
-        reply_markup=make_skip_back_restart_keyboard()
-    )
-
-
-# ✅ Обработка текста (свободный ввод)
-@dp.message_handler(state=SellStates.SELL_MARKETING, content_types=types.ContentTypes.TEXT)
-async def process_marketing_text(message: types.Message, state: FSMContext):
-    # Игнорируем служебные кнопки, которые обрабатываются отдельно
-    if message.text in ["Назад", "Пропустить", "Начать сначала"]:
-        return
-
-    await state.update_data(marketing=message.text.strip())
-    await SellStates.SELL_EMPLOYEES.set()
-    await message.answer(
-        "Заполните информацию про сотрудников (количество, ФОТ, стаж, должности):",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-
-# ✅ Обработка кнопки "Пропустить"
-@dp.message_handler(state=SellStates.SELL_EMPLOYEES, content_types=types.ContentTypes.TEXT)
-async def sell_employees(message: types.Message, state: FSMContext):
-    await state.update_data(employees=message.text.strip())
-    await SellStates.SELL_PREMISES.set()
-    await message.answer(
-        "Информация о помещении ((суб)аренда/собственность, площадь,коммунальные, ремонт и т.д.):",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-
-@dp.message_handler(state=SellStates.SELL_PREMISES, content_types=types.ContentTypes.TEXT)
-async def sell_premises(message: types.Message, state: FSMContext):
-    await state.update_data(premises=message.text.strip())
-    await SellStates.SELL_INCLUDED.set()
-    await message.answer(
-        "Что входит в стоимость бизнеса? (Материальное и не материальное, обеспечительный платеж, товарные остатки, ваше сопровождение и т.д.)",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-
-@dp.message_handler(state=SellStates.SELL_INCLUDED, content_types=types.ContentTypes.TEXT)
-async def sell_included(message: types.Message, state: FSMContext):
-    await state.update_data(included=message.text.strip())
-    await SellStates.SELL_EXTRA.set()
-    await message.answer(
-        "Дополнительная информация (история бизнеса, причина продажи, доп. инвестиции):",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-
-@dp.message_handler(state=SellStates.SELL_EXTRA, content_types=types.ContentTypes.TEXT)
-async def sell_extra(message: types.Message, state: FSMContext):
-    await state.update_data(extra=message.text.strip())
-    await SellStates.SELL_TABLE.set()
-
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(InlineKeyboardButton("⏭️ Пропустить", callback_data="sell:skip_table"))
-    kb.add(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
+async def flow_text_step(message: types.Message, state: FSMContext):
+    """Текстовый шаг продажи или покупки: проверить, сохранить, задать следующий вопрос"""
+    step = get_step(await state.get_state())
+    try:
+        value = step.parse(message.text)
+    except InvalidInput as e:
+        return await answer_inline(message, str(e))
 
-    await message.answer(
-        "Прикрепите таблицу доходности (файл) или нажмите 'Пропустить'(не рекомендуется).",
-        reply_markup=kb
-    )
+    await state.update_data({step.key: value})
+    return await answer_step(message, next_step(step), state)
 
 
-@dp.message_handler(state=SellStates.SELL_TABLE, content_types=types.ContentTypes.DOCUMENT)
 async def sell_table_file(message: types.Message, state: FSMContext):
     file = message.document
     await state.update_data(table=file.file_id, table_name=file.file_name)
-    await SellStates.SELL_PHOTOS.set()
-    await message.answer(
-        "Таблица принята. Теперь прикрепите фото (до 10) и/или видео без круглишков ТГ. После загрузки нажмите 'Готово'.",
-        reply_markup=make_done_back_restart_keyboard("sell:photos_done")
-    )
-
-
-@dp.callback_query_handler(lambda c: c.data == "sell:skip_table", state=SellStates.SELL_TABLE)
-async def sell_skip_table(callback_query: types.CallbackQuery, state: FSMContext):
-    await state.update_data(table=None)
-    await SellStates.SELL_PHOTOS.set()
-    await bot.send_message(
-        callback_query.from_user.id,
-        "Хорошо. Прикрепите фото (до 10) и/или видео без круглишков ТГ. После загрузки нажмите 'Готово'.",
-        reply_markup=make_done_back_restart_keyboard("sell:photos_done")
-    )
-    await callback_query.answer()
-
-
-@dp.message_handler(state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.PHOTO)
-async def sell_photos_handler(message: types.Message, state: FSMContext):
+    return await answer_step(message, next_step(SELL_FLOW[SellStates.SELL_TABLE.state]), state,
+                             ack="Таблица принята. ")
+
+async def sell_photos_commit(messages: List[types.Message]):
+    """Весь альбом (или одно фото) — одна запись в черновик и один ответ"""
+    chat_id, user_id = messages[0].chat.id, messages[0].from_user.id
+    state = dp.current_state(chat=chat_id, user=user_id)
+    # Пока альбом собирался, пользователь мог уйти с шага фото
+    if await state.get_state() != SellStates.SELL_PHOTOS.state:
+        return
     try:
         data = await state.get_data()
         photos: List[str] = data.get("photos", [])
-        file_id = message.photo[-1].file_id
+        free = max(MAX_PHOTOS - len(photos), 0)
+        accepted = [message.photo[-1].file_id for message in messages[:free]]
 
-        if len(photos) >= MAX_PHOTOS:
-            await message.answer(f"Можно прикрепить максимум {MAX_PHOTOS} фото.")
+        if not accepted:
+            await bot.send_message(chat_id, f"Можно прикрепить максимум {MAX_PHOTOS} фото.")
             return
 
-        photos.append(file_id)
+        photos.extend(accepted)
         await state.update_data(photos=photos)
-        await message.answer(
-            f"Фото принято ({len(photos)}/{MAX_PHOTOS}).",
+        text = f"Фото принято ({len(photos)}/{MAX_PHOTOS})."
+        if len(accepted) > 1:
+            text = f"Принято фото: {len(accepted)} ({len(photos)}/{MAX_PHOTOS})."
+        if len(messages) > len(accepted):
+            text += f"\nЕщё {len(messages) - len(accepted)} не добавлено: можно прикрепить максимум {MAX_PHOTOS} фото."
+        await bot.send_message(
+            chat_id, text,
             reply_markup=make_done_back_restart_keyboard("sell:photos_done")
         )
     except Exception as e:
         logger.exception("Ошибка добавления фото: %s", e)
-        await message.answer("Не удалось принять фото.")
+        await bot.send_message(chat_id, "Не удалось принять фото.")
+
+
+async def sell_photos_handler(message: types.Message):
+    await album_collector.add(message)
 
 
-@dp.message_handler(state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.VIDEO)
 async def sell_video_handler(message: types.Message, state: FSMContext):
     try:
         data = await state.get_data()
@@ -733,7 +564,6 @@ async def sell_video_handler(message: types.Message, state: FSMContext):
         await message.answer("Не удалось принять видео.")
 
 
-@dp.message_handler(state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.VIDEO_NOTE)
 async def sell_video_note_handler(message: types.Message, state: FSMContext):
     """
     Обработчик видеокружочков (video_note)
@@ -753,89 +583,39 @@ async def sell_video_note_handler(message: types.Message, state: FSMContext):
         logger.exception("Ошибка добавления видеокружочка: %s", e)
         await message.answer("Не удалось принять видеокружочек.")
 
-@dp.callback_query_handler(lambda c: c.data == "sell:photos_done", state=SellStates.SELL_PHOTOS)
 async def sell_photos_done(callback_query: types.CallbackQuery, state: FSMContext):
-    await SellStates.SELL_CITY.set()
-    await bot.send_message(
-        callback_query.from_user.id,
-        "Напишите город с большой буквы (например: Новосибирск):",
-        reply_markup=make_back_restart_keyboard()
-    )
+    # Альбом, отправленный прямо перед нажатием, должен попасть в черновик
+    await album_collector.wait(callback_query.from_user.id)
+    await ask_step(callback_query.from_user.id, next_step(SELL_FLOW[SellStates.SELL_PHOTOS.state]), state)
     await callback_query.answer()
 
-@dp.message_handler(state=SellStates.SELL_CITY, content_types=types.ContentTypes.TEXT)
-async def sell_city(message: types.Message, state: FSMContext):
-    city = message.text.strip()
-    await state.update_data(city=city)
-    # 👉 Сначала спрашиваем адрес
-    await SellStates.SELL_ADDRESS.set()
-    await message.answer(
-        "Укажите адрес бизнеса:",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-@dp.message_handler(state=SellStates.SELL_ADDRESS, content_types=types.ContentTypes.TEXT)
-async def sell_address(message: types.Message, state: FSMContext):
-    await state.update_data(address=message.text.strip())
-    # 👉 После адреса переходим к цене
-    await SellStates.SELL_PRICE.set()
-    await message.answer(
-        "Укажите стоимость бизнеса целым числом (например: 1250700):",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-@dp.message_handler(state=SellStates.SELL_PRICE, content_types=types.ContentTypes.TEXT)
-async def sell_price(message: types.Message, state: FSMContext):
-    val = message.text.strip()
-    if safe_int(val) is None:
-        await message.answer("Пожалуйста, укажите целое число — пример: 1250700")
-        return
-
-    await state.update_data(price=val)
-    await SellStates.SELL_CATEGORY.set()
-
-    kb = make_categories_keyboard()
-    kb.row(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
-
-    await message.answer("Выберите категорию:", reply_markup=kb)
-
-
 # Строка ~1142-1165
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("cat:"), state=SellStates.SELL_CATEGORY)
-async def sell_category(callback_query: types.CallbackQuery, state: FSMContext):
-    cat_idx = callback_query.data.split(":")[1]
-    await state.update_data(category_idx=cat_idx)
+async def sell_category(callback_query: types.CallbackQuery, state: FSMContext, arg: Optional[str]):
+    await state.update_data(category_idx=arg)
 
     await SellStates.SELL_PREVIEW.set()
 
     data = await state.get_data()
-    preview_text = build_sell_preview(data)
+
+    # ✅ Рендерим объявление один раз и храним вместе с черновиком:
+    # модерация и публикация возьмут готовый рендер, если данные не менялись
+    rendered = get_rendered_listing(data, data.get("rendered_listing"))
+    await state.update_data(rendered_listing=rendered)
+    preview_text = rendered["html"]
 
     user_id = callback_query.from_user.id
 
     # ✅ ДОБАВЛЕНО: Отправляем медиа для предпросмотра
-    photos = data.get("photos", [])
-    video = data.get("video")
     video_note = data.get("video_note")
     table = data.get("table")
 
     # Отправляем медиагруппу (фото + видео)
-    if photos or video:
-        media_group = []
-        for photo_id in photos[:10]:
-            media_group.append(InputMediaPhoto(media=photo_id))
-        if video and len(media_group) < 10:
-            media_group.append(InputMediaVideo(media=video))
-
-        if media_group:
-            try:
-                await bot.send_media_group(user_id, media_group)
-            except Exception as e:
-                logger.error(f"Ошибка отправки медиа в предпросмотр: {e}")
+    if rendered["media"]:
+        try:
+            await bot.send_media_group(user_id, rendered["media"])
+        except Exception as e:
+            logger.error(f"Ошибка отправки медиа в предпросмотр: {e}")
 
     # Отправляем видеокружочек
     if video_note:
@@ -856,11 +636,7 @@ async def sell_category(callback_query: types.CallbackQuery, state: FSMContext):
             logger.error(f"Ошибка отправки таблицы в предпросмотр: {e}")
 
     # Отправляем текст с кнопками подтверждения
-    kb = InlineKeyboardMarkup()
-    kb.add(
-        InlineKeyboardButton("✅ Да, всё верно", callback_data="preview:confirm"),
-        InlineKeyboardButton("❌ Отменить", callback_data="preview:cancel")
-    )
+    kb = make_preview_keyboard()
 
     await bot.send_message(
         user_id,
@@ -873,13 +649,13 @@ async def sell_category(callback_query: types.CallbackQuery, state: FSMContext):
 
 # Обработка предпросмотра -> подтверждение размещения
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("preview:"), state=SellStates.SELL_PREVIEW)
-async def preview_actions(callback_query: types.CallbackQuery, state: FSMContext):
-    action = callback_query.data.split(":")[1]
+async def preview_actions(callback_query: types.CallbackQuery, state: FSMContext, arg: Optional[str]):
+    action = arg
     user_id = callback_query.from_user.id
 
     if action == "confirm":
         # переводим в состояние подтверждения посредничества
+        await state.update_data(preview_confirmed_at=time.time())
         await SellStates.SELL_AGENT_CONFIRM.set()
         await bot.send_message(
             user_id,
@@ -894,7 +670,6 @@ async def preview_actions(callback_query: types.CallbackQuery, state: FSMContext
 
 
 # Обработка согласия на агентство
-@dp.callback_query_handler(lambda c: c.data == "sell:agree_agent", state=SellStates.SELL_AGENT_CONFIRM)
 async def sell_agree_agent(callback_query: types.CallbackQuery, state: FSMContext):
     await state.update_data(with_agent=True)
     await SellStates.SELL_CONTACT_AGENT.set()
@@ -902,7 +677,6 @@ async def sell_agree_agent(callback_query: types.CallbackQuery, state: FSMContex
     await callback_query.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data == "sell:no_agent", state=SellStates.SELL_AGENT_CONFIRM)
 async def sell_no_agent(callback_query: types.CallbackQuery, state: FSMContext):
     await state.update_data(with_agent=False)
     await SellStates.SELL_CONTACT_AGENT.set()
@@ -911,13 +685,43 @@ async def sell_no_agent(callback_query: types.CallbackQuery, state: FSMContext):
 
 
 
+# Пользователь выбрал путь с приглашением друзей
+async def sell_will_invite(callback_query: types.CallbackQuery, state: FSMContext):
+    """
+    Объявление ждёт REFERRAL_THRESHOLD приглашённых: дальше его отправит на модерацию cmd_start
+    пригласившего, когда наберётся раунд (или сразу, если друзья пришли раньше).
+    """
+    user_id = callback_query.from_user.id
+    me = await bot.me
+    await state.update_data(
+        waiting_for_invites=True,
+        channel_link=f"https://t.me/{channel_username()}",
+        referral_link=f"https://t.me/{me.username}?start=ref_{user_id}",
+    )
+    if await complete_invites(user_id, state):
+        await callback_query.answer()
+        return
+
+    await bot.send_message(
+        user_id,
+        f"Пригласите {REFERRAL_THRESHOLD} друзей подписаться на канал — после этого объявление "
+        f"автоматически уйдёт на модерацию.",
+        reply_markup=make_agent_invite_keyboard()
+    )
+    await callback_query.answer()
+
+
 # Пользователь нажал "Скопировать" приглашение
-@dp.callback_query_handler(lambda c: c.data == "invite:copy", state=SellStates)
 async def invite_copy(callback_query: types.CallbackQuery, state: FSMContext):
     """
     Отправляет текст приглашения для удобного копирования.
     """
     data = await state.get_data()
+    # ✅ Друзья могли подписаться раньше, чем пользователь начал ждать приглашений
+    if data.get("waiting_for_invites") and await complete_invites(callback_query.from_user.id, state):
+        await callback_query.answer()
+        return
+
     channel_link = data.get("channel_link", "")
     referral_link = data.get("referral_link", "")
 
@@ -954,7 +758,6 @@ async def invite_copy(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer("✅ Ссылки отправлены! Скопируйте и отправьте 5 друзьям!", show_alert=False)
 
 # и после нужно запросить контакт (если не указан) и отправить в модерацию:
-@dp.message_handler(state=SellStates, content_types=types.ContentTypes.TEXT)
 async def generic_sell_text_handler(message: types.Message, state: FSMContext):
     """
     Обработчик любых текстовых сообщений в состоянии SellStates, если не попали в конкретный handler.
@@ -967,43 +770,35 @@ async def generic_sell_text_handler(message: types.Message, state: FSMContext):
     await message.reply("Пожалуйста, используйте интерфейс бота (кнопки) или дождитесь запроса. Если хотите сбросить данные — /reset.")
 
 # =======================
-# Функция отправки на модерацию (в MOD_CHAT_ID)
+# Функция отправки на модерацию (в чат модераторов)
 # =======================
 
 
 async def finalize_and_send_to_moderation(user_id: int, state: FSMContext, invited: bool = False):
     session = None
+    started_at = time.perf_counter()
     try:
         data = await state.get_data()
         local_id = uuid.uuid4()
+        rendered = get_rendered_listing(data, data.get("rendered_listing"))
+        data["rendered_listing"] = rendered
+
+        # ✅ Redis сразу, в БД — групповым коммитом в фоне
+        await submission_store.save({
+            'id': local_id,
+            'user_id': user_id,
+            'type': 'sell',
+            'data': data,
+            'invited': invited,
+            'rejected_all': data.get("rejected_all", False),
+            'status': 'pending'
+        })
+
+        await moderation_queue.add(local_id)
+        usage_stats.incr("submissions_sell")
 
-        await redis_client.redis_client.set(
-            f'submission_{local_id}',
-            json.dumps({
-                'user_id': user_id,
-                'type': 'sell',
-                'data': data,
-                'invited': invited,
-                'rejected_all': data.get("rejected_all", False),
-                'status': 'pending'
-            })
-        )
-
-        # ✅ СОХРАНЯЕМ В ПАМЯТИ (для быстрого доступа модератора)
-        await redis_client.redis_client.set(
-            f'pending_submissions_{local_id}',
-            json.dumps(
-                {
-                "user_id": user_id,
-                "data": data,
-                "invited": invited,
-                "type": "sell",
-                "status": "pending"
-                }
-            )
-        )
         # ✅ Формируем текст для модератора
-        preview_text = build_sell_preview(data)
+        preview_text = rendered["html"]
 
         # ✅ ДОБАВЛЯЕМ КОНТАКТ ПОЛЬЗОВАТЕЛЯ
         user_contact = data.get("contact", "Не указан")
@@ -1018,62 +813,70 @@ async def finalize_and_send_to_moderation(user_id: int, state: FSMContext, invit
         if data.get("rejected_all"):
             preview_text += "\n\n⚠️ <b>Пользователь отказался от посредничества и от приглашений.</b>"
 
-        # ✅ Отправляем медиа (если есть)
-        photos = data.get("photos", [])
-        video = data.get("video")
+        # ✅ Копия для модератора уходит в очередь чата модерации (порядок сохраняется),
+        # а пользователь получает подтверждение сразу, не дожидаясь загрузки медиа
         video_note = data.get("video_note")
+        table = data.get("table")
+        mod_steps = []
 
-        if photos or video:
-            media_group = []
-            for photo_id in photos[:10]:
-                media_group.append(InputMediaPhoto(media=photo_id))
-            if video and len(media_group) < 10:
-                media_group.append(InputMediaVideo(media=video))
-
-            if media_group:
+        if rendered["media"]:
+            async def send_media():
                 try:
-                    await bot.send_media_group(MOD_CHAT_ID, media_group)
+                    await bot.send_media_group(config.mod_chat_id, rendered["media"])
                     logger.info(f"✅ Медиа отправлено модератору для {local_id}")
                 except Exception as e:
                     logger.error(f"❌ Ошибка отправки медиа на модерацию: {e}")
+            mod_steps.append(send_media)
 
         if video_note:
-            try:
-                await bot.send_video_note(MOD_CHAT_ID, video_note)
-                logger.info(f"✅ Видеокружочек отправлен модератору для {local_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка отправки видеокружочка на модерацию: {e}")
-
-        # ✅ Отправляем текст с кнопками модерации
-        mod_kb = make_mod_inline(local_id)
-        try:
-            await bot.send_message(
-                MOD_CHAT_ID,
-                preview_text,
-                reply_markup=mod_kb,
-                parse_mode=ParseMode.HTML
-            )
-            logger.info(f"✅ Текст модерации отправлен для {local_id}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки текста модерации: {e}")
-            await bot.send_message(
-                user_id,
-                "❌ Ошибка при отправке на модерацию. Попробуйте позже."
-            )
-            return
+            async def send_video_note():
+                try:
+                    await bot.send_video_note(config.mod_chat_id, video_note)
+                    logger.info(f"✅ Видеокружочек отправлен модератору для {local_id}")
+                except Exception as e:
+                    logger.error(f"❌ Ошибка отправки видеокружочка на модерацию: {e}")
+            mod_steps.append(send_video_note)
 
-        # ✅ Отправляем таблицу (если есть)
-        table = data.get("table")
-        if table:
+        # ✅ Текст с кнопками модерации
+        async def send_mod_text():
             try:
-                await bot.send_document(
-                    MOD_CHAT_ID,
-                    table,
-                    caption="📊 Финансовая таблица"
+                await bot.send_message(
+                    config.mod_chat_id,
+                    preview_text,
+                    reply_markup=make_mod_inline(local_id),
+                    parse_mode=ParseMode.HTML
                 )
-                logger.info(f"✅ Таблица отправлена модератору для {local_id}")
+                logger.info(f"✅ Текст модерации отправлен для {local_id}")
+                return True
             except Exception as e:
-                logger.error(f"❌ Ошибка отправки таблицы на модерацию: {e}")
+                logger.error(f"❌ Ошибка отправки текста модерации: {e}")
+                try:
+                    await bot.send_message(
+                        user_id,
+                        "❌ Ошибка при отправке на модерацию. Попробуйте позже."
+                    )
+                except Exception as notify_error:
+                    logger.error(f"❌ Не удалось сообщить пользователю {user_id} об ошибке: {notify_error}")
+                return False
+        mod_steps.append(send_mod_text)
+
+        # ✅ Таблица (если есть)
+        if table:
+            async def send_table():
+                try:
+                    await bot.send_document(
+                        config.mod_chat_id,
+                        table,
+                        caption="📊 Финансовая таблица"
+                    )
+                    logger.info(f"✅ Таблица отправлена модератору для {local_id}")
+                except Exception as e:
+                    logger.error(f"❌ Ошибка отправки таблицы на модерацию: {e}")
+            mod_steps.append(send_table)
+
+        # Не ждём отправки, но и не теряем её результат
+        delivery = send_pipeline.submit(config.mod_chat_id, *mod_steps)
+        delivery.add_done_callback(lambda task: report_moderation_delivery(local_id, task))
 
         # ✅ Уведомляем пользователя
         await bot.send_message(
@@ -1083,11 +886,20 @@ async def finalize_and_send_to_moderation(user_id: int, state: FSMContext, invit
             f"ID объявления: <code>{local_id}</code>",
             parse_mode=ParseMode.HTML
         )
+        logger.info(
+            f"⏱ Объявление {local_id}: подтверждение пользователю через "
+            f"{(time.perf_counter() - started_at) * 1000:.1f} мс"
+        )
+        if data.get("preview_confirmed_at"):
+            logger.info(
+                f"⏱ Объявление {local_id}: от подтверждения предпросмотра до ответа "
+                f"{time.time() - data['preview_confirmed_at']:.2f} с"
+            )
 
         # ✅ Завершаем FSM
         await state.finish()
 
-        logger.info(f"✅ Объявление {local_id} от пользователя {user_id} успешно отправлено на модерацию")
+        logger.info(f"✅ Объявление {local_id} от пользователя {user_id} поставлено в очередь на модерацию")
 
     except Exception as e:
         logger.exception(f"❌ Критическая ошибка при отправке на модерацию: {e}")
@@ -1110,41 +922,11 @@ async def finalize_and_send_to_moderation(user_id: int, state: FSMContext, invit
 # BUY flow (покупка)
 # =======================
 
-# ✅ ПРАВИЛЬНО
-@dp.message_handler(state=BuyStates.BUY_BUDGET, content_types=types.ContentTypes.TEXT)
-async def buy_budget(message: types.Message, state: FSMContext):
-    await state.update_data(budget=message.text.strip())
-    await BuyStates.BUY_CITY.set()
-    await message.answer("В каком городе? (Напишите с большой буквы)")
-
-
-@dp.message_handler(state=BuyStates.BUY_CITY, content_types=types.ContentTypes.TEXT)
-async def buy_city(message: types.Message, state: FSMContext):
-    # ✅ ИСПРАВЛЕНО: убрана избыточная строка
-    await state.update_data(city=message.text.strip())
-    await BuyStates.BUY_CATEGORY.set()
-
-
-    kb = make_categories_keyboard(prefix="buycat")
-    kb.row(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
-
-    await message.answer(
-        "Какой вид деятельности рассматриваете? Выберите категорию:",
-        reply_markup=kb
-    )
-
-
-@dp.callback_query_handler(lambda c: c.data.startswith("buycat:"), state=BuyStates.BUY_CATEGORY)
-async def buy_category_handler(callback_query: types.CallbackQuery, state: FSMContext):
-    """Шаг 4: Получаем категорию, спрашиваем про опыт."""
-    cat_idx = callback_query.data.split(":")[1]
-    await state.update_data(category_idx=cat_idx)
-
-    await callback_query.message.edit_text("Есть ли у вас опыт в бизнесе? (Напишите Да/Нет или опишите опыт)")
-    await BuyStates.BUY_EXPERIENCE.set()
+async def buy_category_handler(callback_query: types.CallbackQuery, state: FSMContext, arg: Optional[str]):
+    """Шаг 3: Получаем категорию, спрашиваем про опыт."""
+    step = BUY_FLOW[BuyStates.BUY_CATEGORY.state]
+    await state.update_data({step.key: arg})
+    await ask_step(callback_query.from_user.id, next_step(step), state)
     await callback_query.answer()
 
 
@@ -1153,106 +935,117 @@ async def buy_category_handler(callback_query: types.CallbackQuery, state: FSMCo
 # =======================
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("mod:publish:"))
-async def mod_publish(callback_query: types.CallbackQuery):
+async def mod_publish(callback_query: types.CallbackQuery, arg: Optional[str]):
     """
     Обработчик кнопки публикации объявления модератором.
-    ✅ Обновляет статус в БД
-    ✅ Публикует в канал
-    ✅ Уведомляет пользователя
+    ✅ Атомарно переводит заявку pending → published
+    ✅ Сразу отвечает модератору — отправка в канал идёт по лимиту канала и может ждать минуты
+    ✅ Публикует в канал и уведомляет пользователя в фоне (publish_approved)
     """
-    session = None  # ✅ Явно инициализируем как None
+    local_id = arg
+    # ✅ Владелец аренды — это нажатие: второе нажатие того же модератора её не продлит
+    claim_owner = callback_query.id
+    if not local_id:
+        await callback_query.answer("❌ Ошибка: неверный формат данных")
+        return
+    # ✅ Двойное нажатие или второй модератор — сразу отказ, без повторной публикации
+    if not await submission_claims.claim(local_id, claim_owner, MOD_CLAIM_TTL):
+        await callback_query.answer("⏳ Заявка уже обрабатывается другим модератором.")
+        return
     try:
-        # Извлекаем local_id из callback_data
-        parts = callback_query.data.split(":")
-        if len(parts) < 3:
-            await callback_query.answer("❌ Ошибка: неверный формат данных")
-            return
-
-        local_id = parts[2]
-        # submission = pending_submissions.get(local_id)
-        submission = await redis_client.redis_client.get(f'pending_submissions_{local_id}')
-        if not submission:
+        submission_dict = await submission_store.get(local_id)
+        if not submission_dict or submission_dict["status"] != "pending":
             await callback_query.answer("❌ Заявка не найдена или уже обработана.")
             return
-        db_submission = await redis_client.redis_client.get(f'submission_{local_id}')
-
-        if not db_submission:
-            await callback_query.answer("❌ Заявка не найдена в БД")
+        # ✅ Заявки покупателей в канал не публикуются — статус не трогаем
+        if submission_dict["type"] == "buy":
+            await callback_query.answer("⚠️ Публикация заявок покупателей не поддерживается в общий канал.")
+            return
+        # ✅ Публикует только тот, кто атомарно перевёл заявку из pending
+        if not await submission_store.transition(local_id, "pending", "published"):
+            await callback_query.answer("❌ Заявка не найдена или уже обработана.")
             return
-        submission_dict = json.loads(db_submission)
         submission_dict['status'] = "published"
 
-        await redis_client.redis_client.set(
-            f'submission_{local_id}',
-            json.dumps(submission_dict)
-        )
+        # ✅ Дальше повторные нажатия отсекает статус: аренда и апдейт не держатся на время отправки в канал
+        task = asyncio.ensure_future(publish_approved(local_id, submission_dict, callback_query.from_user.id))
+        publish_tasks.add(task)
+        task.add_done_callback(publish_tasks.discard)
+        await callback_query.answer("⏳ Объявление поставлено в очередь на публикацию")
 
+    except Exception as e:
+        logger.exception(f"❌ Критическая ошибка при публикации {callback_query.data}: {e}")
+        try:
+            await callback_query.answer("❌ Произошла ошибка при публикации. Попробуйте позже.")
+        except Exception as answer_error:
+            logger.warning(f"Не удалось ответить модератору на {callback_query.data}: {answer_error}")
 
-        # ✅ Публикуем в канал
-        if submission_dict["type"] == "sell":
-            try:
-                await publish_sell(submission_dict)
-                logger.info(f"✅ Объявление {local_id} опубликовано в канал")
-            except Exception as pub_error:
-                logger.exception(f"❌ Ошибка публикации объявления {local_id}: {pub_error}")
-                await callback_query.answer("❌ Ошибка при публикации объявления")
-                return
+    finally:
+        await submission_claims.release(local_id, claim_owner)
 
-        elif submission_dict["type"] == "buy":
-            await callback_query.answer("⚠️ Публикация заявок покупателей не поддерживается в общий канал.")
-            return
 
-        # ✅ Уведомляем продавца/покупателя
-        user_id = submission_dict.get("user_id")
-        if user_id:
-            try:
-                await bot.send_message(
-                    user_id,
-                    "✅ Ваше объявление опубликовано!\n\n"
-                    "Спасибо за использование нашего сервиса. "
-                    "Ожидайте предложений от заинтересованных покупателей.",
-                    parse_mode=ParseMode.HTML
-                )
-                logger.info(f"✅ Уведомление отправлено пользователю {user_id}")
-            except Exception as msg_error:
-                logger.exception(f"⚠️ Не удалось отправить уведомление пользователю {user_id}: {msg_error}")
+async def publish_approved(local_id: str, submission_dict: dict, mod_id: int):
+    """
+    Фоновая часть публикации: канал, поиск и подбор, уведомление пользователя, очередь модерации.
+    Если пост в канал не удался — заявка возвращается в pending, модераторам уходит сообщение.
+    """
+    try:
+        await publish_sell(submission_dict)
+    except Exception as pub_error:
+        logger.exception(f"❌ Ошибка публикации объявления {local_id}: {pub_error}")
+        await submission_store.transition(local_id, "published", "pending")
+        try:
+            await bot.send_message(
+                config.mod_chat_id,
+                f"❌ Объявление <code>{local_id}</code> не опубликовано, попробуйте ещё раз.",
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as notify_error:
+            logger.error(f"❌ Не удалось сообщить модераторам об ошибке публикации {local_id}: {notify_error}")
+        return
 
-        # ✅ Удаляем из памяти (pending_submissions)
-        await redis_client.redis_client.delete(f'pending_submissions_{local_id}')
-        logger.info(f"✅ Заявка {local_id} удалена из очереди pending_submissions")
+    usage_stats.incr("published")
+    logger.info(f"✅ Объявление {local_id} опубликовано в канал")
+    try:
+        await index_listing(local_id, submission_dict)
+        await match_listing(local_id, submission_dict)
+    except Exception as e:
+        logger.exception(f"⚠️ Объявление {local_id} не добавлено в поиск/подбор: {e}")
 
-        # ✅ Уведомляем модератора
-        await callback_query.answer("✅ Объявление опубликовано успешно!")
-        logger.info(f"✅ Модератор {callback_query.from_user.id} опубликовал заявку {local_id}")
+    # ✅ Уведомляем продавца/покупателя
+    user_id = submission_dict.get("user_id")
+    if user_id:
+        try:
+            await bot.send_message(
+                user_id,
+                "✅ Ваше объявление опубликовано!\n\n"
+                "Спасибо за использование нашего сервиса. "
+                "Ожидайте предложений от заинтересованных покупателей.",
+                parse_mode=ParseMode.HTML
+            )
+            logger.info(f"✅ Уведомление отправлено пользователю {user_id}")
+        except Exception as msg_error:
+            logger.exception(f"⚠️ Не удалось отправить уведомление пользователю {user_id}: {msg_error}")
 
-    except ValueError as ve:
-        logger.exception(f"❌ Ошибка парсинга callback_data: {ve}")
-        await callback_query.answer("❌ Ошибка: неверный формат данных")
+    # ✅ Убираем из очереди модерации
+    await moderation_queue.set_status(local_id, "published")
+    logger.info(f"✅ Модератор {mod_id} опубликовал заявку {local_id}")
 
-    except Exception as e:
-        logger.exception(f"❌ Критическая ошибка при публикации {callback_query.data}: {e}")
-        await callback_query.answer("❌ Произошла ошибка при публикации. Попробуйте позже.")
 
-    finally:
-        # ✅ ВСЕГДА закрываем сессию (если она была открыта)
-        if session is not None:  # ✅ Проверяем, что session не None
-            try:
-                session.close()
-                logger.info("✅ Сессия БД закрыта")
-            except Exception as close_error:
-                logger.exception(f"❌ Ошибка при закрытии сессии БД: {close_error}")
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("mod:reject:"))
-async def mod_reject(callback_query: types.CallbackQuery):
+async def mod_reject(callback_query: types.CallbackQuery, arg: Optional[str]):
     try:
-        _, _, local_id = callback_query.data.split(":")
-        submission = await redis_client.redis_client.get(f'pending_submissions_{local_id}')
-        if not submission:
+        local_id = arg
+        mod_id = callback_query.from_user.id
+        # ✅ Аренда держится, пока модератор пишет причину (снимается в mod_reason_input)
+        if not await submission_claims.claim(local_id, mod_id, MOD_REJECT_CLAIM_TTL):
+            await callback_query.answer("⏳ Заявка уже обрабатывается другим модератором.")
+            return
+        if await submission_store.get_status(local_id) != "pending":
+            await submission_claims.release(local_id, mod_id)
             await callback_query.answer("Заявка не найдена или уже обработана.")
             return
 
-        mod_id = callback_query.from_user.id
-        await redis_client.redis_client.set(f'mod_rejection_state_{mod_id}', f'{local_id}')
+        await redis_client.set_rejection_target(mod_id, local_id)
         # mod_rejection_state[mod_id] = local_id
 
         # ✅ ИСПРАВЛЕНО: правильное получение FSMContext для модератора
@@ -1266,10 +1059,62 @@ async def mod_reject(callback_query: types.CallbackQuery):
         logger.exception("Ошибка при модерации reject: %s", e)
         await callback_query.answer("Ошибка при обработке отклонения.")
 
+# =======================
+# Очередь модерации: /queue
+# =======================
+
+async def render_queue_page(cursor: Optional[str] = None):
+    """Текст и клавиатура страницы очереди модерации"""
+    total = await moderation_queue.count()
+    items, next_cursor = await moderation_queue.page(cursor, QUEUE_PAGE_SIZE)
+    if not items:
+        return "📭 Очередь модерации пуста.", None
+
+    lines = [f"🗂 <b>Ожидают модерации:</b> {total}\n"]
+    # ✅ Вся страница — один pipeline к Redis, а не запрос на каждую заявку
+    submissions = await submission_store.get_many([submission_id for submission_id, _ in items], ("data",))
+    for submission_id, created_ts in items:
+        submission = submissions[submission_id]
+        title = escape_html(submission["data"].get("title", "")) if submission else "—"
+        created = datetime.fromtimestamp(created_ts).strftime("%d.%m %H:%M")
+        lines.append(f"• {created} — {title}\n<code>{submission_id}</code>")
+
+    kb = None
+    if next_cursor is not None:
+        kb = InlineKeyboardMarkup()
+        kb.add(InlineKeyboardButton("Далее ▶️", callback_data=f"queue:page:{next_cursor}"))
+    return "\n".join(lines), kb
+
+
+async def cmd_queue(message: types.Message):
+    text, kb = await render_queue_page()
+    await message.answer(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+
+
+async def queue_page(callback_query: types.CallbackQuery, arg: Optional[str]):
+    try:
+        text, kb = await render_queue_page(arg)
+    except ValueError:
+        await callback_query.answer("❌ Неверный курсор")
+        return
+    await callback_query.message.edit_text(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await callback_query.answer()
+
+
+# =======================
+# Статистика: /stats
+# =======================
+
+async def cmd_stats(message: types.Message):
+    # Свои ещё не сброшенные счётчики — сразу, чтобы сводка не отставала на интервал
+    await usage_stats.flush()
+    report = await usage_stats.report()
+    await message.answer(format_report(report), parse_mode=ParseMode.HTML)
+
+
 # Обработка причины отклонения от модератора
 
 
-@dp.message_handler(state=ModStates.MOD_REASON, content_types=types.ContentTypes.TEXT)
 async def mod_reason_input(message: types.Message, state: FSMContext):
     mod_id = message.from_user.id
     reason = message.text.strip()
@@ -1278,18 +1123,28 @@ async def mod_reason_input(message: types.Message, state: FSMContext):
     logger.info(f"[MOD_REASON] Модератор {mod_id} ввёл причину: {reason[:50]}...")
 
     # local_id = mod_rejection_state.get(mod_id)
-    local_id = await redis_client.redis_client.get(f'mod_rejection_state_{mod_id}')
+    local_id = await redis_client.get_rejection_target(mod_id)
     if not local_id:
         await message.answer("❌ Не найдена заявка для отклонения. Попробуйте снова.")
         await state.finish()
         return
 
-    submission = await redis_client.redis_client.get(f'pending_submissions{local_id}')
-    if not submission:
+    # ✅ Аренда могла истечь, пока модератор писал причину, и заявку взял другой
+    if not await submission_claims.claim(local_id, mod_id, MOD_CLAIM_TTL):
+        await message.answer("⏳ Заявка уже обрабатывается другим модератором.")
+        await state.finish()
+        await redis_client.clear_rejection_target(mod_id)
+        return
+
+    # ✅ Читаем только нужные поля заявки
+    submission = await submission_store.get(local_id, ("status", "user_id"))
+    # ✅ Статус меняется атомарно из pending — отклонение не выполнится дважды
+    if not submission or not await submission_store.transition(local_id, "pending", "rejected"):
         await message.answer("❌ Заявка уже обработана или не найдена.")
         await state.finish()
         # mod_rejection_state.pop(mod_id, None)
-        await redis_client.redis_client.delete(f'mod_rejection_state_{mod_id}', )
+        await redis_client.clear_rejection_target(mod_id)
+        await submission_claims.release(local_id, mod_id)
         return
 
     # ✅ Отправляем причину отклонения пользователю
@@ -1302,9 +1157,11 @@ async def mod_reason_input(message: types.Message, state: FSMContext):
     except Exception as e:
         logger.exception(f"Ошибка отправки причины отклонения пользователю {submission['user_id']}: {e}")
 
-    # ✅ Удаляем заявку из очереди
-    await redis_client.redis_client.delete(f'pending_submissions_{local_id}')
-    await redis_client.redis_client.delete(f'mod_rejection_state_{mod_id}')
+    # ✅ Убираем заявку из очереди
+    usage_stats.incr("rejected")
+    await moderation_queue.set_status(local_id, "rejected")
+    await redis_client.clear_rejection_target(mod_id)
+    await submission_claims.release(local_id, mod_id)
 
     # ✅ Уведомляем модератора
     await message.answer(f"✅ Заявка {local_id} отклонена. Причина отправлена пользователю.")
@@ -1312,26 +1169,6 @@ async def mod_reason_input(message: types.Message, state: FSMContext):
     # ✅ Завершаем FSM состояние модератора
     await state.finish()
 
-@dp.message_handler(state=BuyStates.BUY_EXPERIENCE)
-async def buy_experience_handler(message: types.Message, state: FSMContext):
-    """Получает опыт, сохраняет и запрашивает контакт."""
-    await state.update_data(experience=message.text)
-    await message.answer("Отлично! Теперь, пожалуйста, оставьте ваш контакт для связи (номер телефона или @username).")
-    await BuyStates.BUY_PHONE.set()
-
-
-
-@dp.message_handler(state=BuyStates.BUY_PHONE)
-async def buy_contact_handler(message: types.Message, state: FSMContext):
-    """Получает контакт и переходит к вопросу о времени связи."""
-    await state.update_data(contact=message.text)
-    await BuyStates.BUY_WHEN_CONTACT.set()
-    await message.answer(
-        "Когда лучше связаться?",
-        reply_markup=make_back_restart_keyboard()
-    )
-
-@dp.message_handler(state=BuyStates.BUY_WHEN_CONTACT)
 async def buy_when_contact_handler(message: types.Message, state: FSMContext):
     """Получает время для связи и завершает заявку."""
     await state.update_data(when_contact=message.text.strip())
@@ -1342,7 +1179,9 @@ async def buy_when_contact_handler(message: types.Message, state: FSMContext):
 
     # Отправляем на модерацию
     try:
-        await bot.send_message(MOD_CHAT_ID, preview_text, parse_mode=ParseMode.HTML)
+        await bot.send_message(config.mod_chat_id, preview_text, parse_mode=ParseMode.HTML)
+        usage_stats.incr("submissions_buy")
+        await match_buyer(message.from_user.id, user_data)
         await message.answer(
             "✅ Спасибо! Ваша заявка принята и отправлена на рассмотрение.\n\n"
             "Мы свяжемся с вами, как только появятся подходящие варианты.",
@@ -1358,159 +1197,417 @@ async def buy_when_contact_handler(message: types.Message, state: FSMContext):
     # Завершаем сценарий
     await state.finish()
 
-def build_sell_preview(data: Dict[str, Any]) -> str:
-    """Формирует текст предпросмотра объявления на продажу"""
-    title = escape_html(data.get("title", ""))
-    profit = format_number(data.get("profit", ""))
-    city = escape_html(data.get("city", ""))
-    price = format_number(data.get("price", ""))
-    category = CATEGORIES.get(data.get("category_idx", ""), "")
-
-    text = (
-        f"🔥 <b>{title}</b>\n\n"
-        f"💰 <b>Прибыль:</b> {profit} ₽/мес\n"
-        f"💵 <b>Цена:</b> {price} ₽\n"
-        f"📍 <b>Город:</b> {city}\n"
-        f"🏷 <b>Категория:</b> {category}\n"
-    )
-
-    # Дополнительные блоки с отступами
-    sections = []
-
-    if data.get("marketing"):
-        sections.append(f"📢 <b>Маркетинг</b>\n{escape_html(data.get('marketing'))}")
-
-    if data.get("employees"):
-        sections.append(f"👥 <b>Персонал</b>\n{escape_html(data.get('employees'))}")
-
-    if data.get("premises"):
-        sections.append(f"🏢 <b>Помещение</b>\n{escape_html(data.get('premises'))}")
-
-    if data.get("included"):
-        sections.append(f"✅ <b>В стоимость входит</b>\n{escape_html(data.get('included'))}")
-
-    if data.get("extra"):
-        sections.append(f"ℹ️ <b>Дополнительно</b>\n{escape_html(data.get('extra'))}")
-
-    # ✅ ДОБАВЛЯЕМ КОНТАКТ ДЛЯ СВЯЗИ
-    contact = data.get("contact", "")
-    with_agent = data.get("with_agent", False)
-
-    if with_agent:
-        # Если согласен на посредничество - показываем контакт агента
-        sections.append(f"📞 <b>Контакт для связи</b>\n{AGENT_CONTACT}")
-    elif contact:
-        # Если не согласен на посредничество - показываем контакт пользователя
-        sections.append(f"📞 <b>Контакт для связи</b>\n{escape_html(contact)}")
 
-    if sections:
-        text += "\n" + "─" * 25 + "\n\n"
-        text += "\n\n".join(sections)
-
-    # Хэштеги
-    text += "\n\n" + "─" * 25 + "\n"
-
-    city_tag = city.replace(" ", "")
-    text += f"#{city_tag} "
+def optional_step(name: str, step: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Шаг отправки, ошибка которого логируется и не обрывает следующие шаги того же чата"""
+    async def run():
+        try:
+            return await step()
+        except Exception as e:
+            logger.exception(f"❌ Шаг «{name}» не отправлен: {e}")
+    return run
+
+
+def report_moderation_delivery(local_id, task: asyncio.Task):
+    """Итог фоновой отправки заявки модераторам — в лог (пользователю ответили раньше)"""
+    if task.cancelled():
+        logger.error(f"❌ Отправка заявки {local_id} модераторам отменена")
+    elif task.exception() is not None:
+        logger.error(f"❌ Заявка {local_id} не доставлена модераторам: {task.exception()!r}")
+    elif any(result is False for result in task.result()):
+        logger.error(f"❌ Текст заявки {local_id} с кнопками не доставлен модераторам")
+    else:
+        logger.info(f"✅ Заявка {local_id} доставлена модераторам")
 
-    price_num = safe_int(data.get("price", "0"))
-    if price_num:
-        if price_num < 1_000_000:
-            text += "#до1млн "
-        elif price_num < 2_000_000:
-            text += "#до2млн "
-        elif price_num < 5_000_000:
-            text += "#до5млн "
-        elif price_num < 10_000_000:
-            text += "#до10млн "
-        else:
-            text += "#более10млн "
-
-    category_tag = category.replace(" ", "").replace("/", "")
-    text += f"#{category_tag}"
-
-    return text
-
-def build_buy_preview(data: Dict[str, Any]) -> str:
-    """Формирует текст заявки на покупку"""
-    budget = escape_html(data.get("budget", ""))
-    city = escape_html(data.get("city", ""))
-    category = CATEGORIES.get(data.get("category_idx", ""), "")
-    experience = escape_html(data.get("experience", ""))
-    contact = escape_html(data.get("contact", ""))
-    when_contact = escape_html(data.get("when_contact", ""))
-
-    text = (
-        f"<b>🔍 НОВАЯ ЗАЯВКА НА ПОКУПКУ</b>\n\n"
-        f"💰 <b>Бюджет:</b> {budget}\n"
-        f"📍 <b>Город:</b> {city}\n"
-        f"🏷️ <b>Категория:</b> {category}\n"
-        f"📚 <b>Опыт:</b> {experience}\n"
-        f"📞 <b>Контакт:</b> {contact}\n"
-        f"⏰ <b>Когда связаться:</b> {when_contact}\n"
-    )
 
-    return text
+def sent_once(local_id: str, name: str, step: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Шаг поста, который отмечается в Redis после отправки: повтор публикации его не продублирует"""
+    async def run():
+        result = await step()
+        await redis_client.mark_publish_step(local_id, name)
+        return result
+    return run
 
-# Найдите функцию publish_sell и замените её на:
 
 async def publish_sell(submission: dict):
     """
     Публикует объявление о продаже в канал.
+    Если обязательный текст не ушёл, публикация откатывается; повторная отправляет только то,
+    чего в канале ещё нет (отправленные шаги — в publish_steps_<id>).
     """
     try:
+        local_id = str(submission["id"])
         data = submission.get("data", {})
 
-        # Формируем текст для публикации
-        preview_text = build_sell_preview(data)
+        # Берём готовый рендер (перерендер — только если данные менялись, например правка модератора)
+        rendered = get_rendered_listing(data, data.get("rendered_listing"))
+        preview_text = rendered["html"]
 
         # Получаем медиа
-        photos = data.get("photos", [])
-        video = data.get("video")
         video_note = data.get("video_note")
         table = data.get("table")
 
-        # 1. Сначала отправляем медиагруппу (БЕЗ текста)
-        if photos or video:
-            media_group = []
-
-            # Добавляем фото (максимум 10)
-            for photo_id in photos[:10]:
-                media_group.append(InputMediaPhoto(media=photo_id))
+        steps = []
+        already_sent = await redis_client.get_publish_steps(local_id)
 
-            # Добавляем видео, если есть место
-            if video and len(media_group) < 10:
-                media_group.append(InputMediaVideo(media=video))
-
-            if media_group:
-                await bot.send_media_group(CHANNEL_ID, media_group)
+        # 1. Сначала отправляем медиагруппу (БЕЗ текста)
+        if rendered["media"] and "media" not in already_sent:
+            steps.append(optional_step("медиа", sent_once(
+                local_id, "media", lambda: bot.send_media_group(config.channel_id, rendered["media"]))))
 
         # 2. Отправляем видеокружочек (если есть)
-        if video_note:
-            await bot.send_video_note(CHANNEL_ID, video_note)
+        if video_note and "video_note" not in already_sent:
+            steps.append(optional_step("видеокружочек", sent_once(
+                local_id, "video_note", lambda: bot.send_video_note(config.channel_id, video_note))))
 
-        # 3. Отправляем текст объявления
-        await bot.send_message(
-            CHANNEL_ID,
+        # 3. Отправляем текст объявления — без него публикация не состоялась, ошибка уходит наверх
+        steps.append(lambda: bot.send_message(
+            config.channel_id,
             preview_text,
             parse_mode=ParseMode.HTML
-        )
+        ))
 
         # 4. Отправляем финансовую модель (если есть)
         if table:
-            await bot.send_document(
-                CHANNEL_ID,
+            steps.append(optional_step("финмодель", lambda: bot.send_document(
+                config.channel_id,
                 table,
                 caption="📊 Финансовая модель"
-            )
+            )))
+
+        # Публикации разных объявлений в канал не перемешиваются между собой
+        await send_pipeline.submit(config.channel_id, *steps)
+        await redis_client.clear_publish_steps(local_id)
 
-        logger.info(f"✅ Объявление опубликовано в канал {CHANNEL_ID}")
+        logger.info(f"✅ Объявление опубликовано в канал {config.channel_id}")
 
     except Exception as e:
         logger.exception(f"❌ Ошибка при публикации объявления: {e}")
         raise
 
+# =======================
+# Поиск объявлений (inline-режим)
+# =======================
+
+async def index_listing(local_id: str, submission: dict):
+    """Опубликованное объявление — в поисковый индекс"""
+    try:
+        data = submission.get("data", {})
+        rendered = get_rendered_listing(data, data.get("rendered_listing"))
+        await listing_search.add(local_id, data, rendered["html"])
+    except Exception as e:
+        logger.exception(f"❌ Не удалось добавить объявление {local_id} в поиск: {e}")
+
+
+async def inline_search(inline_query: types.InlineQuery):
+    """@bot кафе Новосибирск до 2млн — страница найденных объявлений"""
+    cards, next_offset = await listing_search.search(inline_query.query, offset=inline_query.offset)
+    await inline_query.answer(
+        build_inline_results(cards),
+        cache_time=60,
+        next_offset=next_offset or "",
+    )
+
+
+# =======================
+# Подбор покупателей и объявлений
+# =======================
+
+async def send_match(chat_id: int, text: str):
+    await bot.send_message(chat_id, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+
+
+async def match_listing(local_id: str, submission: dict):
+    """Опубликованное объявление — в индекс; ждущим покупателям и модераторам — уведомления"""
+    try:
+        data = submission.get("data", {})
+        buyers = await match_index.add_listing(local_id, data, user_id=submission.get("user_id"))
+    except Exception as e:
+        # Публикация уже прошла — подбор не должен её ломать
+        logger.exception(f"❌ Не удалось проиндексировать объявление {local_id}: {e}")
+        return
+    if not buyers:
+        return
+    usage_stats.incr("matches", len(buyers))
+    text = format_listing_for_buyer(data, channel_username())
+    for buyer in buyers:
+        match_notifier.notify(int(buyer["user_id"]), text)
+    match_notifier.notify(config.mod_chat_id, format_matches_for_moderators(data, buyers))
+    logger.info(f"🤝 Объявление {local_id}: подходящих покупателей {len(buyers)}")
+
+
+async def match_buyer(user_id: int, user_data: dict):
+    """Заявка покупателя — в индекс; подходящие опубликованные объявления — покупателю"""
+    try:
+        request_id, listings = await match_index.add_buyer(user_id, user_data)
+    except Exception as e:
+        logger.exception(f"❌ Не удалось проиндексировать заявку покупателя {user_id}: {e}")
+        return
+    if not listings:
+        return
+    usage_stats.incr("matches", len(listings))
+    match_notifier.notify(user_id, format_listings_for_buyer(listings, channel_username()))
+    logger.info(f"🤝 Заявка {request_id}: подходящих объявлений {len(listings)}")
+
+
+async def warm_up(dispatcher: Dispatcher):
+    """
+    Готовность: до первого апдейта проверяем Redis и прогреваем то, что иначе
+    запрашивалось бы на первых хендлерах (getMe, getChat канала)
+    """
+    global channel_info
+    started = time.perf_counter()
+    redis_health = await redis_client.health_check()
+    logger.info(f"Redis {redis_health['host']}: пул до {redis_health['max_connections']} соединений")
+    me = await dispatcher.bot.me
+    try:
+        channel_info = await dispatcher.bot.get_chat(config.channel_id)
+    except Exception as e:
+        # Канал не мешает принимать апдейты: проверка подписки сама сходит в API
+        logger.warning(f"Не удалось получить канал {config.channel_id}: {e}")
+    startup_timings["warm_up"] = time.perf_counter() - started
+    startup_timings["ready"] = time.perf_counter() - IMPORTED_AT
+    logger.info(
+        f"Бот @{me.username} готов за {startup_timings['ready'] * 1000:.0f} мс "
+        f"(сборка {startup_timings['build'] * 1000:.0f} мс, прогрев {startup_timings['warm_up'] * 1000:.0f} мс)"
+    )
+
+
+async def start_metrics():
+    global metrics_runner
+    if config.metrics_port:
+        metrics_runner = await start_metrics_server(config.metrics_host, config.metrics_port)
+        logger.info(f"Метрики: http://{config.metrics_host}:{config.metrics_port}/metrics")
+
+
+async def on_startup(dispatcher: Dispatcher):
+    await init_db(db_engine)
+    submission_store.start()
+    usage_stats.start()
+    match_notifier.start()
+    # Обходит keyspace один процесс: в режиме воркеров — первый
+    if config.key_sweep_interval and (config.bot_mode != "worker" or config.worker_index == 0):
+        key_sweeper.start()
+    await start_metrics()
+    await warm_up(dispatcher)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await key_sweeper.close()
+    if publish_tasks:
+        await asyncio.wait(list(publish_tasks))
+    await match_notifier.close()
+    await send_pipeline.join()
+    await submission_store.close()
+    await usage_stats.close()
+    await db_engine.dispose()
+    await redis_client.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+async def on_ingress_startup(dispatcher: Dispatcher):
+    await start_metrics()
+    await warm_up(dispatcher)
+
+
+async def on_ingress_shutdown(dispatcher: Dispatcher):
+    await redis_client.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+# =======================
+# Сборка приложения
+# =======================
+
+def register_handlers(dp: Dispatcher, callback_router: CallbackRouter):
+    """Регистрирует хендлеры; порядок message-хендлеров важен — первый подошедший забирает апдейт"""
+    dp.register_message_handler(cmd_start, commands=['start'])
+    dp.register_chat_member_handler(channel_member_updated)
+    dp.register_inline_handler(inline_search, state="*")
+    callback_router.register(nav_back_handler, "nav:back", state="*")
+    callback_router.register(nav_restart_handler, "nav:restart", state="*")
+    callback_router.register(sell_skip_current_handler, "sell:skip_current", state=SellStates)
+    callback_router.register(sell_skip_current_handler, "sell:skip_table", state=SellStates.SELL_TABLE)
+    callback_router.register(process_start_choice, "start")
+    callback_router.register(process_check_sub, "check_sub")
+    callback_router.register(info_ready, "info:ready")
+    dp.register_message_handler(flow_text_step, state=TEXT_STEP_STATES, content_types=types.ContentTypes.TEXT)
+    dp.register_message_handler(sell_table_file, state=SellStates.SELL_TABLE, content_types=types.ContentTypes.DOCUMENT)
+    dp.register_message_handler(sell_photos_handler, state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.PHOTO)
+    dp.register_message_handler(sell_video_handler, state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.VIDEO)
+    dp.register_message_handler(sell_video_note_handler, state=SellStates.SELL_PHOTOS, content_types=types.ContentTypes.VIDEO_NOTE)
+    callback_router.register(sell_photos_done, "sell:photos_done", state=SellStates.SELL_PHOTOS)
+    callback_router.register(sell_category, "cat", state=SellStates.SELL_CATEGORY)
+    callback_router.register(preview_actions, "preview", state=SellStates.SELL_PREVIEW)
+    callback_router.register(sell_agree_agent, "sell:agree_agent", state=SellStates.SELL_AGENT_CONFIRM)
+    callback_router.register(sell_no_agent, "sell:no_agent", state=SellStates.SELL_AGENT_CONFIRM)
+    callback_router.register(sell_will_invite, "agent:will_invite", "noagent:will_invite", state=SellStates)
+    callback_router.register(invite_copy, "invite:copy", state=SellStates)
+    dp.register_message_handler(generic_sell_text_handler, state=SellStates, content_types=types.ContentTypes.TEXT)
+    callback_router.register(buy_category_handler, "buycat", state=BuyStates.BUY_CATEGORY)
+    callback_router.register(mod_publish, "mod:publish")
+    callback_router.register(mod_reject, "mod:reject")
+    dp.register_message_handler(cmd_queue, commands=['queue'], chat_id=config.mod_chat_id, state="*")
+    callback_router.register(queue_page, "queue:page", state="*")
+    dp.register_message_handler(cmd_stats, commands=['stats'], chat_id=config.mod_chat_id, state="*")
+    dp.register_message_handler(mod_reason_input, state=ModStates.MOD_REASON, content_types=types.ContentTypes.TEXT)
+    dp.register_message_handler(buy_when_contact_handler, state=BuyStates.BUY_WHEN_CONTACT)
+
+
+def create_app(app_config: Optional[Config] = None) -> Dispatcher:
+    """
+    Собирает бота: Redis, хранилище FSM, диспетчер с middleware и хендлерами, БД заявок.
+    Соединения не открываются — это делают on_startup и первые запросы.
+    Повторный вызов возвращает уже собранный диспетчер.
+    """
+    global config, redis_client, bot, dp, callback_router, update_dedupe, send_pipeline, db_engine
+    global submission_store, moderation_queue, submission_claims, subscription_cache, album_collector, usage_stats
+    global match_index, match_notifier, listing_search, key_sweeper
+    if dp is not None:
+        return dp
+    started = time.perf_counter()
+    if app_config is None:
+        load_dotenv()
+        app_config = Config.from_env()
+    config = app_config
+    redis_client = RedisClient(config.redis)
+
+    # ✅ БОТ И ДИСПЕТЧЕР
+    # ✅ Все исходящие сообщения идут через планировщик с лимитами Telegram
+    bot_kwargs = {}
+    if config.telegram_api_url:
+        bot_kwargs["server"] = TelegramAPIServer.from_base(config.telegram_api_url)
+    bot = ScheduledBot(
+        token=config.token,
+        channel_ids=[config.channel_id],
+        moderation_ids=[config.mod_chat_id],
+        global_rate=config.bot_send_rate,
+        group_rate=config.bot_group_rate,
+        group_burst=config.bot_group_burst,
+        **bot_kwargs
+    )
+    # Кодек новых записей FSM и кэша заявок; старые читаются по своему заголовку
+    serializer = Serializer(config.serialization_codec)
+    if config.fsm_storage == "memory":
+        if config.bot_mode == "worker":
+            logger.error("BOT_MODE=worker с FSM_STORAGE=memory: состояние опроса не будет общим между воркерами")
+        storage = MemoryStorage()
+    else:
+        storage = RedisHashStorage(redis_client, draft_ttl=config.fsm_draft_ttl, serializer=serializer)
+    dp = Dispatcher(bot, storage=storage)
+    # ✅ Повторно доставленные апдейты (ретраи вебхука, стрим после падения воркера) не обрабатываются дважды
+    update_dedupe = UpdateDedupeMiddleware(redis_client.redis_client, window=config.update_dedupe_window)
+    dp.middleware.setup(update_dedupe)
+    # ✅ Время каждого хендлера и ошибки — в /metrics
+    dp.middleware.setup(MetricsMiddleware())
+    # ✅ Счётчики и уникальные пользователи копятся в памяти и сбрасываются в Redis пачкой
+    usage_stats = UsageStats(redis_client.redis_client, flush_interval=config.stats_flush_interval)
+    dp.middleware.setup(StatsMiddleware(usage_stats))
+    # ✅ callback_query разбирается один раз и уходит в хендлер через префиксное дерево
+    callback_router = CallbackRouter()
+    callback_router.install(dp)
+    send_pipeline = ChatPipeline()
+
+    # ✅ БД ЗАЯВОК (SQL + Redis как кэш с отложенной записью)
+    db_engine = create_engine(config.database_url)
+    submission_store = SubmissionStore(
+        create_session_factory(db_engine), redis=redis_client.raw_client, serializer=serializer
+    )
+    moderation_queue = ModerationQueue(redis_client.redis_client)
+    # ✅ Заявку публикует/отклоняет ровно один модератор
+    submission_claims = Claims(redis_client.redis_client)
+    # ✅ Индекс подбора: покупатели и объявления по (город, категория), цена/бюджет — score
+    match_index = MatchIndex(redis_client.redis_client)
+    match_notifier = MatchNotifier(send_match, rate=config.match_notify_rate)
+    # ✅ Обратный индекс для inline-поиска, результаты кэшируются по нормализованному запросу
+    listing_search = ListingSearch(redis_client.redis_client, cache_ttl=config.search_cache_ttl)
+    # ✅ TTL по схеме ключей и память по пространствам имён (в redis.conf — volatile-lru)
+    key_sweeper = KeySweeper(redis_client.redis_client, key_schema(
+        fsm_draft_ttl=config.fsm_draft_ttl,
+        update_dedupe_window=config.update_dedupe_window,
+        subscription_ttl=config.sub_cache_positive_ttl,
+        search_cache_ttl=config.search_cache_ttl,
+    ), interval=config.key_sweep_interval)
+
+    # ✅ КЭШ ПОДПИСОК
+    subscription_cache = init_subscription_cache(
+        config.channel_id,
+        redis=redis_client.redis_client,
+        positive_ttl=config.sub_cache_positive_ttl,
+        negative_ttl=config.sub_cache_negative_ttl,
+    )
+    # ✅ Фото альбома копятся по media_group_id и записываются одной пачкой
+    album_collector = AlbumCollector(sell_photos_commit, delay=config.album_debounce)
+
+    register_handlers(dp, callback_router)
+    REGISTRY.add_collector(lambda: {
+        **{f"subscription_cache_{name}": value for name, value in subscription_cache.stats.items()},
+        "subscription_cache_hit_ratio": subscription_cache.hit_ratio(),
+        **{f"callback_router_{name}": value for name, value in callback_router.stats.items()},
+        **{f"update_dedupe_{name}": value for name, value in update_dedupe.stats.items()},
+        **{f"submission_claims_{name}": value for name, value in submission_claims.stats.items()},
+        **{f"album_collector_{name}": value for name, value in album_collector.stats.items()},
+        **{f"match_index_{name}": value for name, value in match_index.stats.items()},
+        **{f"match_notifier_{name}": value for name, value in match_notifier.stats.items()},
+        "match_notifier_pending": match_notifier.pending(),
+        **{f"listing_search_{name}": value for name, value in listing_search.stats.items()},
+        **key_sweeper.metrics(),
+        **{f"bot_startup_{name}_seconds": value for name, value in startup_timings.items()},
+    })
+    startup_timings["build"] = time.perf_counter() - started
+    return dp
+
+
+def run_ingress():
+    """Только приём апдейтов: раскладывает их по стримам, хендлеры работают в воркерах"""
+    publisher = UpdatePublisher(redis_client.redis_client, config.update_partitions, config.update_stream_maxlen)
+    run_bot(
+        IngressDispatcher(bot, publisher),
+        mode=config.ingress_source,
+        webhook_host=config.webhook_host,
+        webhook_path=config.webhook_path,
+        secret_token=config.webhook_secret,
+        webapp_host=config.webapp_host,
+        webapp_port=config.webapp_port,
+        allowed_updates=list(config.allowed_updates),
+        on_startup=on_ingress_startup,
+        on_shutdown=on_ingress_shutdown,
+    )
+
+
+def run_shard_worker():
+    worker = ShardWorker(
+        dp,
+        redis_client.redis_client,
+        worker_partitions(config.worker_index, config.worker_count, config.update_partitions),
+        consumer=config.worker_name,
+    )
+    run_worker(worker, on_startup=on_startup, on_shutdown=on_shutdown)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    create_app()
+    if config.bot_mode == "ingress":
+        run_ingress()
+    elif config.bot_mode == "worker":
+        run_shard_worker()
+    else:
+        run_bot(
+            dp,
+            mode=config.bot_mode,
+            webhook_host=config.webhook_host,
+            webhook_path=config.webhook_path,
+            secret_token=config.webhook_secret,
+            webapp_host=config.webapp_host,
+            webapp_port=config.webapp_port,
+            allowed_updates=list(config.allowed_updates),
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+        )
+
+
 if __name__ == "__main__":
-    executor.start_polling(
-        dispatcher=dp,
-    )
\ No newline at end of file
+    main()
@@ -0,0 +1,106 @@
+"""
+Сборка альбомов: Telegram присылает альбом из N фото как N отдельных сообщений
+с общим media_group_id.
+
+AlbumCollector копит сообщения альбома, пока они идут с паузами меньше delay,
+и отдаёт их обработчику одной пачкой: одна запись в состояние и один ответ на альбом.
+Хендлер сообщения не ждёт конца альбома — иначе в воркере (см. sharding), где апдейты
+пользователя идут строго по очереди, остальные фото альбома до него бы не дошли.
+Пачки одного чата обрабатываются по очереди, чтобы два альбома подряд не затёрли друг друга.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import types
+
+from tg_bot.metrics import observe_handler
+
+logger = logging.getLogger(__name__)
+
+AlbumHandler = Callable[[List[types.Message]], Awaitable]
+
+
+class _Album:
+    __slots__ = ("messages", "touched")
+
+    def __init__(self, message: types.Message, now: float):
+        self.messages = [message]
+        self.touched = now
+
+
+class AlbumCollector:
+    def __init__(self, handler: AlbumHandler, delay: float = 0.5):
+        self.handler = handler
+        self.delay = delay
+        self._albums: Dict[Tuple[int, str], _Album] = {}
+        # Последняя запущенная пачка чата — следующая ждёт её завершения
+        self._tails: Dict[int, asyncio.Task] = {}
+        self.stats = {"albums": 0, "messages": 0}
+
+    async def add(self, message: types.Message):
+        """
+        Сообщение без media_group_id обрабатывается сразу (в очереди своего чата),
+        сообщение альбома — после паузы в delay секунд после последнего фото альбома.
+        """
+        self.stats["messages"] += 1
+        loop = asyncio.get_running_loop()
+        if not message.media_group_id:
+            await self._schedule(message.chat.id, self._single(message))
+            return
+
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.messages.append(message)
+            album.touched = loop.time()
+            return
+        self._albums[key] = _Album(message, loop.time())
+        self._schedule(message.chat.id, self._collect(key))
+
+    async def wait(self, chat_id: int):
+        """Дождаться, пока все начатые альбомы чата будут записаны"""
+        while True:
+            task = self._tails.get(chat_id)
+            if task is None or task.done():
+                return
+            await asyncio.wait([task])
+
+    def _schedule(self, chat_id: int, coro: Awaitable) -> asyncio.Task:
+        previous = self._tails.get(chat_id)
+        task = asyncio.ensure_future(self._run_after(previous, coro))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+        return task
+
+    def _forget(self, chat_id: int, task: asyncio.Task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    @staticmethod
+    async def _run_after(previous: Optional[asyncio.Task], coro: Awaitable):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await coro
+
+    async def _single(self, message: types.Message):
+        await observe_handler("album", self.handler, [message])
+
+    async def _collect(self, key: Tuple[int, str]):
+        loop = asyncio.get_running_loop()
+        album = self._albums[key]
+        try:
+            while True:
+                remaining = album.touched + self.delay - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+        finally:
+            del self._albums[key]
+        self.stats["albums"] += 1
+        messages = sorted(album.messages, key=lambda m: m.message_id)
+        try:
+            await observe_handler("album", self.handler, messages)
+        except Exception as e:
+            # Хендлер сообщения уже вернулся — ошибку больше некому поймать
+            logger.exception(f"Ошибка обработки альбома {key}: {e}")
@@ -0,0 +1,87 @@
+"""
+Накладные расходы хендлера на один шаг опроса без сетевых вызовов:
+найти предыдущий шаг («Назад») и выбрать вопрос с клавиатурой.
+
+Было: словарь переходов собирается заново на каждый вызов get_previous_state,
+вопрос ищется цепочкой if/elif по имени состояния (дальние шаги — десятки сравнений строк).
+Стало: одно обращение к таблице tg_bot.flows.STEPS.
+
+Запуск:
+    python -m tg_bot.benchmarks.flow_bench [кол-во итераций]
+"""
+import sys
+import timeit
+
+from tg_bot.flows import STEPS, get_step, prev_step
+from tg_bot.states import SellStates, BuyStates
+
+# Порядок if/elif в прежнем send_state_question
+OLD_QUESTION_ORDER = [
+    "SellStates:SELL_TITLE", "SellStates:SELL_PROFIT", "SellStates:SELL_MARKETING",
+    "SellStates:SELL_EMPLOYEES", "SellStates:SELL_PREMISES", "SellStates:SELL_INCLUDED",
+    "SellStates:SELL_EXTRA", "SellStates:SELL_TABLE", "SellStates:SELL_PHOTOS",
+    "SellStates:SELL_CITY", "SellStates:SELL_PRICE", "SellStates:SELL_CATEGORY",
+    "BuyStates:BUY_BUDGET", "BuyStates:BUY_CITY", "BuyStates:BUY_CATEGORY",
+    "BuyStates:BUY_EXPERIENCE", "BuyStates:BUY_PHONE", "BuyStates:BUY_WHEN_CONTACT",
+]
+
+
+def old_previous_state(current_state_name: str):
+    """Копия прежнего get_previous_state (без async)"""
+    if "SELL" in current_state_name:
+        states_map = {
+            "SellStates:SELL_PROFIT": SellStates.SELL_TITLE,
+            "SellStates:SELL_MARKETING": SellStates.SELL_PROFIT,
+            "SellStates:SELL_EMPLOYEES": SellStates.SELL_MARKETING,
+            "SellStates:SELL_PREMISES": SellStates.SELL_EMPLOYEES,
+            "SellStates:SELL_INCLUDED": SellStates.SELL_PREMISES,
+            "SellStates:SELL_EXTRA": SellStates.SELL_INCLUDED,
+            "SellStates:SELL_TABLE": SellStates.SELL_EXTRA,
+            "SellStates:SELL_PHOTOS": SellStates.SELL_TABLE,
+            "SellStates:SELL_CITY": SellStates.SELL_PHOTOS,
+            "SellStates:SELL_PRICE": SellStates.SELL_CITY,
+            "SellStates:SELL_CATEGORY": SellStates.SELL_PRICE,
+            "SellStates:SELL_ADDRESS": SellStates.SELL_CITY,
+        }
+    elif "BUY" in current_state_name:
+        states_map = {
+            "BuyStates:BUY_CITY": BuyStates.BUY_BUDGET,
+            "BuyStates:BUY_CATEGORY": BuyStates.BUY_CITY,
+            "BuyStates:BUY_EXPERIENCE": BuyStates.BUY_CATEGORY,
+            "BuyStates:BUY_PHONE": BuyStates.BUY_EXPERIENCE,
+            "BuyStates:BUY_WHEN_CONTACT": BuyStates.BUY_PHONE,
+        }
+    else:
+        return None
+    return states_map.get(current_state_name)
+
+
+def old_question(state_name: str):
+    """Цепочка сравнений, как в прежнем send_state_question"""
+    for name in OLD_QUESTION_ORDER:
+        if state_name == name:
+            return STEPS[name].render({"photos": []})
+    return None
+
+
+def old_step(state_name: str):
+    previous = old_previous_state(state_name)
+    return old_question(previous.state) if previous is not None else None
+
+
+def new_step(state_name: str):
+    previous = prev_step(get_step(state_name))
+    return previous.render({"photos": []}) if previous is not None else None
+
+
+def main(number: int):
+    names = [name for name in STEPS if STEPS[name].prev is not None]
+    print(f"{'шаг':<28} {'было':>10} {'стало':>10} {'ускорение':>10}")
+    for name in names:
+        old_us = timeit.timeit(lambda: old_step(name), number=number) / number * 1e6
+        new_us = timeit.timeit(lambda: new_step(name), number=number) / number * 1e6
+        print(f"{name:<28} {old_us:7.2f} мкс {new_us:7.2f} мкс {old_us / new_us:9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,64 @@
+"""
+Сравнение MemoryStorage и RedisHashStorage на полном проходе SellStates (16 шагов).
+
+Запуск (нужен локальный Redis):
+    python -m tg_bot.benchmarks.fsm_storage_bench [кол-во проходов]
+"""
+import asyncio
+import sys
+import time
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from tg_bot.fsm_storage import RedisHashStorage
+from tg_bot.redis_db import RedisClient
+from tg_bot.states import SellStates
+
+STEP_DATA = {
+    "SELL_TITLE": {"title": "Кофейня у метро"},
+    "SELL_PROFIT": {"profit": 250000},
+    "SELL_MARKETING": {"marketing": "Яндекс.Карты, 2ГИС, сарафан " * 5},
+    "SELL_EMPLOYEES": {"employees": "4 бариста, ФОТ 280 000, стаж от года"},
+    "SELL_PREMISES": {"premises": "Аренда 45 м², 90 000 в месяц, ремонт 2023"},
+    "SELL_INCLUDED": {"included": "Кофемашина, гриндеры, мебель, остатки " * 3},
+    "SELL_EXTRA": {"extra": "Продаю в связи с переездом " * 4},
+    "SELL_TABLE": {"table": "BQACAgIAAxkBAAIB" + "x" * 40, "table_name": "финмодель.xlsx"},
+    "SELL_PHOTOS": {"photos": ["AgACAgIAAxkBAAIC" + str(i) * 40 for i in range(10)]},
+    "SELL_CITY": {"city": "Новосибирск"},
+    "SELL_ADDRESS": {"address": "ул. Ленина, 1"},
+    "SELL_PRICE": {"price": "1250700"},
+    "SELL_CATEGORY": {"category_idx": "6"},
+    "SELL_AGENT_CONFIRM": {"with_agent": True},
+    "SELL_CONTACT_AGENT": {"contact": "@seller"},
+    "SELL_PREVIEW": {},
+}
+
+
+async def walk(storage, user_id: int):
+    """Один пользователь проходит все шаги так же, как это делают хендлеры"""
+    for state in SellStates.all_states:
+        name = state.state.split(":")[1]
+        await storage.get_state(chat=user_id, user=user_id)  # фильтр state= у хендлера
+        await storage.update_data(chat=user_id, user=user_id, data=STEP_DATA[name])
+        await storage.set_state(chat=user_id, user=user_id, state=state)
+    await storage.get_data(chat=user_id, user=user_id)
+    await storage.finish(chat=user_id, user=user_id)
+
+
+async def bench(name: str, storage, walks: int):
+    started = time.perf_counter()
+    await asyncio.gather(*(walk(storage, 10_000 + i) for i in range(walks)))
+    elapsed = time.perf_counter() - started
+    steps = walks * len(SellStates.all_states)
+    print(f"{name:<18} {walks} проходов, {elapsed * 1000:8.1f} мс, {elapsed / steps * 1e6:7.1f} мкс/шаг")
+
+
+async def main(walks: int):
+    await bench("MemoryStorage", MemoryStorage(), walks)
+    redis_client = RedisClient()
+    await bench("RedisHashStorage", RedisHashStorage(redis_client, draft_ttl=3600), walks)
+    await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,44 @@
+"""
+Стоимость клавиатуры на один шаг опроса: сборка InlineKeyboardMarkup + сериализация
+(как было) против готовой замороженной строки (как сейчас).
+
+Запуск:
+    python -m tg_bot.benchmarks.keyboards_bench [кол-во итераций]
+"""
+import sys
+import timeit
+
+from aiogram.utils.payload import prepare_arg
+
+from tg_bot.keyboards import markup
+
+CASES = {
+    "back_restart": (
+        lambda: prepare_arg(markup.build_back_restart_keyboard()),
+        lambda: prepare_arg(markup.make_back_restart_keyboard()),
+    ),
+    "categories+nav": (
+        lambda: prepare_arg(markup.build_categories_keyboard("cat", with_nav=True)),
+        lambda: prepare_arg(markup.make_categories_nav_keyboard("cat")),
+    ),
+    "done_back_restart": (
+        lambda: prepare_arg(markup.build_done_back_restart_keyboard("sell:photos_done")),
+        lambda: prepare_arg(markup.make_done_back_restart_keyboard("sell:photos_done")),
+    ),
+    "mod_inline(uuid)": (
+        lambda: prepare_arg(markup.build_mod_inline("0b8e5c2e-8f4e-4f7a-9d7b-2f5f3c1e9a10")),
+        lambda: prepare_arg(markup.make_mod_inline("0b8e5c2e-8f4e-4f7a-9d7b-2f5f3c1e9a10")),
+    ),
+}
+
+
+def main(number: int):
+    print(f"{'клавиатура':<20} {'сборка+JSON':>14} {'готовая':>10} {'ускорение':>10}")
+    for name, (build, cached) in CASES.items():
+        build_us = timeit.timeit(build, number=number) / number * 1e6
+        cached_us = timeit.timeit(cached, number=number) / number * 1e6
+        print(f"{name:<20} {build_us:11.2f} мкс {cached_us:7.2f} мкс {build_us / cached_us:9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,90 @@
+"""
+Задержка inline-поиска на 50k проиндексированных объявлений: холодный запрос (по индексу),
+повтор из кэша и листание страниц.
+
+Запуск (нужен локальный Redis, ключи search_* в нём будут перезаписаны):
+    python -m tg_bot.benchmarks.search_bench [кол-во объявлений]
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from tg_bot.constants import CATEGORIES
+from tg_bot.redis_db import RedisClient
+from tg_bot.search import ListingSearch, parse_query
+
+CITIES = ["Новосибирск", "Москва", "Санкт-Петербург", "Екатеринбург", "Казань", "Томск", "Барнаул", "Омск"]
+WORDS = ["кофейня", "кафе", "салон", "красоты", "пункт", "выдачи", "магазин", "цветов", "пекарня", "шиномонтаж",
+         "студия", "барбершоп", "автомойка", "склад", "производство", "мебели", "доставка", "суши", "аптека", "фитнес"]
+
+QUERIES = [
+    "кафе Новосибирск до 2млн",
+    "салон красоты",
+    "кофе",
+    "#бьюти #до5млн",
+    "пункт выдачи Москва",
+    "до 800к",
+    "пекарня Томск до 1 500 000",
+    "",
+]
+
+
+def make_listing(i: int) -> dict:
+    return {
+        "title": " ".join(random.sample(WORDS, 2)).capitalize() + f" №{i}",
+        "city": random.choice(CITIES),
+        "price": str(random.randrange(300_000, 15_000_000, 10_000)),
+        "category_idx": random.choice(list(CATEGORIES)),
+    }
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (
+        statistics.median(samples) * 1000,
+        samples[int(len(samples) * 0.95) - 1] * 1000,
+        samples[int(len(samples) * 0.99) - 1] * 1000,
+    )
+
+
+async def timed(coro) -> float:
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+async def main(total: int):
+    redis_client = RedisClient()
+    redis = redis_client.redis_client
+    async for key in redis.scan_iter(match="search_*", count=1000):
+        await redis.delete(key)
+    search = ListingSearch(redis)
+
+    started = time.perf_counter()
+    for i in range(total):
+        data = make_listing(i)
+        await search.add(f"bench-{i}", data, f"<b>{data['title']}</b>")
+    elapsed = time.perf_counter() - started
+    print(f"индексация:  {total} объявлений за {elapsed:.1f} с ({total / elapsed:,.0f}/с)\n")
+
+    print(f"{'запрос':<32} {'найдено':>8} {'холодный, мс':>13} {'кэш p50/p95/p99, мс':>24} {'стр. 2, мс':>11}")
+    for query in QUERIES:
+        # Холодный — первый запрос после изменения индекса (версия в ключе кэша меняется)
+        await redis.incr("search_version")
+        cold = await timed(search.search(query))
+        _, next_offset = await search.search(query)
+        warm = [await timed(search.search(query)) for _ in range(200)]
+        found = len(await search._query(*parse_query(query)))
+        page = await timed(search.search(query, offset=next_offset or ""))
+        p50, p95, p99 = percentiles(warm)
+        print(f"{query or '(пусто)':<32} {found:>8} {cold * 1000:>13.2f} "
+              f"{p50:>8.2f}/{p95:.2f}/{p99:.2f}{'':>6} {page * 1000:>11.2f}")
+
+    print(f"\n{search.stats}")
+    await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000))
@@ -0,0 +1,46 @@
+"""
+Размер и скорость кодеков на реалистичных черновиках продажи.
+Сравнивает json.dumps без заголовка (как было) с JSON- и msgpack-кодеками из serialization.
+
+Запуск:
+    python -m tg_bot.benchmarks.serialization_bench [кол-во итераций]
+"""
+import json
+import sys
+import timeit
+
+from tg_bot.benchmarks.fsm_storage_bench import STEP_DATA
+from tg_bot.serialization import CODECS, Serializer, msgpack
+
+# Полный черновик: все шаги + рендер объявления, как он лежит в заявке
+DRAFT = {}
+for step in STEP_DATA.values():
+    DRAFT.update(step)
+DRAFT["rendered_listing"] = {
+    "version": "3f1c2a9b0d4e5f67",
+    "html": "🔥 <b>Кофейня у метро</b>\n\n" + "Описание бизнеса " * 60,
+    "hashtags": "#Новосибирск #до2млн #Общепит",
+    "media": [{"type": "photo", "media": file_id} for file_id in DRAFT["photos"]],
+}
+
+
+def report(name: str, dumps, loads, number: int):
+    encoded = dumps(DRAFT)
+    encode_us = timeit.timeit(lambda: dumps(DRAFT), number=number) / number * 1e6
+    decode_us = timeit.timeit(lambda: loads(encoded), number=number) / number * 1e6
+    print(f"{name:<22} {len(encoded):8d} байт {encode_us:9.1f} мкс {decode_us:9.1f} мкс")
+
+
+def main(number: int):
+    print(f"{'кодек':<22} {'размер':>13} {'encode':>13} {'decode':>13}")
+    report("json.dumps (было)", lambda d: json.dumps(d).encode(), json.loads, number)
+    for name in CODECS:
+        if name == "msgpack" and msgpack is None:
+            print(f"{name:<22} не установлен")
+            continue
+        serializer = Serializer(name)
+        report(f"{name} + заголовок", serializer.encode, serializer.decode, number)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,103 @@
+"""
+Заявка в Redis: два JSON-блоба (submission_ + pending_submissions_, как было)
+против одного хэша с частичными записями (как сейчас).
+Считает память на заявку (MEMORY USAGE) и задержку действий модератора.
+
+Запуск (нужен локальный Redis, использует db 15 и очищает её):
+    python -m tg_bot.benchmarks.submission_record_bench [кол-во заявок]
+"""
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+from redis.asyncio import Redis
+
+from tg_bot.benchmarks.submissions_bench import DRAFT
+
+META = {"user_id": 123456789, "type": "sell", "invited": False, "rejected_all": False}
+
+
+async def old_layout(redis: Redis, ids):
+    for local_id in ids:
+        record = {**META, "data": DRAFT, "status": "pending"}
+        await redis.set(f"submission_{local_id}", json.dumps(record))
+        await redis.set(f"pending_submissions_{local_id}", json.dumps(record))
+
+
+async def old_publish(redis: Redis, local_id):
+    await redis.get(f"pending_submissions_{local_id}")
+    record = json.loads(await redis.get(f"submission_{local_id}"))
+    record["status"] = "published"
+    await redis.set(f"submission_{local_id}", json.dumps(record))
+    await redis.delete(f"pending_submissions_{local_id}")
+
+
+async def old_reject_check(redis: Redis, local_id):
+    return await redis.get(f"pending_submissions_{local_id}") is not None
+
+
+async def new_layout(redis: Redis, ids):
+    for local_id in ids:
+        await redis.hset(f"submission_{local_id}", mapping={
+            "user_id": META["user_id"], "type": "sell", "invited": 0, "rejected_all": 0,
+            "status": "pending", "created_at": "2026-01-01T00:00:00", "data": json.dumps(DRAFT),
+        })
+
+
+async def new_publish(redis: Redis, local_id):
+    status, data = await redis.hmget(f"submission_{local_id}", ["status", "data"])
+    json.loads(data)
+    await redis.hset(f"submission_{local_id}", "status", "published")
+
+
+async def new_reject_check(redis: Redis, local_id):
+    return await redis.hget(f"submission_{local_id}", "status") == "pending"
+
+
+async def memory_per_submission(redis: Redis, keys_of) -> float:
+    sample = [k for local_id in SAMPLE for k in keys_of(local_id)]
+    total = 0
+    for key in sample:
+        total += await redis.memory_usage(key) or 0
+    return total / len(SAMPLE)
+
+
+async def timed(action, redis, ids) -> float:
+    started = time.perf_counter()
+    for local_id in ids:
+        await action(redis, local_id)
+    return (time.perf_counter() - started) / len(ids) * 1e6
+
+
+SAMPLE = []
+
+
+async def main(total: int):
+    redis = Redis(db=15, decode_responses=True)
+    await redis.flushdb()
+    ids = [str(uuid.uuid4()) for _ in range(total)]
+    SAMPLE.extend(ids[:100])
+
+    await old_layout(redis, ids)
+    old_mem = await memory_per_submission(redis, lambda i: (f"submission_{i}", f"pending_submissions_{i}"))
+    old_check = await timed(old_reject_check, redis, ids)
+    old_pub = await timed(old_publish, redis, ids)
+    await redis.flushdb()
+
+    await new_layout(redis, ids)
+    new_mem = await memory_per_submission(redis, lambda i: (f"submission_{i}",))
+    new_check = await timed(new_reject_check, redis, ids)
+    new_pub = await timed(new_publish, redis, ids)
+    await redis.flushdb()
+    await redis.close()
+
+    print(f"{'':<24} {'два JSON':>12} {'один хэш':>12}")
+    print(f"{'память на заявку, байт':<24} {old_mem:12.0f} {new_mem:12.0f}")
+    print(f"{'проверка статуса, мкс':<24} {old_check:12.1f} {new_check:12.1f}")
+    print(f"{'публикация, мкс':<24} {old_pub:12.1f} {new_pub:12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
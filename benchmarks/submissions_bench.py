@@ -0,0 +1,82 @@
+"""
+Пропускная способность SubmissionStore на 100k заявок: групповые вставки и выборки по индексам.
+
+Запуск (SQLite во временном файле, Redis не нужен):
+    python -m tg_bot.benchmarks.submissions_bench [кол-во заявок]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from tg_bot.db import create_engine, create_session_factory, init_db
+from tg_bot.submissions import SubmissionStore
+
+DRAFT = {
+    "title": "Кофейня у метро",
+    "profit": 250000,
+    "marketing": "Яндекс.Карты, 2ГИС, сарафан",
+    "city": "Новосибирск",
+    "price": "1250700",
+    "category_idx": "6",
+    "photos": ["AgACAgIAAxkBAAIC" + str(i) * 40 for i in range(10)],
+}
+
+
+async def main(total: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite+aiosqlite:///{path}")
+    await init_db(engine)
+    store = SubmissionStore(create_session_factory(engine))
+    store.start()
+
+    ids = [str(uuid.uuid4()) for _ in range(total)]
+
+    started = time.perf_counter()
+    for i, submission_id in enumerate(ids):
+        await store.save({
+            "id": submission_id,
+            "user_id": 1000 + i % 5000,
+            "type": "sell",
+            "data": DRAFT,
+            "status": "pending",
+        })
+    await store.flush()
+    elapsed = time.perf_counter() - started
+    print(f"вставка:      {total} заявок за {elapsed:.2f} с ({total / elapsed:,.0f}/с)")
+
+    started = time.perf_counter()
+    for submission_id in random.sample(ids, 10000):
+        await store.update_status(submission_id, "published")
+    await store.flush()
+    elapsed = time.perf_counter() - started
+    print(f"статусы:      10000 обновлений за {elapsed:.2f} с ({10000 / elapsed:,.0f}/с)")
+
+    lookups = 5000
+    started = time.perf_counter()
+    for submission_id in random.sample(ids, lookups):
+        await store.get(submission_id)
+    elapsed = time.perf_counter() - started
+    print(f"по id:        {lookups} за {elapsed:.2f} с ({elapsed / lookups * 1e6:.0f} мкс/запрос)")
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        await store.list_by_status("pending", limit=20)
+    elapsed = time.perf_counter() - started
+    print(f"по статусу:   1000 страниц за {elapsed:.2f} с ({elapsed * 1000:.0f} мкс/страница)")
+
+    started = time.perf_counter()
+    for user_id in random.sample(range(1000, 6000), 1000):
+        await store.list_by_user(user_id)
+    elapsed = time.perf_counter() - started
+    print(f"по user_id:   1000 запросов за {elapsed:.2f} с ({elapsed * 1000:.0f} мкс/запрос)")
+
+    await store.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,139 @@
+"""
+Маршрутизация callback_query по callback_data вида prefix:action:arg.
+
+Вместо цепочки lambda-фильтров (по одному на хендлер) callback_data разбирается один раз
+и ищется в префиксном дереве: самый длинный зарегистрированный префикс выбирает хендлер,
+остаток строки передаётся ему аргументом arg. Ограничения state= работают как у
+dp.callback_query_handler: без state — только вне опроса, "*" — в любом состоянии.
+
+Маршрут выбирается в pre-process, а вызывается из зарегистрированного в диспетчере хендлера
+CallbackRouter.dispatch — поэтому process/post-process остальных middleware (метрики) отрабатывают как обычно.
+"""
+import inspect
+import logging
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from tg_bot.metrics import label_handler
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+
+
+def resolve_states(state) -> Optional[FrozenSet[Optional[str]]]:
+    """Множество имён состояний, в которых хендлер срабатывает (None — в любом)"""
+    if state == "*":
+        return None
+    items = state if isinstance(state, (list, tuple, set, frozenset)) else [state]
+    names = set()
+    for item in items:
+        if inspect.isclass(item) and issubclass(item, StatesGroup):
+            names.update(item.all_states_names)
+        elif isinstance(item, State):
+            names.add(item.state)
+        else:
+            names.add(item)
+    return frozenset(names)
+
+
+class Route:
+    __slots__ = ("handler", "states", "kwargs")
+
+    def __init__(self, handler: Callable, states: Optional[FrozenSet[Optional[str]]]):
+        self.handler = handler
+        self.states = states
+        # Какие из state/arg хендлер принимает — определяется один раз при регистрации
+        params = inspect.signature(handler).parameters
+        self.kwargs = tuple(name for name in ("state", "arg") if name in params)
+
+    def matches(self, current_state: Optional[str]) -> bool:
+        return self.states is None or current_state in self.states
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.routes: List[Route] = []
+
+
+class CallbackRouter(BaseMiddleware):
+    """
+    Middleware, которое выбирает хендлер callback_query, и хендлер диспетчера, который его вызывает.
+    Неизвестные callback_data считаются в stats["unknown"] и гасятся пустым answer().
+    """
+
+    DATA_KEY = "callback_route"
+
+    def __init__(self):
+        super().__init__()
+        self._root = _Node()
+        self.stats = {"dispatched": 0, "unknown": 0, "state_mismatch": 0}
+
+    def install(self, dp: Dispatcher):
+        """Подключает роутер к диспетчеру: middleware и хендлер для всех callback_query"""
+        dp.middleware.setup(self)
+        dp.register_callback_query_handler(self.dispatch, state="*")
+
+    def register(self, handler: Callable, *paths: str, state=None):
+        """router.register(mod_publish, "mod:publish", state="*") — по аналогии с dp.register_*_handler"""
+        states = resolve_states(state)
+        for path in paths:
+            node = self._root
+            for part in path.split(SEPARATOR):
+                node = node.children.setdefault(part, _Node())
+            node.routes.append(Route(handler, states))
+
+    def callback(self, *paths: str, state=None):
+        """Декоратор: @router.callback("mod:publish", state="*")"""
+        def decorator(handler: Callable):
+            self.register(handler, *paths, state=state)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[List[Route], Optional[str]]:
+        """Маршруты самого длинного совпавшего префикса и остаток callback_data"""
+        parts = data.split(SEPARATOR)
+        node = self._root
+        routes: List[Route] = []
+        depth = 0
+        for i, part in enumerate(parts):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.routes:
+                routes, depth = node.routes, i + 1
+        arg = SEPARATOR.join(parts[depth:]) if depth < len(parts) else None
+        return routes, arg
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: Dict[str, Any]):
+        routes, arg = self.resolve(callback_query.data or "")
+        if not routes:
+            self.stats["unknown"] += 1
+            logger.warning(f"Неизвестный callback_data: {callback_query.data!r}")
+            await callback_query.answer()
+            raise CancelHandler()
+
+        state = self.manager.dispatcher.current_state()
+        current_state = await state.get_state()
+        for route in routes:
+            if route.matches(current_state):
+                break
+        else:
+            # Кнопка из прошлого шага опроса — как и раньше, молча игнорируем
+            self.stats["state_mismatch"] += 1
+            raise CancelHandler()
+
+        data[self.DATA_KEY] = (route, {"state": state, "arg": arg})
+
+    async def dispatch(self, callback_query: types.CallbackQuery, callback_route: Tuple[Route, Dict[str, Any]]):
+        route, values = callback_route
+        self.stats["dispatched"] += 1
+        label_handler("callback_query", route.handler)
+        return await route.handler(callback_query, **{name: values[name] for name in route.kwargs})
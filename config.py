@@ -0,0 +1,141 @@
+"""
+Настройки бота из переменных окружения.
+
+Читаются один раз в Config.from_env() при сборке приложения (см. MainBot.create_app),
+а не при импорте модулей — чтобы бенчмарки и утилиты могли импортировать код бота без окружения.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from tg_bot.db import DEFAULT_DATABASE_URL
+from tg_bot.redis_db import RedisSettings
+
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} должен быть целым числом, получено {value!r}") from None
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} должен быть числом, получено {value!r}") from None
+
+
+@dataclass(frozen=True)
+class Config:
+    token: str
+    channel_id: int
+    mod_chat_id: int
+
+    bot_mode: str = "polling"  # polling, webhook, ingress или worker
+    webhook_host: Optional[str] = None  # публичный https-адрес, например https://bot.example.com
+    webhook_path: str = "/webhook"
+    webhook_secret: Optional[str] = None
+    webapp_host: str = "0.0.0.0"
+    webapp_port: int = 8080
+    telegram_api_url: Optional[str] = None  # свой Bot API сервер (например, локальный фейк для замеров)
+    send_global_rate: float = 30.0  # сообщений в секунду на бота
+    send_group_rate: float = 20 / 60  # сообщений в секунду в одну группу или канал
+    send_group_burst: float = 5  # всплеск сверх send_group_rate в одну группу или канал
+    allowed_updates: Tuple[str, ...] = ("message", "callback_query", "chat_member", "inline_query")
+
+    redis: RedisSettings = field(default_factory=RedisSettings)  # REDIS_HOST, REDIS_PORT, ... (см. RedisSettings)
+    fsm_storage: str = "redis"  # redis или memory
+    serialization_codec: str = "json"  # json или msgpack — для новых записей FSM и кэша заявок
+    database_url: str = DEFAULT_DATABASE_URL
+    fsm_draft_ttl: int = 3 * 24 * 3600  # сколько живёт брошенный черновик
+    sub_cache_positive_ttl: int = 600
+    sub_cache_negative_ttl: int = 30
+    update_dedupe_window: int = 24 * 3600  # сколько помним обработанные update_id
+    album_debounce: float = 0.5  # пауза, после которой альбом считается полученным
+    stats_flush_interval: float = 10.0  # как часто счётчики статистики уходят в Redis
+    match_notify_rate: float = 5.0  # уведомлений о совпадениях в секунду (внутри общего лимита бота)
+    search_cache_ttl: int = 300  # сколько живёт результат inline-поиска по одному запросу
+    key_sweep_interval: float = 3600  # обход ключей Redis (см. tg_bot.keyspace), 0 — не обходить
+
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9100  # 0 — не поднимать /metrics
+
+    # Шардирование (BOT_MODE=ingress/worker, см. tg_bot.sharding)
+    ingress_source: str = "polling"  # откуда ingress берёт апдейты: polling или webhook
+    update_partitions: int = 64  # стримов updates_stream_<N>, менять только вместе с очисткой
+    update_stream_maxlen: int = 100_000
+    worker_index: int = 0
+    worker_count: int = 1
+    worker_name: str = "worker-0"
+
+    @property
+    def send_share(self) -> float:
+        """Доля общих лимитов Telegram на этот процесс — воркеры делят их поровну"""
+        return 1 / self.worker_count if self.bot_mode == "worker" else 1.0
+
+    @property
+    def bot_send_rate(self) -> float:
+        """Лимит Telegram общий на бота"""
+        return self.send_global_rate * self.send_share
+
+    @property
+    def bot_group_rate(self) -> float:
+        """
+        Лимит на группу или канал. В канал и чат модераторов пишут все воркеры, поэтому он делится;
+        личный чат шардируется по user_id на один воркер, его лимит не делится.
+        """
+        return self.send_group_rate * self.send_share
+
+    @property
+    def bot_group_burst(self) -> float:
+        return max(1.0, self.send_group_burst * self.send_share)
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        missing = [name for name in ("BOT_TOKEN", "CHANNEL_ID", "MOD_CHAT_ID") if not os.getenv(name)]
+        if missing:
+            raise RuntimeError(f"Не заданы переменные окружения: {', '.join(missing)}")
+        worker_index = _env_int("WORKER_INDEX", 0)
+        return cls(
+            token=os.getenv("BOT_TOKEN"),
+            channel_id=_env_int("CHANNEL_ID"),
+            mod_chat_id=_env_int("MOD_CHAT_ID"),
+            bot_mode=os.getenv("BOT_MODE", "polling"),
+            webhook_host=os.getenv("WEBHOOK_HOST"),
+            webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            webhook_secret=os.getenv("WEBHOOK_SECRET"),
+            webapp_host=os.getenv("WEBAPP_HOST", "0.0.0.0"),
+            webapp_port=_env_int("WEBAPP_PORT", 8080),
+            telegram_api_url=os.getenv("TELEGRAM_API_URL"),
+            send_global_rate=_env_float("SEND_GLOBAL_RATE", 30.0),
+            send_group_rate=_env_float("SEND_GROUP_RATE", 20 / 60),
+            send_group_burst=_env_float("SEND_GROUP_BURST", 5),
+            redis=RedisSettings.from_env(),
+            fsm_storage=os.getenv("FSM_STORAGE", "redis"),
+            serialization_codec=os.getenv("SERIALIZATION_CODEC", "json"),
+            database_url=os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL),
+            fsm_draft_ttl=_env_int("FSM_DRAFT_TTL", 3 * 24 * 3600),
+            sub_cache_positive_ttl=_env_int("SUB_CACHE_POSITIVE_TTL", 600),
+            sub_cache_negative_ttl=_env_int("SUB_CACHE_NEGATIVE_TTL", 30),
+            update_dedupe_window=_env_int("UPDATE_DEDUPE_WINDOW", 24 * 3600),
+            album_debounce=_env_float("ALBUM_DEBOUNCE", 0.5),
+            stats_flush_interval=_env_float("STATS_FLUSH_INTERVAL", 10.0),
+            match_notify_rate=_env_float("MATCH_NOTIFY_RATE", 5.0),
+            search_cache_ttl=_env_int("SEARCH_CACHE_TTL", 300),
+            key_sweep_interval=_env_float("KEY_SWEEP_INTERVAL", 3600),
+            metrics_host=os.getenv("METRICS_HOST", "0.0.0.0"),
+            metrics_port=_env_int("METRICS_PORT", 9100),
+            ingress_source=os.getenv("INGRESS_SOURCE", "polling"),
+            update_partitions=_env_int("UPDATE_PARTITIONS", 64),
+            update_stream_maxlen=_env_int("UPDATE_STREAM_MAXLEN", 100_000),
+            worker_index=worker_index,
+            worker_count=_env_int("WORKER_COUNT", 1),
+            worker_name=os.getenv("WORKER_NAME", f"worker-{worker_index}"),
+        )
@@ -7,4 +7,8 @@ CATEGORIES = {
     "6": "Общепит",
     "7": "Опт",
     "8": "IT",
-}
\ No newline at end of file
+}
+
+AGENT_CONTACT = "@Ultanovr"
+
+MAX_PHOTOS = 10
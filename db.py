@@ -0,0 +1,35 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///submissions.db"  # бот берёт адрес из Config.database_url
+
+Base = declarative_base()
+
+
+def create_engine(url: str = DEFAULT_DATABASE_URL) -> AsyncEngine:
+    """Создаёт async-движок. Для SQLite включает WAL, чтобы чтения не ждали групповых коммитов"""
+    engine = create_async_engine(url)
+
+    if url.startswith("sqlite"):
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    return engine
+
+
+def create_session_factory(engine: AsyncEngine) -> async_sessionmaker:
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def init_db(engine: AsyncEngine):
+    """Создаёт таблицы и индексы, если их ещё нет"""
+    # Импорт регистрирует модели в Base.metadata
+    from tg_bot import models  # noqa: F401
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
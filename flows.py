@@ -0,0 +1,179 @@
+"""
+Опросы продажи и покупки в виде таблицы шагов.
+
+Каждый шаг описан один раз: вопрос, клавиатура, ключ в данных FSM, проверка ввода,
+значение при «Пропустить». Порядок шагов задаёт переходы вперёд/назад; таблица
+строится при импорте, и хендлеры находят шаг по имени состояния одним обращением к dict.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram.dispatcher.filters.state import State
+
+from tg_bot.constants import MAX_PHOTOS
+from tg_bot.keyboards.markup import (
+    make_back_restart_keyboard,
+    make_categories_nav_keyboard,
+    make_done_back_restart_keyboard,
+    make_restart_only_keyboard,
+    make_skip_back_restart_keyboard,
+    make_skip_table_keyboard,
+)
+from tg_bot.states import SellStates, BuyStates
+from tg_bot.utils import safe_int
+
+TEXT = "text"
+DOCUMENT = "document"
+MEDIA = "media"
+CHOICE = "choice"
+
+# Значение skip_value по умолчанию: шаг нельзя пропустить
+NO_SKIP = object()
+
+
+class InvalidInput(ValueError):
+    """Ввод не прошёл проверку шага; текст исключения отправляется пользователю"""
+
+
+def int_value(error: str) -> Callable[[str], int]:
+    def validate(text: str) -> int:
+        if safe_int(text) is None:
+            raise InvalidInput(error)
+        return int(text)
+    return validate
+
+
+def int_string(error: str) -> Callable[[str], str]:
+    """Проверяет, что введено целое число, но сохраняет строку как есть"""
+    def validate(text: str) -> str:
+        if safe_int(text) is None:
+            raise InvalidInput(error)
+        return text
+    return validate
+
+
+@dataclass
+class Step:
+    state: State
+    prompt: Union[str, Callable[[Dict[str, Any]], str]]
+    keyboard: Optional[str] = None
+    key: Optional[str] = None
+    kind: str = TEXT
+    validator: Optional[Callable[[str], Any]] = None
+    skip_value: Any = NO_SKIP
+    next: Optional[State] = None
+    prev: Optional[State] = None
+
+    @property
+    def name(self) -> str:
+        return self.state.state
+
+    @property
+    def skippable(self) -> bool:
+        return self.skip_value is not NO_SKIP
+
+    @property
+    def needs_data(self) -> bool:
+        """Вопрос зависит от уже введённых данных (например, счётчик фото)"""
+        return callable(self.prompt)
+
+    def render(self, data: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[str]]:
+        text = self.prompt(data or {}) if callable(self.prompt) else self.prompt
+        return text, self.keyboard
+
+    def parse(self, text: str) -> Any:
+        """Значение для сохранения; InvalidInput, если ввод не подходит"""
+        text = text.strip()
+        return self.validator(text) if self.validator else text
+
+
+def build_flow(steps: List[Step]) -> Dict[str, Step]:
+    """Связывает шаги по порядку (если next/prev не заданы явно) и индексирует их по имени состояния"""
+    for i, step in enumerate(steps):
+        if step.prev is None and i > 0:
+            step.prev = steps[i - 1].state
+        if step.next is None and i + 1 < len(steps):
+            step.next = steps[i + 1].state
+    return {step.name: step for step in steps}
+
+
+def _photos_prompt(data: Dict[str, Any]) -> str:
+    return (
+        f"Прикрепите фото (до {MAX_PHOTOS}) и/или видео без круглишков ТГ. "
+        f"Загружено фото: {len(data.get('photos', []))}/{MAX_PHOTOS}\n\n"
+        "После загрузки нажмите 'Готово'."
+    )
+
+
+SELL_FLOW = build_flow([
+    Step(SellStates.SELL_TITLE, "Тогда начнём с названия объявления:",
+         make_restart_only_keyboard(), key="title"),
+    Step(SellStates.SELL_PROFIT, "Какая чистая прибыль? (Должна совпадать с таблицей)",
+         make_back_restart_keyboard(), key="profit",
+         validator=int_value("Пожалуйста, укажите целое число — пример: 150000")),
+    Step(SellStates.SELL_MARKETING,
+         "Расскажите, как привлекаете клиентов (активные источники привлечения клиентов):",
+         make_skip_back_restart_keyboard(), key="marketing", skip_value=""),
+    Step(SellStates.SELL_EMPLOYEES,
+         "Заполните информацию про сотрудников (количество, ФОТ, стаж, должности):",
+         make_back_restart_keyboard(), key="employees"),
+    Step(SellStates.SELL_PREMISES,
+         "Информация о помещении ((суб)аренда/собственность, площадь,коммунальные, ремонт и т.д.):",
+         make_back_restart_keyboard(), key="premises"),
+    Step(SellStates.SELL_INCLUDED,
+         "Что входит в стоимость бизнеса? (Материальное и не материальное, обеспечительный платеж, "
+         "товарные остатки, ваше сопровождение и т.д.)",
+         make_back_restart_keyboard(), key="included"),
+    Step(SellStates.SELL_EXTRA,
+         "Дополнительная информация (история бизнеса, причина продажи, доп. инвестиции):",
+         make_skip_back_restart_keyboard(), key="extra", skip_value=""),
+    Step(SellStates.SELL_TABLE,
+         "Прикрепите таблицу доходности (файл) или нажмите 'Пропустить'(не рекомендуется).",
+         make_skip_table_keyboard(), key="table", kind=DOCUMENT, skip_value=None),
+    Step(SellStates.SELL_PHOTOS, _photos_prompt,
+         make_done_back_restart_keyboard("sell:photos_done"), key="photos", kind=MEDIA),
+    Step(SellStates.SELL_CITY, "Напишите город с большой буквы (например: Новосибирск):",
+         make_back_restart_keyboard(), key="city"),
+    Step(SellStates.SELL_ADDRESS, "Укажите адрес бизнеса:",
+         make_back_restart_keyboard(), key="address"),
+    Step(SellStates.SELL_PRICE, "Укажите стоимость бизнеса целым числом (например: 1250700):",
+         make_back_restart_keyboard(), key="price",
+         validator=int_string("Пожалуйста, укажите целое число — пример: 1250700")),
+    # Дальше — предпросмотр и посредничество, у них свои хендлеры
+    Step(SellStates.SELL_CATEGORY, "Выберите категорию:",
+         make_categories_nav_keyboard(), key="category_idx", kind=CHOICE),
+])
+
+BUY_FLOW = build_flow([
+    Step(BuyStates.BUY_BUDGET, "Отлично! Какой у вас бюджет?",
+         make_restart_only_keyboard(), key="budget"),
+    Step(BuyStates.BUY_CITY, "В каком городе? (Напишите с большой буквы)",
+         make_back_restart_keyboard(), key="city"),
+    Step(BuyStates.BUY_CATEGORY, "Какой вид деятельности рассматриваете? Выберите категорию:",
+         make_categories_nav_keyboard(prefix="buycat"), key="category_idx", kind=CHOICE),
+    Step(BuyStates.BUY_EXPERIENCE, "Есть ли у вас опыт в бизнесе? (Напишите Да/Нет или опишите опыт)",
+         make_back_restart_keyboard(), key="experience"),
+    Step(BuyStates.BUY_PHONE,
+         "Отлично! Теперь, пожалуйста, оставьте ваш контакт для связи (номер телефона или @username).",
+         make_back_restart_keyboard(), key="contact"),
+    # Последний шаг завершает заявку — его обрабатывает buy_when_contact_handler
+    Step(BuyStates.BUY_WHEN_CONTACT, "Когда лучше связаться?",
+         make_back_restart_keyboard(), key="when_contact"),
+])
+
+STEPS: Dict[str, Step] = {**SELL_FLOW, **BUY_FLOW}
+
+# Текстовые шаги, у которых есть следующий шаг: их обслуживает один общий хендлер
+TEXT_STEP_STATES = [step.state for step in STEPS.values() if step.kind == TEXT and step.next is not None]
+
+
+def get_step(state_name: Optional[str]) -> Optional[Step]:
+    return STEPS.get(state_name) if state_name else None
+
+
+def next_step(step: Optional[Step]) -> Optional[Step]:
+    return STEPS.get(step.next.state) if step and step.next else None
+
+
+def prev_step(step: Optional[Step]) -> Optional[Step]:
+    return STEPS.get(step.prev.state) if step and step.prev else None
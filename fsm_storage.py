@@ -0,0 +1,112 @@
+from typing import Any, Dict, Optional
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from tg_bot.redis_db import RedisClient
+from tg_bot.serialization import Serializer, default_serializer
+
+STATE_FIELD = b"state"
+DATA_PREFIX = b"data:"
+
+# Заменяет все поля data:* в хэше одной атомарной операцией, не трогая state
+SET_DATA_SCRIPT = """
+local fields = redis.call('HKEYS', KEYS[1])
+for _, f in ipairs(fields) do
+    if string.sub(f, 1, 5) == 'data:' then
+        redis.call('HDEL', KEYS[1], f)
+    end
+end
+if #ARGV > 1 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+class RedisHashStorage(BaseStorage):
+    """
+    FSM-хранилище в Redis: один хэш на пользователя.
+    Поле state — текущее состояние, поля data:<ключ> — значения данных (через Serializer).
+    update_data пишет только изменённые поля одним pipeline, без чтения всего словаря.
+    Каждая запись продлевает TTL черновика (draft_ttl, 0 — без срока).
+    """
+
+    def __init__(self, redis_client: RedisClient, draft_ttl: int = 0, prefix: str = "fsm",
+                 serializer: Serializer = default_serializer):
+        self.redis = redis_client.raw_client
+        self.serializer = serializer
+        self.draft_ttl = draft_ttl
+        self.prefix = prefix
+        self._set_data_script = self.redis.register_script(SET_DATA_SCRIPT)
+
+    def _key(self, chat, user) -> str:
+        chat, user = self.check_address(chat=chat, user=user)
+        return f"{self.prefix}_{chat}_{user}"
+
+    def _encode_fields(self, data: Dict[str, Any]) -> Dict[bytes, bytes]:
+        return {DATA_PREFIX + k.encode(): self.serializer.encode(v) for k, v in data.items()}
+
+    def _decode_fields(self, raw: Dict[bytes, bytes]) -> Dict[str, Any]:
+        return {
+            k[len(DATA_PREFIX):].decode(): self.serializer.decode(v)
+            for k, v in raw.items()
+            if k.startswith(DATA_PREFIX)
+        }
+
+    async def close(self):
+        # Соединением владеет RedisClient
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default: Optional[str] = None) -> Optional[str]:
+        state = await self.redis.hget(self._key(chat, user), STATE_FIELD)
+        return state.decode() if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default: Optional[Dict] = None) -> Dict:
+        raw = await self.redis.hgetall(self._key(chat, user))
+        data = self._decode_fields(raw)
+        if not data and default:
+            return dict(default)
+        return data
+
+    async def set_state(self, *, chat=None, user=None, state: Optional[str] = None):
+        key = self._key(chat, user)
+        state = self.resolve_state(state)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if state is None:
+                pipe.hdel(key, STATE_FIELD)
+            else:
+                pipe.hset(key, STATE_FIELD, state)
+                if self.draft_ttl:
+                    pipe.expire(key, self.draft_ttl)
+            await pipe.execute()
+
+    async def set_data(self, *, chat=None, user=None, data: Dict = None):
+        args = [self.draft_ttl]
+        for field, value in self._encode_fields(data or {}).items():
+            args.extend((field, value))
+        await self._set_data_script(keys=[self._key(chat, user)], args=args)
+
+    async def update_data(self, *, chat=None, user=None, data: Dict = None, **kwargs):
+        changes = dict(data or {})
+        changes.update(kwargs)
+        if not changes:
+            return
+        key = self._key(chat, user)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=self._encode_fields(changes))
+            if self.draft_ttl:
+                pipe.expire(key, self.draft_ttl)
+            await pipe.execute()
+
+    async def reset_state(self, *, chat=None, user=None, with_data: Optional[bool] = True):
+        key = self._key(chat, user)
+        if with_data:
+            await self.redis.delete(key)
+        else:
+            await self.redis.hdel(key, STATE_FIELD)
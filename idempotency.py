@@ -0,0 +1,102 @@
+"""
+Идемпотентность: повторные апдейты и одновременные действия модераторов.
+
+UpdateDedupeMiddleware отбрасывает апдейт, update_id которого уже обработан
+(ретраи вебхука, повторная доставка из стрима после падения воркера).
+Claims — атомарная аренда объекта (SET NX + срок жизни): действие над заявкой
+выполняет только тот, кто взял аренду, остальные сразу получают отказ.
+"""
+import logging
+from typing import Any, Dict
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = "processing"
+DONE = "done"
+
+# Удаляет аренду, только если она всё ещё наша
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def update_key(update_id: int) -> str:
+    return f"update_seen_{update_id}"
+
+
+class UpdateInProgress(Exception):
+    """Апдейт прямо сейчас обрабатывается в другом месте — подтверждать его рано"""
+
+
+class UpdateDedupeMiddleware(BaseMiddleware):
+    """
+    Окно дедупликации по update_id.
+    Перед обработкой ставится аренда update_seen_<id>=processing на lease_ttl секунд
+    (SET NX EX), после обработки — done на window секунд.
+    Уже обработанный апдейт молча отбрасывается. Апдейт, который ещё обрабатывается,
+    поднимает UpdateInProgress: воркер не подтверждает его и заберёт позже, если
+    первый обработчик упал и аренда истекла.
+    """
+
+    def __init__(self, redis, window: int = 24 * 3600, lease_ttl: int = 30):
+        super().__init__()
+        self.redis = redis
+        self.window = window
+        self.lease_ttl = lease_ttl
+        self.stats = {"duplicates": 0, "in_progress": 0}
+
+    async def on_pre_process_update(self, update: types.Update, data: Dict[str, Any]):
+        key = update_key(update.update_id)
+        if await self.redis.set(key, PROCESSING, nx=True, ex=self.lease_ttl):
+            return
+        if await self.redis.get(key) == DONE:
+            self.stats["duplicates"] += 1
+            logger.info(f"Повторный апдейт {update.update_id} пропущен")
+            raise CancelHandler()
+        self.stats["in_progress"] += 1
+        raise UpdateInProgress(update.update_id)
+
+    async def on_post_process_update(self, update: types.Update, results, data: Dict[str, Any]):
+        # И после исключения в хендлере: повтор не должен выполнять его побочные эффекты ещё раз
+        await self.redis.set(update_key(update.update_id), DONE, ex=self.window)
+
+
+class Claims:
+    """
+    Аренда объектов: submission_claim_<id> = владелец, с истечением.
+    Владелец может продлить свою аренду повторным claim; чужую — только дождаться её
+    освобождения или истечения (если держатель упал).
+    Владелец — токен попытки, а не модератор: для одного нажатия — callback_query.id,
+    иначе второе нажатие того же модератора пройдёт как продление.
+    """
+
+    def __init__(self, redis, prefix: str = "submission_claim"):
+        self.redis = redis
+        self.prefix = prefix
+        self._release_script = redis.register_script(RELEASE_SCRIPT)
+        self.stats = {"acquired": 0, "conflicts": 0}
+
+    def _key(self, object_id: str) -> str:
+        return f"{self.prefix}_{object_id}"
+
+    async def claim(self, object_id: str, owner, ttl: int) -> bool:
+        key, owner = self._key(object_id), str(owner)
+        if await self.redis.set(key, owner, nx=True, ex=ttl):
+            self.stats["acquired"] += 1
+            return True
+        # Та же аренда у того же владельца (например, модератор дописывает причину отклонения)
+        if await self.redis.get(key) == owner:
+            await self.redis.expire(key, ttl)
+            return True
+        self.stats["conflicts"] += 1
+        return False
+
+    async def release(self, object_id: str, owner) -> bool:
+        return bool(await self._release_script(keys=[self._key(object_id)], args=[str(owner)]))
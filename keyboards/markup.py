@@ -1,8 +1,48 @@
+"""
+Клавиатуры бота.
+
+Все клавиатуры собираются один раз при импорте и хранятся уже сериализованными в JSON:
+aiogram передаёт строку reply_markup в Bot API как есть, без повторного to_python() + json.dumps.
+Клавиатуры с параметром (id заявки, callback кнопки «Готово») собираются из шаблона,
+в котором подставляется только callback_data.
+"""
+import json
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from tg_bot.constants import CATEGORIES
 
+ARG_PLACEHOLDER = "__ARG__"
+
+
+def freeze_keyboard(kb: InlineKeyboardMarkup) -> str:
+    """Сериализует клавиатуру в готовую для Bot API строку"""
+    return json.dumps(kb.to_python(), ensure_ascii=False)
+
+
+class KeyboardTemplate:
+    """Замороженная клавиатура, в callback_data которой подставляется аргумент"""
+
+    def __init__(self, kb: InlineKeyboardMarkup):
+        self._json = freeze_keyboard(kb)
+
+    def render(self, arg) -> str:
+        # json.dumps(...)[1:-1] — экранирование аргумента как содержимого JSON-строки
+        return self._json.replace(ARG_PLACEHOLDER, json.dumps(str(arg), ensure_ascii=False)[1:-1])
+
+
+def _nav_buttons():
+    return (
+        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
+        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
+    )
+
+
+# =======================
+# Сборка клавиатур (вызывается один раз)
+# =======================
 
-def make_agent_discount_keyboard() -> InlineKeyboardMarkup:
+def build_agent_discount_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора: согласиться на скидку или нет"""
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -12,7 +52,7 @@ def make_agent_discount_keyboard() -> InlineKeyboardMarkup:
     return kb
 
 
-def make_noagent_keyboard() -> InlineKeyboardMarkup:
+def build_noagent_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора: пригласить друзей или отказаться"""
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -22,7 +62,7 @@ def make_noagent_keyboard() -> InlineKeyboardMarkup:
     return kb
 
 
-def make_agent_invite_keyboard() -> InlineKeyboardMarkup:
+def build_agent_invite_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для отправки приглашений"""
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -32,62 +72,61 @@ def make_agent_invite_keyboard() -> InlineKeyboardMarkup:
     return kb
 
 
-def make_start_keyboard() -> InlineKeyboardMarkup:
+def build_start_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("Продать", callback_data="start:sell"))
     kb.add(InlineKeyboardButton("Купить", callback_data="start:buy"))
     return kb
 
-def make_subscribe_keyboard() -> InlineKeyboardMarkup:
+def build_subscribe_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("Подписаться", url="https://t.me/goodbiz54"))
     kb.add(InlineKeyboardButton("Проверить подписку", callback_data="check_sub"))
     return kb
 
-def make_ready_keyboard() -> InlineKeyboardMarkup:
+def build_ready_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("Информацию подготовил(а)", callback_data="info:ready"))
     return kb
 
-def make_back_restart_keyboard() -> InlineKeyboardMarkup:
+def build_back_restart_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
+    kb.add(*_nav_buttons())
     return kb
 
-def make_restart_only_keyboard() -> InlineKeyboardMarkup:
+def build_restart_only_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart"))
     return kb
 
-def make_skip_back_restart_keyboard() -> InlineKeyboardMarkup:
+def build_skip_back_restart_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(InlineKeyboardButton("⏭️ Пропустить", callback_data="sell:skip_current"))
-    kb.add(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
+    kb.add(*_nav_buttons())
     return kb
 
-def make_done_back_restart_keyboard(done_callback: str) -> InlineKeyboardMarkup:
+def build_skip_table_keyboard() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup(row_width=2)
+    kb.add(InlineKeyboardButton("⏭️ Пропустить", callback_data="sell:skip_table"))
+    kb.add(*_nav_buttons())
+    return kb
+
+def build_done_back_restart_keyboard(done_callback: str) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(InlineKeyboardButton("✅ Готово", callback_data=done_callback))
-    kb.add(
-        InlineKeyboardButton("◀️ Назад", callback_data="nav:back"),
-        InlineKeyboardButton("🔄 Начать сначала", callback_data="nav:restart")
-    )
+    kb.add(*_nav_buttons())
     return kb
 
-def make_categories_keyboard(prefix="cat") -> InlineKeyboardMarkup:
+def build_categories_keyboard(prefix="cat", with_nav: bool = False) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     for i in range(1, 9):
         cat_name = CATEGORIES.get(str(i), f"Категория {i}")
         kb.insert(InlineKeyboardButton(cat_name, callback_data=f"{prefix}:{i}"))
+    if with_nav:
+        kb.row(*_nav_buttons())
     return kb
 
-def make_confirm_agent_keyboard() -> InlineKeyboardMarkup:
+def build_confirm_agent_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
         InlineKeyboardButton("Да", callback_data="sell:agree_agent"),
@@ -95,10 +134,95 @@ def make_confirm_agent_keyboard() -> InlineKeyboardMarkup:
     )
     return kb
 
-def make_mod_inline(local_id: str) -> InlineKeyboardMarkup:
+def build_preview_keyboard() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    kb.add(
+        InlineKeyboardButton("✅ Да, всё верно", callback_data="preview:confirm"),
+        InlineKeyboardButton("❌ Отменить", callback_data="preview:cancel")
+    )
+    return kb
+
+def build_mod_inline(local_id: str) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
         InlineKeyboardButton("✅ Опубликовать", callback_data=f"mod:publish:{local_id}"),
         InlineKeyboardButton("❌ Отклонить", callback_data=f"mod:reject:{local_id}")
     )
-    return kb
\ No newline at end of file
+    return kb
+
+
+# =======================
+# Готовые (замороженные) клавиатуры
+# =======================
+
+AGENT_DISCOUNT_KEYBOARD = freeze_keyboard(build_agent_discount_keyboard())
+NOAGENT_KEYBOARD = freeze_keyboard(build_noagent_keyboard())
+AGENT_INVITE_KEYBOARD = freeze_keyboard(build_agent_invite_keyboard())
+START_KEYBOARD = freeze_keyboard(build_start_keyboard())
+SUBSCRIBE_KEYBOARD = freeze_keyboard(build_subscribe_keyboard())
+READY_KEYBOARD = freeze_keyboard(build_ready_keyboard())
+BACK_RESTART_KEYBOARD = freeze_keyboard(build_back_restart_keyboard())
+RESTART_ONLY_KEYBOARD = freeze_keyboard(build_restart_only_keyboard())
+SKIP_BACK_RESTART_KEYBOARD = freeze_keyboard(build_skip_back_restart_keyboard())
+SKIP_TABLE_KEYBOARD = freeze_keyboard(build_skip_table_keyboard())
+CONFIRM_AGENT_KEYBOARD = freeze_keyboard(build_confirm_agent_keyboard())
+PREVIEW_KEYBOARD = freeze_keyboard(build_preview_keyboard())
+
+DONE_BACK_RESTART_TEMPLATE = KeyboardTemplate(build_done_back_restart_keyboard(ARG_PLACEHOLDER))
+MOD_INLINE_TEMPLATE = KeyboardTemplate(build_mod_inline(ARG_PLACEHOLDER))
+
+
+def make_agent_discount_keyboard() -> str:
+    return AGENT_DISCOUNT_KEYBOARD
+
+
+def make_noagent_keyboard() -> str:
+    return NOAGENT_KEYBOARD
+
+
+def make_agent_invite_keyboard() -> str:
+    return AGENT_INVITE_KEYBOARD
+
+
+def make_start_keyboard() -> str:
+    return START_KEYBOARD
+
+def make_subscribe_keyboard() -> str:
+    return SUBSCRIBE_KEYBOARD
+
+def make_ready_keyboard() -> str:
+    return READY_KEYBOARD
+
+def make_back_restart_keyboard() -> str:
+    return BACK_RESTART_KEYBOARD
+
+def make_restart_only_keyboard() -> str:
+    return RESTART_ONLY_KEYBOARD
+
+def make_skip_back_restart_keyboard() -> str:
+    return SKIP_BACK_RESTART_KEYBOARD
+
+def make_skip_table_keyboard() -> str:
+    return SKIP_TABLE_KEYBOARD
+
+@lru_cache(maxsize=32)
+def make_done_back_restart_keyboard(done_callback: str) -> str:
+    return DONE_BACK_RESTART_TEMPLATE.render(done_callback)
+
+@lru_cache(maxsize=8)
+def make_categories_keyboard(prefix="cat") -> str:
+    return freeze_keyboard(build_categories_keyboard(prefix))
+
+@lru_cache(maxsize=8)
+def make_categories_nav_keyboard(prefix="cat") -> str:
+    """Категории + ряд «Назад / Начать сначала»"""
+    return freeze_keyboard(build_categories_keyboard(prefix, with_nav=True))
+
+def make_confirm_agent_keyboard() -> str:
+    return CONFIRM_AGENT_KEYBOARD
+
+def make_preview_keyboard() -> str:
+    return PREVIEW_KEYBOARD
+
+def make_mod_inline(local_id: str) -> str:
+    return MOD_INLINE_TEMPLATE.render(local_id)
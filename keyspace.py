@@ -0,0 +1,289 @@
+"""
+Схема ключей Redis и политика их жизни.
+
+Каждый ключ бота принадлежит одному пространству имён (по префиксу) одного из четырёх классов:
+    DURABLE      — данные, которых больше нигде нет (рефералы, очередь модерации, стримы апдейтов,
+                   поисковый индекс). Всегда без TTL;
+    COORDINATION — блокировки со сроком жизни (аренды заявок, окно дедупликации апдейтов). TTL нужен,
+                   но вытеснение раньше срока ломает корректность: заявку возьмут два модератора,
+                   повторно доставленный апдейт обработается дважды;
+    EXPIRING     — рабочее состояние со сроком жизни (черновики FSM, причина отклонения, подбор,
+                   дневная статистика). TTL ставится при записи, потерять раньше срока неприятно, но не опасно;
+    CACHE        — копии, которые восстанавливаются из источника (заявки из SQL, подписки из Bot API,
+                   результаты поиска). TTL ставится при записи.
+
+В redis.conf maxmemory-policy volatile-lru: при нехватке памяти Redis вытесняет только ключи
+с TTL, то есть COORDINATION, EXPIRING и CACHE — отличить первые от остальных Redis не умеет.
+Поэтому maxmemory подбирается так, чтобы вытеснения не было вовсе (оценка — в redis.conf), а KeySweeper
+следит за этим: считает память по классам и evicted_keys из INFO и предупреждает, если Redis начал
+вытеснять или память подходит к maxmemory.
+DURABLE-ключ с TTL — тоже ошибка: он стал кандидатом на вытеснение. Такие ключи KeySweeper только
+считает и пишет в лог — снимать TTL молча нельзя, его мог поставить код, который мы не знаем.
+
+KeySweeper раз в interval секунд проходит keyspace через SCAN (пачками, не блокируя Redis) и
+    - ставит TTL своего пространства ключам EXPIRING/CACHE, у которых его нет
+      (черновики и состояния отклонения, записанные до появления TTL);
+    - считает ключи и память (MEMORY USAGE) по пространствам — это уходит в /metrics;
+    - сравнивает evicted_keys и used_memory/maxmemory из INFO с прошлым обходом.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tg_bot.matching import BUYER_TTL, LISTING_TTL
+from tg_bot.stats import DAILY_TTL, MONTHLY_TTL
+
+logger = logging.getLogger(__name__)
+
+DURABLE = "durable"
+COORDINATION = "coordination"
+EXPIRING = "expiring"
+CACHE = "cache"
+
+REJECTION_STATE_TTL = 24 * 3600  # модератор начал отклонять заявку и не дописал причину
+CLAIM_TTL = 15 * 60  # не больше самой длинной аренды в MainBot
+SEARCH_CACHE_TTL = 300
+PUBLISH_STEPS_TTL = 24 * 3600  # модератор повторит публикацию, не дольше суток
+MEMORY_WARNING_RATIO = 0.8  # used_memory/maxmemory, после которого ждём вытеснений
+
+OTHER = "other"
+
+
+@dataclass(frozen=True)
+class Namespace:
+    name: str
+    prefixes: Tuple[str, ...]  # префикс ключа или имя ключа целиком
+    kind: str
+    ttl: Optional[int] = None  # для классов с TTL — срок, который ставит KeySweeper, если TTL нет
+    description: str = ""
+
+
+def key_schema(fsm_draft_ttl: int, update_dedupe_window: int, subscription_ttl: int,
+               search_cache_ttl: int = SEARCH_CACHE_TTL) -> List[Namespace]:
+    """Все пространства ключей бота; сроки, которые задаются в Config, передаются сюда"""
+    return [
+        # ---------- DURABLE ----------
+        Namespace("users", ("user:", "user_list:"), DURABLE,
+                  description="данные и списки пользователей (RedisClient)"),
+        Namespace("referrals", ("referral_members_", "referral_count_", "referral_invites_"), DURABLE,
+                  description="приглашённые за всё время и счётчик текущего раунда (referral_invites_ — старый формат)"),
+        Namespace("moderation", ("moderation_queue", "submissions_status_"), DURABLE,
+                  description="очередь модерации и индексы статусов"),
+        Namespace("submissions_unconfirmed", ("submissions_unconfirmed",), DURABLE,
+                  description="заявки, ещё не записанные в SQL (SubmissionStore допишет их при запуске)"),
+        Namespace("update_streams", ("updates_stream_",), DURABLE,
+                  description="стримы апдейтов для воркеров, длина ограничена MAXLEN"),
+        Namespace("stats_total", ("stats_total",), DURABLE,
+                  description="счётчики статистики за всё время"),
+        Namespace("search_index", ("search_term_", "search_listing_", "search_price", "search_recent",
+                                   "search_version"), DURABLE,
+                  description="обратный индекс inline-поиска, старые объявления убирает ListingSearch.prune"),
+        # ---------- COORDINATION ----------
+        Namespace("claims", ("submission_claim_",), COORDINATION, CLAIM_TTL,
+                  description="аренды заявок модераторами"),
+        Namespace("update_dedupe", ("update_seen_",), COORDINATION, update_dedupe_window,
+                  description="обработанные update_id"),
+        # ---------- EXPIRING ----------
+        Namespace("fsm", ("fsm_",), EXPIRING, fsm_draft_ttl,
+                  description="состояние и черновик опроса"),
+        Namespace("rejections", ("mod_rejection_state_",), EXPIRING, REJECTION_STATE_TTL,
+                  description="заявка, для которой модератор пишет причину отклонения"),
+        Namespace("publish_steps", ("publish_steps_",), EXPIRING, PUBLISH_STEPS_TTL,
+                  description="части поста, уже отправленные в канал неудавшейся публикацией"),
+        Namespace("stats_daily", ("stats_daily_", "stats_dau_"), EXPIRING, DAILY_TTL,
+                  description="счётчики и уникальные пользователи за день"),
+        Namespace("stats_monthly", ("stats_mau_",), EXPIRING, MONTHLY_TTL,
+                  description="уникальные пользователи за месяц"),
+        Namespace("match_listings", ("match_listings_", "match_listing_"), EXPIRING, LISTING_TTL,
+                  description="объявления в индексе подбора"),
+        Namespace("match_buyers", ("match_buyers_", "match_buyer_", "match_sent_"), EXPIRING, BUYER_TTL,
+                  description="заявки покупателей и отправленные совпадения"),
+        # ---------- CACHE ----------
+        # TTL ставит сам SubmissionStore после коммита в БД: до него хэш — единственная копия
+        Namespace("submissions", ("submission_",), CACHE,
+                  description="кэш заявок, источник — SQL; без TTL, пока запись не подтверждена БД"),
+        Namespace("subscriptions", ("subscription_status_",), CACHE, subscription_ttl,
+                  description="статус подписки на канал"),
+        Namespace("search_cache", ("search_cache_", "search_tmp_"), CACHE, search_cache_ttl,
+                  description="результаты inline-поиска по запросу"),
+    ]
+
+
+class NamespaceReport:
+    __slots__ = ("keys", "bytes", "expired_set", "durable_with_ttl")
+
+    def __init__(self):
+        self.keys = 0
+        self.bytes = 0
+        self.expired_set = 0  # сколько ключей без TTL получили TTL пространства
+        self.durable_with_ttl = 0
+
+
+class KeySweeper:
+    def __init__(self, redis, schema: Iterable[Namespace], interval: float = 3600, batch: int = 500,
+                 pause: float = 0.01):
+        self.redis = redis
+        self.interval = interval
+        self.batch = batch
+        self.pause = pause  # пауза между пачками SCAN, чтобы не забирать Redis у хендлеров
+        self.namespaces = {ns.name: ns for ns in schema}
+        # Самые длинные префиксы первыми: submission_claim_ раньше submission_
+        self._prefixes = sorted(
+            ((prefix, ns) for ns in self.namespaces.values() for prefix in ns.prefixes),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self.last_report: Dict[str, NamespaceReport] = {}
+        self.last_duration = 0.0
+        self._memory_usage: Optional[bool] = None  # MEMORY USAGE есть не везде — проверяется при первом обходе
+        self._info = True  # INFO тоже есть не везде — после первой ошибки не спрашиваем
+        self.evicted_keys: Optional[int] = None  # evicted_keys из INFO на последнем обходе
+        self.evicted_since_last = 0
+        self.memory_ratio = 0.0  # used_memory/maxmemory, 0 — maxmemory не задан
+        self._task: Optional[asyncio.Task] = None
+
+    def classify(self, key: str) -> Optional[Namespace]:
+        for prefix, ns in self._prefixes:
+            if key.startswith(prefix):
+                return ns
+        return None
+
+    # ---------- жизненный цикл ----------
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._sweep_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception(f"Обход ключей Redis не удался: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ---------- обход ----------
+
+    async def sweep(self) -> Dict[str, NamespaceReport]:
+        started = time.perf_counter()
+        report: Dict[str, NamespaceReport] = {name: NamespaceReport() for name in (*self.namespaces, OTHER)}
+        if self._memory_usage is None:
+            self._memory_usage = await self._probe_memory_usage()
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(cursor, count=self.batch)
+            if keys:
+                await self._sweep_batch(keys, report)
+            if cursor == 0:
+                break
+            await asyncio.sleep(self.pause)
+
+        self.last_report = report
+        self.last_duration = time.perf_counter() - started
+        await self._check_eviction()
+        self._log(report)
+        return report
+
+    async def _check_eviction(self):
+        if not self._info:
+            return
+        try:
+            stats = await self.redis.info("stats")
+            memory = await self.redis.info("memory")
+        except Exception as e:
+            self._info = False
+            logger.warning(f"INFO недоступна ({e}) — вытеснения не отслеживаются")
+            return
+        evicted = int(stats.get("evicted_keys", 0))
+        self.evicted_since_last = evicted - self.evicted_keys if self.evicted_keys is not None else 0
+        self.evicted_keys = evicted
+        maxmemory = int(memory.get("maxmemory", 0))
+        self.memory_ratio = int(memory.get("used_memory", 0)) / maxmemory if maxmemory else 0.0
+
+    async def _probe_memory_usage(self) -> bool:
+        try:
+            await self.redis.memory_usage("__keyspace_probe__")
+            return True
+        except Exception as e:
+            logger.warning(f"MEMORY USAGE недоступна ({e}) — считаем только ключи")
+            return False
+
+    async def _sweep_batch(self, keys: List[str], report: Dict[str, NamespaceReport]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+                if self._memory_usage:
+                    pipe.memory_usage(key, samples=0)
+            results = await pipe.execute(raise_on_error=False)
+        step = 2 if self._memory_usage else 1
+
+        to_expire = []
+        for i, key in enumerate(keys):
+            ttl = results[i * step]
+            if isinstance(ttl, Exception) or ttl == -2:  # ключ успел исчезнуть
+                continue
+            ns = self.classify(key)
+            entry = report[ns.name if ns else OTHER]
+            entry.keys += 1
+            if step == 2:
+                memory = results[i * step + 1]
+                entry.bytes += memory if isinstance(memory, int) else 0
+            if ns is None:
+                continue
+            if ns.kind == DURABLE and ttl >= 0:
+                entry.durable_with_ttl += 1
+            elif ns.kind != DURABLE and ttl == -1 and ns.ttl:
+                to_expire.append((key, ns.ttl))
+                entry.expired_set += 1
+
+        if to_expire:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, ttl in to_expire:
+                    # NX: не трогаем ключ, которому TTL успели поставить между TTL и EXPIRE
+                    pipe.expire(key, ttl, nx=True)
+                await pipe.execute(raise_on_error=False)
+
+    def _log(self, report: Dict[str, NamespaceReport]):
+        parts = [
+            f"{name}={entry.keys}/{entry.bytes // 1024}КБ"
+            for name, entry in sorted(report.items(), key=lambda item: -item[1].bytes)
+            if entry.keys
+        ]
+        logger.info(f"Ключи Redis ({self.last_duration:.1f} с): {', '.join(parts) or 'пусто'}")
+        for name, entry in report.items():
+            if entry.expired_set:
+                logger.info(f"{name}: поставлен TTL {entry.expired_set} ключам без срока")
+            if entry.durable_with_ttl:
+                logger.warning(f"{name}: {entry.durable_with_ttl} долговременных ключей с TTL — их может вытеснить Redis")
+        if report[OTHER].keys:
+            logger.warning(f"Ключей вне схемы: {report[OTHER].keys} (добавьте пространство в tg_bot.keyspace)")
+        coordination = [name for name, ns in self.namespaces.items() if ns.kind == COORDINATION]
+        if self.evicted_since_last > 0:
+            logger.error(
+                f"Redis вытеснил {self.evicted_since_last} ключей с прошлого обхода — под вытеснение попадают и "
+                f"{', '.join(coordination)}: увеличьте maxmemory (см. redis.conf)"
+            )
+        elif self.memory_ratio >= MEMORY_WARNING_RATIO:
+            logger.warning(f"Redis занял {self.memory_ratio:.0%} maxmemory — скоро начнётся вытеснение")
+
+    def metrics(self) -> Dict[str, float]:
+        values = {
+            "redis_keys_sweep_seconds": self.last_duration,
+            "redis_evicted_keys_since_sweep": self.evicted_since_last,
+            "redis_memory_used_ratio": self.memory_ratio,
+        }
+        for name, entry in self.last_report.items():
+            values[f"redis_keys_{name}"] = entry.keys
+            values[f"redis_memory_bytes_{name}"] = entry.bytes
+            values[f"redis_keys_durable_with_ttl_{name}"] = entry.durable_with_ttl
+        return values
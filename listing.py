@@ -0,0 +1,153 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from tg_bot.constants import AGENT_CONTACT, CATEGORIES
+from tg_bot.utils import escape_html, format_number, safe_int
+
+# Поля черновика, от которых зависит отрендеренное объявление
+LISTING_FIELDS = (
+    "title", "profit", "city", "price", "category_idx",
+    "marketing", "employees", "premises", "included", "extra",
+    "contact", "with_agent", "photos", "video", "video_note", "table",
+)
+
+
+def price_hashtag(price) -> str:
+    """Хэштег ценового диапазона (пустая строка, если цена не число)"""
+    price_num = safe_int(price)
+    if not price_num:
+        return ""
+    if price_num < 1_000_000:
+        return "#до1млн"
+    elif price_num < 2_000_000:
+        return "#до2млн"
+    elif price_num < 5_000_000:
+        return "#до5млн"
+    elif price_num < 10_000_000:
+        return "#до10млн"
+    return "#более10млн"
+
+
+def build_hashtags(data: Dict[str, Any]) -> str:
+    """Хэштеги объявления: город, диапазон цены, категория"""
+    city_tag = escape_html(data.get("city", "")).replace(" ", "")
+    text = f"#{city_tag} "
+
+    price_tag = price_hashtag(data.get("price", "0"))
+    if price_tag:
+        text += price_tag + " "
+
+    category = CATEGORIES.get(data.get("category_idx", ""), "")
+    category_tag = category.replace(" ", "").replace("/", "")
+    text += f"#{category_tag}"
+    return text
+
+
+def build_media_group(data: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Медиагруппа (фото + видео, не больше 10) в виде, который принимает send_media_group"""
+    media = [{"type": "photo", "media": photo_id} for photo_id in data.get("photos", [])[:10]]
+    video = data.get("video")
+    if video and len(media) < 10:
+        media.append({"type": "video", "media": video})
+    return media
+
+
+def build_sell_preview(data: Dict[str, Any]) -> str:
+    """Формирует текст предпросмотра объявления на продажу"""
+    title = escape_html(data.get("title", ""))
+    profit = format_number(data.get("profit", ""))
+    city = escape_html(data.get("city", ""))
+    price = format_number(data.get("price", ""))
+    category = CATEGORIES.get(data.get("category_idx", ""), "")
+
+    text = (
+        f"🔥 <b>{title}</b>\n\n"
+        f"💰 <b>Прибыль:</b> {profit} ₽/мес\n"
+        f"💵 <b>Цена:</b> {price} ₽\n"
+        f"📍 <b>Город:</b> {city}\n"
+        f"🏷 <b>Категория:</b> {category}\n"
+    )
+
+    # Дополнительные блоки с отступами
+    sections = []
+
+    if data.get("marketing"):
+        sections.append(f"📢 <b>Маркетинг</b>\n{escape_html(data.get('marketing'))}")
+
+    if data.get("employees"):
+        sections.append(f"👥 <b>Персонал</b>\n{escape_html(data.get('employees'))}")
+
+    if data.get("premises"):
+        sections.append(f"🏢 <b>Помещение</b>\n{escape_html(data.get('premises'))}")
+
+    if data.get("included"):
+        sections.append(f"✅ <b>В стоимость входит</b>\n{escape_html(data.get('included'))}")
+
+    if data.get("extra"):
+        sections.append(f"ℹ️ <b>Дополнительно</b>\n{escape_html(data.get('extra'))}")
+
+    # ✅ ДОБАВЛЯЕМ КОНТАКТ ДЛЯ СВЯЗИ
+    contact = data.get("contact", "")
+    with_agent = data.get("with_agent", False)
+
+    if with_agent:
+        # Если согласен на посредничество - показываем контакт агента
+        sections.append(f"📞 <b>Контакт для связи</b>\n{AGENT_CONTACT}")
+    elif contact:
+        # Если не согласен на посредничество - показываем контакт пользователя
+        sections.append(f"📞 <b>Контакт для связи</b>\n{escape_html(contact)}")
+
+    if sections:
+        text += "\n" + "─" * 25 + "\n\n"
+        text += "\n\n".join(sections)
+
+    # Хэштеги
+    text += "\n\n" + "─" * 25 + "\n"
+    text += build_hashtags(data)
+
+    return text
+
+def build_buy_preview(data: Dict[str, Any]) -> str:
+    """Формирует текст заявки на покупку"""
+    budget = escape_html(data.get("budget", ""))
+    city = escape_html(data.get("city", ""))
+    category = CATEGORIES.get(data.get("category_idx", ""), "")
+    experience = escape_html(data.get("experience", ""))
+    contact = escape_html(data.get("contact", ""))
+    when_contact = escape_html(data.get("when_contact", ""))
+
+    text = (
+        f"<b>🔍 НОВАЯ ЗАЯВКА НА ПОКУПКУ</b>\n\n"
+        f"💰 <b>Бюджет:</b> {budget}\n"
+        f"📍 <b>Город:</b> {city}\n"
+        f"🏷️ <b>Категория:</b> {category}\n"
+        f"📚 <b>Опыт:</b> {experience}\n"
+        f"📞 <b>Контакт:</b> {contact}\n"
+        f"⏰ <b>Когда связаться:</b> {when_contact}\n"
+    )
+
+    return text
+
+
+def listing_version(data: Dict[str, Any]) -> str:
+    """Хэш полей черновика, влияющих на объявление"""
+    payload = json.dumps({k: data.get(k) for k in LISTING_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def render_listing(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Рендерит объявление целиком: HTML-текст, хэштеги и медиагруппу"""
+    return {
+        "version": listing_version(data),
+        "html": build_sell_preview(data),
+        "hashtags": build_hashtags(data),
+        "media": build_media_group(data),
+    }
+
+
+def get_rendered_listing(data: Dict[str, Any], rendered: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Возвращает сохранённый рендер, если черновик с тех пор не менялся, иначе рендерит заново"""
+    if rendered and rendered.get("version") == listing_version(data):
+        return rendered
+    return render_listing(data)
@@ -0,0 +1,144 @@
+"""
+Локальная подмена Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на любые методы по пути /bot<token>/<method>: sendMessage, sendMediaGroup,
+getChatMember, getUpdates и т.д. Задержка ответа и доля ответов 429 настраиваются.
+Апдейты для бота кладутся через push_update и отдаются ему через getUpdates (polling).
+
+Бот направляется сюда через TELEGRAM_API_URL, например:
+    TELEGRAM_API_URL=http://127.0.0.1:8090 BOT_MODE=polling FSM_STORAGE=memory python MainBot.py
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+from tg_bot.sender import SEND_METHODS
+
+BOT_ID = 777000
+BOT_USERNAME = "loadtest_bot"
+
+# Ответ пользователю, по которому драйвер засекает конец шага
+REPLY_METHODS = {"sendMessage", "editMessageText"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.03, jitter: float = 0.01,
+                 rate_429: float = 0.0, retry_after: int = 1, member_status: str = "member"):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.member_status = member_status
+
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        # Вызывается на каждый ответ бота в чат: on_reply(chat_id, method, message)
+        self.on_reply: Optional[Callable[[int, str, Dict[str, Any]], None]] = None
+        # Бот начал забирать апдейты — можно запускать рой
+        self.ready = asyncio.Event()
+
+        self._updates: List[Dict[str, Any]] = []
+        # update_id растут между прогонами, как у настоящего бота, иначе их отбросит окно дедупликации
+        self._update_id = int(time.time() * 1000)
+        self._message_id = 0
+        self._new_update = asyncio.Event()
+
+    # ---------- апдейты для бота ----------
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._new_update.set()
+        return self._update_id
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.ready.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+
+        # offset подтверждает всё, что бот уже забрал
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # ---------- ответы Bot API ----------
+
+    def _message(self, chat_id: int, **fields) -> Dict[str, Any]:
+        self._message_id += 1
+        chat_type = "private" if chat_id > 0 else "supergroup"
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME},
+            **fields,
+        }
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        chat_id = int(params.get("chat_id") or 0)
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME}
+        if method == "getChatMember":
+            user_id = int(params.get("user_id") or 0)
+            return {
+                "status": self.member_status,
+                "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            }
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": len(self._updates)}
+        if method == "getChat":
+            return {"id": chat_id, "type": "channel", "title": "Канал", "username": "loadtest_channel"}
+        if method == "sendMediaGroup":
+            media = params.get("media") or "[]"
+            media = json.loads(media) if isinstance(media, str) else media
+            return [self._message(chat_id) for _ in media]
+        if method in SEND_METHODS or method == "editMessageText":
+            return self._message(chat_id, text=params.get("text", ""))
+        # setWebhook, deleteWebhook, answerCallbackQuery, deleteMessage и прочее
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if method in SEND_METHODS and random.random() < self.rate_429:
+            self.throttled[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        result = self._result(method, params)
+        if method in REPLY_METHODS and self.on_reply is not None:
+            self.on_reply(int(params.get("chat_id") or 0), method, result)
+        return web.json_response({"ok": True, "result": result})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
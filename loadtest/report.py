@@ -0,0 +1,38 @@
+"""Сводка прогона: пропускная способность и перцентили задержки по шагам"""
+import math
+from typing import List, Sequence
+
+from tg_bot.loadtest.fake_api import FakeBotAPI
+from tg_bot.loadtest.swarm import Swarm
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Перцентиль по ближайшему рангу (values отсортированы)"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def render(swarm: Swarm, api: FakeBotAPI) -> str:
+    duration = max(swarm.finished_at - swarm.started_at, 1e-9)
+    lines: List[str] = [
+        f"Длительность: {duration:.1f} с",
+        f"Апдейтов: {swarm.updates_sent} ({swarm.updates_sent / duration:.1f}/с)",
+        "Завершено: " + ", ".join(
+            f"{flow} {count} ({count / duration:.2f}/с)" for flow, count in sorted(swarm.completed.items())
+        ),
+        "",
+        f"{'шаг':<22} {'n':>6} {'ошибок':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}",
+    ]
+    for name in sorted(set(swarm.latencies) | set(swarm.errors)):
+        values = sorted(swarm.latencies.get(name, []))
+        p50, p95, p99 = (percentile(values, p) * 1000 for p in (50, 95, 99))
+        lines.append(
+            f"{name:<22} {len(values):>6} {swarm.errors.get(name, 0):>7} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}"
+        )
+
+    lines += ["", f"{'метод Bot API':<22} {'вызовов':>8} {'429':>6}"]
+    for method, count in api.calls.most_common():
+        lines.append(f"{method:<22} {count:>8} {api.throttled.get(method, 0):>6}")
+    return "\n".join(lines)
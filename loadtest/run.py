@@ -0,0 +1,73 @@
+"""
+Нагрузочный прогон: поднимает фейковый Bot API и запускает рой пользователей.
+
+1. Запустить прогон (ждёт, пока бот начнёт забирать апдейты):
+    python -m tg_bot.loadtest.run --users 500 --concurrency 200 --latency-ms 40 --rate-429 0.01
+2. В другом терминале запустить бота на этот адрес:
+    TELEGRAM_API_URL=http://127.0.0.1:8090 BOT_MODE=polling python MainBot.py
+"""
+import argparse
+import asyncio
+import logging
+
+from aiohttp import web
+
+from tg_bot.loadtest.fake_api import FakeBotAPI
+from tg_bot.loadtest.report import render
+from tg_bot.loadtest.swarm import USER_ID_BASE, Swarm
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на фейковом Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--users", type=int, default=100, help="сколько пользователей пройдут опрос")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько проходят одновременно")
+    parser.add_argument("--buy-share", type=float, default=0.3, help="доля покупателей")
+    parser.add_argument("--album-size", type=int, default=5, help="фото в альбоме продавца")
+    parser.add_argument("--referrals", type=int, default=2, help="рефералов на продавца")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="средняя задержка ответа Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 на отправку")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--user-id-base", type=int, default=USER_ID_BASE,
+                        help="id первого пользователя (меняйте между прогонами на одном Redis)")
+    return parser.parse_args()
+
+
+async def main(args):
+    api = FakeBotAPI(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+    )
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logger.info(f"Фейковый Bot API на http://{args.host}:{args.port}, жду бота...")
+
+    try:
+        await api.ready.wait()
+        swarm = Swarm(
+            api,
+            users=args.users,
+            concurrency=args.concurrency,
+            buy_share=args.buy_share,
+            album_size=args.album_size,
+            referrals=args.referrals,
+            step_timeout=args.step_timeout,
+            user_id_base=args.user_id_base,
+        )
+        await swarm.run()
+        print(render(swarm, api))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,185 @@
+"""
+Рой синтетических пользователей: каждый проходит опрос продажи или покупки целиком.
+
+Шаг — это один или несколько апдейтов (сообщение, нажатие кнопки, альбом фото) и ожидание
+ответов бота в чат пользователя. Время шага — от отправки апдейта до последнего ответа.
+Продавцы после опроса приводят рефералов (/start ref_<id>).
+"""
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from tg_bot.loadtest.fake_api import FakeBotAPI
+
+USER_ID_BASE = 10_000_000
+
+
+class StepFailed(Exception):
+    pass
+
+
+class SimUser:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.replies: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.last_message_id = 0
+
+    @property
+    def sender(self) -> Dict[str, Any]:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"user{self.user_id}", "language_code": "ru"}
+
+    @property
+    def chat(self) -> Dict[str, Any]:
+        return {"id": self.user_id, "type": "private"}
+
+    def message(self, **fields) -> Dict[str, Any]:
+        return {"message": {
+            "message_id": random.randint(1, 2 ** 31),
+            "date": int(time.time()),
+            "from": self.sender,
+            "chat": self.chat,
+            **fields,
+        }}
+
+    def text(self, text: str) -> Dict[str, Any]:
+        return self.message(text=text)
+
+    def photo(self, n: int, media_group_id: Optional[str] = None) -> Dict[str, Any]:
+        fields = {"photo": [{
+            "file_id": f"AgACAgIAAxkBAAI{self.user_id}_{n}",
+            "file_unique_id": f"AQAD{self.user_id}_{n}",
+            "width": 1280,
+            "height": 960,
+        }]}
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        return self.message(**fields)
+
+    def callback(self, data: str) -> Dict[str, Any]:
+        return {"callback_query": {
+            "id": str(random.randint(1, 2 ** 62)),
+            "from": self.sender,
+            "chat_instance": str(self.user_id),
+            "data": data,
+            "message": {
+                "message_id": self.last_message_id,
+                "date": int(time.time()),
+                "chat": self.chat,
+                "text": "",
+            },
+        }}
+
+
+class Swarm:
+    def __init__(self, api: FakeBotAPI, users: int = 100, concurrency: int = 50,
+                 buy_share: float = 0.3, album_size: int = 5, referrals: int = 2,
+                 step_timeout: float = 30.0, user_id_base: int = USER_ID_BASE):
+        self.api = api
+        self.users = users
+        self.concurrency = concurrency
+        self.buy_share = buy_share
+        self.album_size = album_size
+        self.referrals = referrals
+        self.step_timeout = step_timeout
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.completed: Dict[str, int] = defaultdict(int)
+        self.updates_sent = 0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+        self._users: Dict[int, SimUser] = {}
+        self._next_user_id = user_id_base
+        api.on_reply = self._on_reply
+
+    def _on_reply(self, chat_id: int, method: str, message: Any):
+        user = self._users.get(chat_id)
+        if user is not None:
+            user.replies.put_nowait(message)
+
+    def _new_user(self) -> SimUser:
+        self._next_user_id += 1
+        user = SimUser(self._next_user_id)
+        self._users[user.user_id] = user
+        return user
+
+    async def step(self, user: SimUser, name: str, *updates: Dict[str, Any], replies: int = 1):
+        # Ответы на прошлые шаги, которые не ждали, не должны засчитаться этому
+        while not user.replies.empty():
+            user.replies.get_nowait()
+
+        started = time.perf_counter()
+        for update in updates:
+            self.api.push_update(update)
+        self.updates_sent += len(updates)
+        try:
+            for _ in range(replies):
+                message = await asyncio.wait_for(user.replies.get(), self.step_timeout)
+                if isinstance(message, dict):
+                    user.last_message_id = message.get("message_id", user.last_message_id)
+        except asyncio.TimeoutError:
+            self.errors[name] += 1
+            raise StepFailed(name)
+        self.latencies[name].append(time.perf_counter() - started)
+
+    # ---------- сценарии ----------
+
+    async def sell_flow(self, user: SimUser):
+        await self.step(user, "sell:/start", user.text("/start"))
+        await self.step(user, "sell:start", user.callback("start:sell"))
+        await self.step(user, "sell:ready", user.callback("info:ready"))
+        await self.step(user, "sell:title", user.text("Кофейня у метро"))
+        await self.step(user, "sell:profit", user.text("250000"))
+        await self.step(user, "sell:skip_marketing", user.callback("sell:skip_current"))
+        await self.step(user, "sell:employees", user.text("3 бариста, ФОТ 180000"))
+        await self.step(user, "sell:premises", user.text("Аренда 40 м², 60000 в месяц"))
+        await self.step(user, "sell:included", user.text("Оборудование, мебель, товарные остатки"))
+        await self.step(user, "sell:extra", user.text("Переезд в другой город"))
+        await self.step(user, "sell:skip_table", user.callback("sell:skip_table"))
+        album = f"album{user.user_id}"
+        await self.step(
+            user, "sell:album",
+            *(user.photo(i, album) for i in range(self.album_size)),
+        )
+        await self.step(user, "sell:photos_done", user.callback("sell:photos_done"))
+        await self.step(user, "sell:city", user.text("Новосибирск"))
+        await self.step(user, "sell:address", user.text("Красный проспект, 1"))
+        await self.step(user, "sell:price", user.text("1250700"))
+        await self.step(user, "sell:category", user.callback("cat:6"))
+        await self.step(user, "sell:confirm", user.callback("preview:confirm"))
+        await self.step(user, "sell:agent", user.callback("sell:agree_agent"))
+        self.completed["sell"] += 1
+
+        for _ in range(self.referrals):
+            friend = self._new_user()
+            await self.step(friend, "referral:/start", friend.text(f"/start ref_{user.user_id}"))
+            self.completed["referral"] += 1
+
+    async def buy_flow(self, user: SimUser):
+        await self.step(user, "buy:/start", user.text("/start"))
+        await self.step(user, "buy:start", user.callback("start:buy"))
+        await self.step(user, "buy:budget", user.text("до 2 000 000"))
+        await self.step(user, "buy:city", user.text("Новосибирск"))
+        await self.step(user, "buy:category", user.callback("buycat:6"))
+        await self.step(user, "buy:experience", user.text("Нет"))
+        await self.step(user, "buy:phone", user.text("+79990000000"))
+        await self.step(user, "buy:when_contact", user.text("После 18:00"))
+        self.completed["buy"] += 1
+
+    async def _run_user(self, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            user = self._new_user()
+            flow = self.buy_flow if random.random() < self.buy_share else self.sell_flow
+            try:
+                await flow(user)
+            except StepFailed:
+                pass
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.started_at = time.perf_counter()
+        await asyncio.gather(*(self._run_user(semaphore) for _ in range(self.users)))
+        self.finished_at = time.perf_counter()
@@ -0,0 +1,260 @@
+"""
+Подбор: заявки покупателей ↔ опубликованные объявления.
+
+Индексы в Redis, по одному sorted set на пару (город, категория):
+    match_listings_<город>_<категория> — id объявлений, score = цена;
+    match_buyers_<город>_<категория>   — id заявок покупателей, score = бюджет
+    (бюджет не распознан — +inf: такой покупатель подходит под любую цену).
+Карточки — хэши match_listing_<id> / match_buyer_<id> со сроком жизни;
+id, чья карточка истекла, вычищаются из индекса при следующем поиске.
+
+Поиск — ZRANGEBYSCORE по одному ключу с LIMIT и HGETALL карточек одним pipeline:
+O(log n + k), без перебора всех объявлений.
+Уже отправленные пары (заявка, объявление) помнятся в match_sent_<заявка>,
+поэтому повторная публикация не рассылает одно и то же дважды.
+"""
+import asyncio
+import logging
+import re
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from tg_bot.constants import CATEGORIES
+from tg_bot.sender import TokenBucket
+from tg_bot.utils import escape_html, format_number, safe_int
+
+logger = logging.getLogger(__name__)
+
+LISTING_TTL = 90 * 24 * 3600
+BUYER_TTL = 30 * 24 * 3600
+
+# «1 500 000», «1,5 млн», «до 800к», «2 000 тыс»
+_NUMBER = re.compile(r"(\d[\d\s]*(?:[.,]\d+)?)\s*(млн|миллион\w*|м\b|тыс\w*|к\b|т\b)?", re.IGNORECASE)
+_MULTIPLIERS = {"м": 1_000_000, "к": 1_000, "т": 1_000}
+
+
+def normalize_city(city: str) -> str:
+    return " ".join(str(city or "").lower().replace("ё", "е").split())
+
+
+def parse_budget(text: str) -> Optional[int]:
+    """Верхняя граница бюджета из свободного текста (наибольшее число), None — если чисел нет"""
+    amounts = []
+    for number, unit in _NUMBER.findall(str(text or "")):
+        try:
+            value = float(re.sub(r"\s", "", number).replace(",", "."))
+        except ValueError:
+            continue
+        if unit:
+            value *= _MULTIPLIERS.get(unit[0].lower(), 1)
+        amounts.append(int(value))
+    return max(amounts) if amounts else None
+
+
+def listings_key(city: str, category_idx: str) -> str:
+    return f"match_listings_{normalize_city(city)}_{category_idx}"
+
+
+def buyers_key(city: str, category_idx: str) -> str:
+    return f"match_buyers_{normalize_city(city)}_{category_idx}"
+
+
+def listing_key(listing_id: str) -> str:
+    return f"match_listing_{listing_id}"
+
+
+def buyer_key(request_id: str) -> str:
+    return f"match_buyer_{request_id}"
+
+
+def sent_key(request_id: str) -> str:
+    return f"match_sent_{request_id}"
+
+
+class MatchIndex:
+    """
+    add_listing/add_buyer кладут карточку в индекс и сразу возвращают
+    подходящих покупателей/объявления, которым ещё ничего не отправляли.
+    """
+
+    def __init__(self, redis, listing_ttl: int = LISTING_TTL, buyer_ttl: int = BUYER_TTL, limit: int = 50):
+        self.redis = redis
+        self.listing_ttl = listing_ttl
+        self.buyer_ttl = buyer_ttl
+        self.limit = limit
+        self.stats = {"listings": 0, "buyers": 0, "matches": 0, "expired": 0}
+
+    async def add_listing(self, listing_id: str, data: Dict[str, Any], user_id: Optional[int] = None) -> List[Dict[str, str]]:
+        """Опубликованное объявление → покупатели с бюджетом не ниже цены"""
+        listing_id = str(listing_id)
+        price = safe_int(data.get("price"))
+        city, category_idx = data.get("city", ""), data.get("category_idx", "")
+        if price is None or not normalize_city(city) or not category_idx:
+            return []
+        card = {
+            "id": listing_id,
+            "user_id": user_id or "",
+            "title": data.get("title", ""),
+            "price": price,
+            "city": city,
+            "category_idx": category_idx,
+        }
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(listing_key(listing_id), mapping=card)
+            pipe.expire(listing_key(listing_id), self.listing_ttl)
+            pipe.zadd(listings_key(city, category_idx), {listing_id: price})
+            pipe.expire(listings_key(city, category_idx), self.listing_ttl)
+            pipe.zrangebyscore(buyers_key(city, category_idx), price, "+inf", start=0, num=self.limit)
+            *_, request_ids = await pipe.execute()
+        self.stats["listings"] += 1
+
+        buyers = await self._cards(buyers_key(city, category_idx), request_ids, buyer_key)
+        buyers = [b for b in buyers if b.get("user_id") != str(user_id or "")]
+        return await self._unsent([(b["id"], listing_id) for b in buyers], buyers)
+
+    async def add_buyer(self, user_id: int, data: Dict[str, Any]) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Заявка покупателя → объявления с ценой не выше бюджета, самые дорогие (ближе к бюджету) первыми.
+        Возвращает (id заявки, объявления).
+        """
+        request_id = uuid.uuid4().hex
+        budget = parse_budget(data.get("budget", ""))
+        city, category_idx = data.get("city", ""), data.get("category_idx", "")
+        if not normalize_city(city) or not category_idx:
+            return request_id, []
+        score = budget if budget is not None else float("inf")
+        card = {
+            "id": request_id,
+            "user_id": user_id,
+            "budget": data.get("budget", ""),
+            "city": city,
+            "category_idx": category_idx,
+            "contact": data.get("contact", ""),
+            "created": int(time.time()),
+        }
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(buyer_key(request_id), mapping=card)
+            pipe.expire(buyer_key(request_id), self.buyer_ttl)
+            pipe.zadd(buyers_key(city, category_idx), {request_id: score})
+            pipe.expire(buyers_key(city, category_idx), self.buyer_ttl)
+            pipe.zrevrangebyscore(listings_key(city, category_idx), score, "-inf", start=0, num=self.limit)
+            *_, listing_ids = await pipe.execute()
+        self.stats["buyers"] += 1
+
+        listings = await self._cards(listings_key(city, category_idx), listing_ids, listing_key)
+        listings = [item for item in listings if item.get("user_id") != str(user_id)]
+        return request_id, await self._unsent([(request_id, item["id"]) for item in listings], listings)
+
+    async def _cards(self, index: str, ids: List[str], card_key: Callable[[str], str]) -> List[Dict[str, str]]:
+        """Карточки по id из индекса; истёкшие убираются из индекса"""
+        if not ids:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for item_id in ids:
+                pipe.hgetall(card_key(item_id))
+            cards = await pipe.execute()
+        expired = [item_id for item_id, card in zip(ids, cards) if not card]
+        if expired:
+            self.stats["expired"] += len(expired)
+            await self.redis.zrem(index, *expired)
+        return [card for card in cards if card]
+
+    async def _unsent(self, pairs: List[Tuple[str, str]], items: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Оставляет только пары (заявка, объявление), о которых ещё не уведомляли, и отмечает их"""
+        if not pairs:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for request_id, listing_id in pairs:
+                pipe.sadd(sent_key(request_id), listing_id)
+                pipe.expire(sent_key(request_id), self.buyer_ttl)
+            results = await pipe.execute()
+        fresh = [item for item, added in zip(items, results[::2]) if added]
+        self.stats["matches"] += len(fresh)
+        return fresh
+
+
+class MatchNotifier:
+    """
+    Рассылка совпадений в фоне: отправки идут через очередь со своим лимитом (rate в секунду)
+    поверх лимитов ScheduledBot, чтобы рассылка по большому индексу не вытесняла ответы
+    пользователям. Обработчик события не ждёт отправки.
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable], rate: float = 5.0):
+        self.send = send
+        self.bucket = TokenBucket(rate, rate)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "failed": 0}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._send_loop())
+
+    def notify(self, chat_id: int, text: str):
+        self._queue.put_nowait((chat_id, text))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self, timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает рассылку"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений о совпадениях: {self._queue.qsize()}")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _send_loop(self):
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                await self.bucket.acquire()
+                await self.send(chat_id, text)
+                self.stats["sent"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Не удалось отправить совпадение в {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def format_listing_for_buyer(listing: Dict[str, str], channel: str) -> str:
+    return (
+        f"🔔 <b>Новое объявление по вашей заявке</b>\n\n"
+        f"🔥 {escape_html(listing.get('title', ''))}\n"
+        f"💵 <b>Цена:</b> {format_number(listing.get('price', ''))} ₽\n"
+        f"📍 <b>Город:</b> {escape_html(listing.get('city', ''))}\n"
+        f"🏷 <b>Категория:</b> {CATEGORIES.get(listing.get('category_idx', ''), '')}\n\n"
+        f"Подробности — в канале @{channel}"
+    )
+
+
+def format_listings_for_buyer(listings: List[Dict[str, str]], channel: str) -> str:
+    lines = [f"🔔 <b>Подходящие объявления ({len(listings)})</b>\n"]
+    for listing in listings:
+        lines.append(
+            f"• {escape_html(listing.get('title', ''))} — {format_number(listing.get('price', ''))} ₽"
+        )
+    lines.append(f"\nПодробности — в канале @{channel}")
+    return "\n".join(lines)
+
+
+def format_matches_for_moderators(listing: Dict[str, Any], buyers: List[Dict[str, str]]) -> str:
+    """Сводка для посредника: объявление и контакты подходящих покупателей"""
+    lines = [
+        f"🤝 <b>Совпадения:</b> {escape_html(listing.get('title', ''))} — "
+        f"{format_number(listing.get('price', ''))} ₽, {escape_html(listing.get('city', ''))}\n"
+    ]
+    for buyer in buyers:
+        lines.append(
+            f"• бюджет {escape_html(buyer.get('budget', ''))}, контакт {escape_html(buyer.get('contact', ''))}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,280 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Гистограммы задержек хендлеров, вызовов Bot API и команд Redis плюс счётчики ошибок.
+Запись метрики — bisect по границам корзин и пара сложений под GIL, без блокировок
+и внешних зависимостей, поэтому сбор можно держать включённым в проде.
+Отдаются по HTTP на /metrics (см. setup_metrics_route).
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import ctx_data, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+# Секунды: от быстрых команд Redis до медленных запросов к Bot API
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        # Функции, возвращающие готовые значения (gauge): {имя метрики: значение}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, value in collector().items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы хендлера", ("event", "handler"))
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("event", "handler"))
+BOT_API_LATENCY = REGISTRY.histogram(
+    "bot_api_request_seconds", "Время запроса к Bot API", ("method",))
+BOT_API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+REDIS_LATENCY = REGISTRY.histogram(
+    "redis_command_seconds", "Время команды Redis (pipeline — целиком)", ("command",))
+REDIS_ERRORS = REGISTRY.counter(
+    "redis_errors_total", "Ошибки команд Redis", ("command", "error"))
+
+
+def handler_name(handler: Optional[Callable]) -> str:
+    return getattr(handler, "__name__", "unknown")
+
+
+# =======================
+# Хендлеры
+# =======================
+
+# (событие, хендлер) текущего апдейта — чтобы засчитать исключение, дошедшее до errors_handler
+_current_handler: ContextVar[Optional[Tuple[str, str]]] = ContextVar("metrics_current_handler", default=None)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет каждый хендлер диспетчера: от прохождения фильтров до возврата"""
+
+    START_KEY = "_metrics_started"
+    HANDLER_KEY = "_metrics_handler"
+
+    async def _start(self, event: str, data: dict):
+        name = handler_name(current_handler.get(None))
+        data[self.HANDLER_KEY] = name
+        data[self.START_KEY] = time.perf_counter()
+        _current_handler.set((event, name))
+
+    async def _finish(self, event: str, data: dict):
+        started = data.get(self.START_KEY)
+        if started is None:
+            return
+        HANDLER_LATENCY.observe(time.perf_counter() - started, event, data[self.HANDLER_KEY])
+
+    async def on_pre_process_error(self, update: types.Update, exception: BaseException, data: dict):
+        current = _current_handler.get()
+        if current is not None:
+            HANDLER_ERRORS.inc(*current)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._start("message", data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        await self._finish("message", data)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        await self._start("callback_query", data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results, data: dict):
+        await self._finish("callback_query", data)
+
+    async def on_process_inline_query(self, inline_query: types.InlineQuery, data: dict):
+        await self._start("inline_query", data)
+
+    async def on_post_process_inline_query(self, inline_query: types.InlineQuery, results, data: dict):
+        await self._finish("inline_query", data)
+
+    async def on_process_chat_member(self, update: types.ChatMemberUpdated, data: dict):
+        await self._start("chat_member", data)
+
+    async def on_post_process_chat_member(self, update: types.ChatMemberUpdated, results, data: dict):
+        await self._finish("chat_member", data)
+
+
+def label_handler(event: str, handler: Callable):
+    """
+    Засчитывает текущий апдейт хендлеру handler, а не зарегистрированному в диспетчере
+    (CallbackRouter.dispatch сам выбирает хендлер): замер MetricsMiddleware и ошибки идут под его именем.
+    """
+    name = handler_name(handler)
+    _current_handler.set((event, name))
+    data = ctx_data.get(None)
+    if data is not None and MetricsMiddleware.HANDLER_KEY in data:
+        data[MetricsMiddleware.HANDLER_KEY] = name
+
+
+async def observe_handler(event: str, handler: Callable, *args, **kwargs):
+    """Вызов хендлера в обход диспетчера (например, из CallbackRouter) с замером"""
+    name = handler_name(handler)
+    _current_handler.set((event, name))
+    started = time.perf_counter()
+    try:
+        return await handler(*args, **kwargs)
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - started, event, name)
+
+
+# =======================
+# Bot API
+# =======================
+
+async def observe_bot_request(method: str, request: Callable, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return await request(*args, **kwargs)
+    except Exception as e:
+        BOT_API_ERRORS.inc(method, type(e).__name__)
+        raise
+    finally:
+        BOT_API_LATENCY.observe(time.perf_counter() - started, method)
+
+
+# =======================
+# Redis
+# =======================
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except Exception as e:
+            REDIS_ERRORS.inc(command, type(e).__name__)
+            raise
+        finally:
+            REDIS_LATENCY.observe(time.perf_counter() - started, command)
+
+
+class InstrumentedRedis(Redis):
+    """redis.asyncio.Redis, который пишет время и ошибки каждой команды в метрики"""
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception as e:
+            REDIS_ERRORS.inc(command, type(e).__name__)
+            raise
+        finally:
+            REDIS_LATENCY.observe(time.perf_counter() - started, command)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# =======================
+# HTTP
+# =======================
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+def setup_metrics_route(app: web.Application, path: str = "/metrics"):
+    app.router.add_get(path, metrics_handler)
+
+
+async def start_metrics_server(host: str, port: int, path: str = "/metrics") -> web.AppRunner:
+    """Отдельный HTTP-сервер для /metrics (в режиме polling своего aiohttp-приложения нет)"""
+    app = web.Application()
+    setup_metrics_route(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
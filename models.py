@@ -1,15 +1,20 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, Index
 from sqlalchemy.sql import func
-from db import Base
+from tg_bot.db import Base
 
 class Submission(Base):
     __tablename__ = "submissions"
 
     id = Column(String, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     type = Column(String, nullable=False)  # "sell" или "buy"
     data = Column(Text, nullable=False)  # JSON
     invited = Column(Boolean, default=False)
     rejected_all = Column(Boolean, default=False)
-    status = Column(String, default="pending")  # pending, published, rejected
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    status = Column(String, default="pending", index=True)  # pending, published, rejected
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+    __table_args__ = (
+        # очередь модерации: заявки в статусе по времени
+        Index("ix_submissions_status_created_at", "status", "created_at"),
+    )
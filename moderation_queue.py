@@ -0,0 +1,70 @@
+import time
+from typing import List, Optional, Tuple
+
+QUEUE_KEY = "moderation_queue"
+
+
+def status_key(status: str) -> str:
+    return f"submissions_status_{status}"
+
+
+class ModerationQueue:
+    """
+    Индекс заявок на модерации.
+    moderation_queue — sorted set (score = время подачи) только для ожидающих,
+    submissions_status_<status> — множество id заявок в каждом статусе.
+    Все операции — O(1) или O(log n), без KEYS/SCAN по всему keyspace.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def add(self, submission_id: str, created_at: Optional[float] = None):
+        submission_id = str(submission_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(QUEUE_KEY, {submission_id: created_at or time.time()})
+            pipe.sadd(status_key("pending"), submission_id)
+            await pipe.execute()
+
+    async def set_status(self, submission_id: str, status: str, old_status: str = "pending"):
+        submission_id = str(submission_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.smove(status_key(old_status), status_key(status), submission_id)
+            if status != "pending":
+                pipe.zrem(QUEUE_KEY, submission_id)
+            await pipe.execute()
+
+    async def count(self) -> int:
+        """Сколько заявок ждёт модерации"""
+        return await self.redis.zcard(QUEUE_KEY)
+
+    async def count_by_status(self, status: str) -> int:
+        return await self.redis.scard(status_key(status))
+
+    async def page(self, cursor: Optional[str] = None, limit: int = 10) -> Tuple[List[Tuple[str, float]], Optional[str]]:
+        """
+        Страница очереди от старых к новым.
+        cursor — "<score>:<n>": score последней показанной заявки и сколько заявок с этим score
+        уже показано (None — с начала). Одинаковый score у заявок, поданных в одну секунду или
+        импортированных пачкой, не теряет их на границе страниц.
+        Возвращает [(id, время подачи)] и курсор следующей страницы (None, если это конец).
+        ValueError — если курсор испорчен.
+        """
+        if cursor is None:
+            min_score, skip = "-inf", 0
+        else:
+            score, _, shown = cursor.partition(":")
+            last_score, skip = float(score), int(shown or 0)
+            min_score = repr(last_score)
+        items = await self.redis.zrangebyscore(
+            QUEUE_KEY, min_score, "+inf", start=skip, num=limit + 1, withscores=True
+        )
+        has_more = len(items) > limit
+        items = items[:limit]
+        if not has_more or not items:
+            return items, None
+        tail_score = items[-1][1]
+        same = sum(1 for _, item_score in items if item_score == tail_score)
+        if cursor is not None and tail_score == last_score:
+            same += skip  # вся страница с тем же score — пропускаем и показанные раньше
+        return items, f"{tail_score!r}:{same}"
@@ -1,22 +1,168 @@
-from redis.asyncio import Redis
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
 import json
+import os
 
+from redis.asyncio.connection import BlockingConnectionPool
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
 
-class RedisClient:
-    def __init__(self):
-        self.redis_client = Redis(
-            host='localhost',
-            port=6379,
-            db=0,
-            decode_responses=True
+from tg_bot.keyspace import PUBLISH_STEPS_TTL, REJECTION_STATE_TTL
+from tg_bot.metrics import InstrumentedRedis
+
+# Старый формат — список referral_invites_<id>: переносим в множество и счётчик при первом обращении
+_MIGRATE_LEGACY_INVITES = """
+local legacy = redis.call('LRANGE', KEYS[3], 0, -1)
+if #legacy > 0 then
+    local moved = 0
+    for _, member in ipairs(legacy) do
+        moved = moved + redis.call('SADD', KEYS[1], member)
+    end
+    redis.call('INCRBY', KEYS[2], moved)
+    redis.call('DEL', KEYS[3])
+end
+"""
+
+# Атомарно: дедуп приглашённого (SADD в множество за всё время) и счётчик текущего раунда (INCR)
+ADD_REFERRAL_SCRIPT = _MIGRATE_LEGACY_INVITES + """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return {0, tonumber(redis.call('GET', KEYS[2]) or '0')}
+end
+return {1, redis.call('INCR', KEYS[2])}
+"""
+
+# Атомарно: набрано ли ARGV[1] приглашений; если да — раунд засчитан и счётчик начинается заново.
+# Множество приглашённых не сбрасывается: один и тот же друг засчитывается один раз за всё время.
+# Из параллельных вызовов 1 вернёт ровно один
+CLAIM_REFERRALS_SCRIPT = _MIGRATE_LEGACY_INVITES + """
+if tonumber(redis.call('GET', KEYS[2]) or '0') < tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class RedisSettings:
+    host: str = "localhost"  # в docker-compose — redis
+    port: int = 6379
+    db: int = 0
+    password: Optional[str] = None
+    # Соединений на пул; блокирующие чтения воркера (XREADGROUP BLOCK) держат одно соединение
+    max_connections: int = 64
+    pool_timeout: float = 5.0  # сколько ждать свободного соединения
+    socket_timeout: float = 5.0  # больше, чем BLOCK у XREADGROUP в tg_bot.sharding
+    connect_timeout: float = 2.0
+    health_check_interval: int = 30  # PING перед командой на соединении, простоявшем дольше
+    retries: int = 3  # повторы при обрыве/таймауте, с экспоненциальной паузой
+
+    @classmethod
+    def from_env(cls) -> "RedisSettings":
+        return cls(
+            host=os.getenv("REDIS_HOST", cls.host),
+            port=int(os.getenv("REDIS_PORT", cls.port)),
+            db=int(os.getenv("REDIS_DB", cls.db)),
+            password=os.getenv("REDIS_PASSWORD") or None,
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", cls.max_connections)),
+            pool_timeout=float(os.getenv("REDIS_POOL_TIMEOUT", cls.pool_timeout)),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", cls.socket_timeout)),
+            connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", cls.connect_timeout)),
+            health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", cls.health_check_interval)),
+            retries=int(os.getenv("REDIS_RETRIES", cls.retries)),
+        )
+
+    def make_pool(self, decode_responses: bool) -> BlockingConnectionPool:
+        return BlockingConnectionPool(
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            host=self.host,
+            port=self.port,
+            db=self.db,
+            password=self.password,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.connect_timeout,
+            health_check_interval=self.health_check_interval,
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), self.retries),
+            retry_on_error=[ConnectionError, TimeoutError],
+            decode_responses=decode_responses,
         )
 
-    def ping(self):
-        print(self.redis_client.ping())
+
+class RedisClient:
+    """
+    Доступ к Redis для всего бота: один пул на процесс (на каждый вид клиента),
+    таймауты и повторы из RedisSettings.
+    Пачки команд — через pipeline()/mget()/mset(): один round-trip вместо команды на ключ.
+    """
+
+    def __init__(self, settings: Optional[RedisSettings] = None):
+        self.settings = settings or RedisSettings.from_env()
+        self.redis_client = InstrumentedRedis(connection_pool=self.settings.make_pool(decode_responses=True))
+        # Без декодирования ответов: для бинарных значений (см. serialization)
+        self.raw_client = InstrumentedRedis(connection_pool=self.settings.make_pool(decode_responses=False))
+        self._add_referral_script = self.redis_client.register_script(ADD_REFERRAL_SCRIPT)
+        self._claim_referrals_script = self.redis_client.register_script(CLAIM_REFERRALS_SCRIPT)
+
+    async def ping(self) -> bool:
+        return await self.redis_client.ping()
+
+    async def health_check(self) -> Dict[str, Any]:
+        """Доступность и занятость пулов — для readiness и логов"""
+        await self.redis_client.ping()
+        await self.raw_client.ping()
+        return {
+            "host": f"{self.settings.host}:{self.settings.port}/{self.settings.db}",
+            "max_connections": self.settings.max_connections,
+            "in_use": sum(
+                len(client.connection_pool._in_use_connections)
+                for client in (self.redis_client, self.raw_client)
+            ),
+        }
+
+    async def close(self):
+        await self.redis_client.aclose()
+        await self.raw_client.aclose()
+
+    # ---------- пачки команд ----------
+
+    def pipeline(self, transaction: bool = False, raw: bool = False):
+        """
+        async with redis_client.pipeline() as pipe:
+            pipe.get(...); pipe.expire(...)
+            results = await pipe.execute()
+        transaction=True — MULTI/EXEC, raw=True — ответы без декодирования
+        """
+        client = self.raw_client if raw else self.redis_client
+        return client.pipeline(transaction=transaction)
+
+    async def mget(self, keys: Iterable[str]) -> List[Optional[str]]:
+        keys = list(keys)
+        if not keys:
+            return []
+        return await self.redis_client.mget(keys)
+
+    async def mset(self, mapping: Mapping[str, Any], ex: Optional[int] = None):
+        """Запись нескольких ключей; с ex — SET EX на каждый ключ, но одним pipeline"""
+        if not mapping:
+            return
+        if ex is None:
+            await self.redis_client.mset(mapping)
+            return
+        async with self.pipeline() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+            await pipe.execute()
+
+    async def delete(self, *keys: str) -> int:
+        return await self.redis_client.delete(*keys) if keys else 0
+
+    # ---------- данные пользователей ----------
 
     async def set_user_data(self, user_id: int, data: dict):
         """Сохранить данные пользователя"""
-        await self.redis_client.set(f'{user_id}', json.dumps(data))
+        await self.redis_client.set(f"user:{user_id}", json.dumps(data))
 
     async def get_user_data(self, user_id: int) -> dict:
         """Получить данные пользователя"""
@@ -29,19 +175,63 @@ class RedisClient:
         current_data.update(kwargs)
         await self.set_user_data(user_id, current_data)
 
-    async def increment_message_count(self, user_id: int):
-        """Увеличить счетчик сообщений"""
-        await self.redis_client.incr(f"stats:messages:{user_id}")
-
-    async def get_message_count(self, user_id: int) -> int:
-        """Получить количество сообщений от пользователя"""
-        count = self.redis_client.get(f"stats:messages:{user_id}")
-        return int(count) if count else 0
-
     async def add_to_list(self, user_id: int, item: str):
         """Добавить элемент в список пользователя"""
-        self.redis_client.rpush(f"user_list:{user_id}", item)
+        await self.redis_client.rpush(f"user_list:{user_id}", item)
 
     async def get_list(self, user_id: int) -> list:
         """Получить список пользователя"""
-        return self.redis_client.lrange(f"user_list:{user_id}", 0, -1)
\ No newline at end of file
+        return await self.redis_client.lrange(f"user_list:{user_id}", 0, -1)
+
+    @staticmethod
+    def _referral_keys(referrer_id: int) -> List[str]:
+        return [f"referral_members_{referrer_id}", f"referral_count_{referrer_id}", f"referral_invites_{referrer_id}"]
+
+    async def add_referral(self, referrer_id: int, user_id: int) -> Tuple[bool, int]:
+        """
+        Учитывает приглашённого пользователя в текущем раунде приглашений.
+        Возвращает (добавлен ли впервые, кол-во приглашённых в раунде)
+        """
+        added, count = await self._add_referral_script(keys=self._referral_keys(referrer_id), args=[user_id])
+        return bool(added), int(count)
+
+    async def claim_referrals(self, referrer_id: int, threshold: int) -> bool:
+        """
+        Засчитывает раунд, если в нём набралось threshold приглашённых, и обнуляет счётчик:
+        следующее объявление собирает новых приглашённых (уже учтённые повторно не считаются). True — ровно одному из параллельных вызовов.
+        Приглашения, пришедшие, пока пригласивший ничего не ждал, не теряются — они ждут этого вызова.
+        """
+        return bool(await self._claim_referrals_script(keys=self._referral_keys(referrer_id), args=[threshold]))
+
+    # ---------- модерация ----------
+
+    @staticmethod
+    def _rejection_key(mod_id: int) -> str:
+        return f"mod_rejection_state_{mod_id}"
+
+    async def set_rejection_target(self, mod_id: int, submission_id: str, ttl: int = REJECTION_STATE_TTL):
+        """Заявка, для которой модератор сейчас пишет причину отклонения (брошенная — истекает)"""
+        await self.redis_client.set(self._rejection_key(mod_id), str(submission_id), ex=ttl)
+
+    async def get_rejection_target(self, mod_id: int) -> Optional[str]:
+        return await self.redis_client.get(self._rejection_key(mod_id))
+
+    async def clear_rejection_target(self, mod_id: int):
+        await self.redis_client.delete(self._rejection_key(mod_id))
+
+    @staticmethod
+    def _publish_steps_key(submission_id: str) -> str:
+        return f"publish_steps_{submission_id}"
+
+    async def get_publish_steps(self, submission_id: str) -> set:
+        """Части поста, которые прошлая попытка публикации уже отправила в канал"""
+        return await self.redis_client.smembers(self._publish_steps_key(submission_id))
+
+    async def mark_publish_step(self, submission_id: str, step: str, ttl: int = PUBLISH_STEPS_TTL):
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.sadd(self._publish_steps_key(submission_id), step)
+            pipe.expire(self._publish_steps_key(submission_id), ttl)
+            await pipe.execute()
+
+    async def clear_publish_steps(self, submission_id: str):
+        await self.redis_client.delete(self._publish_steps_key(submission_id))
@@ -0,0 +1,248 @@
+"""
+Поиск по опубликованным объявлениям для inline-режима (@bot кафе Новосибирск до 2млн).
+
+Обратный индекс в Redis:
+    search_term_<терм> — множество id объявлений. Термы — слова названия, города и категории
+    (и их префиксы от MIN_PREFIX символов: inline-запрос набирается по буквам)
+    и хэштеги объявления из build_hashtags (#новосибирск, #до2млн, #бьюти) — только целиком;
+    search_price — id → цена, search_recent — id → время публикации;
+    search_listing_<id> — карточка с готовым HTML для ответа.
+
+Запрос: хэштеги и слова — пересечение множеств термов, «до 2 млн» — фильтр по цене
+(слово короче MIN_PREFIX есть в индексе только целиком — если такого терма нет, слово пропускается)
+(ZINTERSTORE + ZREMRANGEBYSCORE на сервере, одной транзакцией), сортировка — новые первыми.
+Список id результата кэшируется по нормализованному запросу на cache_ttl секунд;
+в ключе кэша — версия индекса, поэтому новое объявление сразу видно в поиске.
+Страницы читаются из кэша, индекс повторно не трогается: next_offset — «<версия>:<позиция>»,
+следующие страницы берут кэш той версии, с которой начали, и не съезжают, если индекс тем временем изменился.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.types import ParseMode
+
+from tg_bot.constants import CATEGORIES
+from tg_bot.listing import build_hashtags
+from tg_bot.matching import LISTING_TTL, parse_budget
+from tg_bot.utils import escape_html, format_number, safe_int
+
+logger = logging.getLogger(__name__)
+
+PRICE_KEY = "search_price"
+RECENT_KEY = "search_recent"
+VERSION_KEY = "search_version"
+
+MIN_PREFIX = 3
+MAX_PREFIX = 12
+MAX_RESULTS = 500  # дальше листать inline-выдачу никто не будет
+PAGE_SIZE = 20  # Telegram принимает до 50 результатов на ответ
+MIN_PRICE = 10_000  # число меньше — не цена
+
+_WORD = re.compile(r"\w+")
+_HASHTAG = re.compile(r"#(\w+)")
+_PRICE = re.compile(
+    r"(?<!\w)(?:(?:до|дешевле|не\s+дороже)\s*)?\d[\d\s]*(?:[.,]\d+)?\s*(?:млн|миллион\w*|тыс\w*|м|к|т)?(?!\w)",
+    re.IGNORECASE,
+)
+# Слова запроса, которых нет в названиях и по которым искать бессмысленно
+STOP_WORDS = {"до", "от", "в", "во", "на", "и", "с", "за", "по", "руб", "рублей", "рубля", "млн", "тыс"}
+
+
+def term_key(term: str) -> str:
+    return f"search_term_{term}"
+
+
+def card_key(listing_id: str) -> str:
+    return f"search_listing_{listing_id}"
+
+
+def cache_key(version: int, query: str) -> str:
+    return f"search_cache_{version}_{hashlib.sha1(query.encode()).hexdigest()[:16]}"
+
+
+def parse_offset(offset: str) -> Tuple[Optional[int], int]:
+    """offset inline-запроса → (версия индекса или None для первой страницы, позиция)"""
+    version, _, position = str(offset or "").partition(":")
+    if not position:
+        return None, 0
+    return safe_int(version), max(safe_int(position) or 0, 0)
+
+
+def _normalize(text: str) -> str:
+    return str(text or "").lower().replace("ё", "е")
+
+
+def _word_terms(text: str) -> Iterable[str]:
+    """Слова и их префиксы"""
+    for word in _WORD.findall(_normalize(text)):
+        if len(word) < 2:
+            continue
+        yield word[:MAX_PREFIX]
+        for size in range(MIN_PREFIX, min(len(word), MAX_PREFIX)):
+            yield word[:size]
+
+
+def listing_terms(data: Dict[str, Any]) -> List[str]:
+    """Термы объявления: слова названия, города и категории + хэштеги канала"""
+    terms = set()
+    category = CATEGORIES.get(data.get("category_idx", ""), "")
+    for text in (data.get("title", ""), data.get("city", ""), category):
+        terms.update(_word_terms(text))
+    terms.update(f"#{tag}" for tag in _HASHTAG.findall(_normalize(build_hashtags(data))))
+    return sorted(terms)
+
+
+def parse_query(text: str) -> Tuple[Tuple[str, ...], Optional[int]]:
+    """
+    Запрос → (термы, максимальная цена).
+    Хэштеги ищутся как есть (#до2млн — ценовой хэштег канала), числа с «до»/«млн»/«к» — фильтр цены,
+    остальные слова — по префиксу (короче MIN_PREFIX — только целиком, см. ListingSearch._query).
+    """
+    text = _normalize(text)
+    terms = {f"#{tag}" for tag in _HASHTAG.findall(text)}
+    text = _HASHTAG.sub(" ", text)
+    prices = []
+
+    def take_price(match) -> str:
+        price = parse_budget(match.group())
+        if price is None or price < MIN_PRICE:
+            return match.group()  # «кофейня 24» — это часть названия, а не цена
+        prices.append(price)
+        return " "
+
+    text = _PRICE.sub(take_price, text)
+    terms.update(word[:MAX_PREFIX] for word in _WORD.findall(text) if len(word) >= 2 and word not in STOP_WORDS)
+    return tuple(sorted(terms)), (max(prices) if prices else None)
+
+
+class ListingSearch:
+    def __init__(self, redis, cache_ttl: int = 300, max_age: int = LISTING_TTL):
+        self.redis = redis
+        self.cache_ttl = cache_ttl
+        self.max_age = max_age
+        self.stats = {"indexed": 0, "queries": 0, "cache_hits": 0, "pruned": 0}
+
+    async def add(self, listing_id: str, data: Dict[str, Any], html: str):
+        listing_id = str(listing_id)
+        terms = listing_terms(data)
+        now = time.time()
+        card = {
+            "id": listing_id,
+            "title": data.get("title", ""),
+            "price": safe_int(data.get("price")) or 0,
+            "city": data.get("city", ""),
+            "category_idx": data.get("category_idx", ""),
+            "html": html,
+            "terms": " ".join(terms),
+        }
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(card_key(listing_id), mapping=card)
+            for term in terms:
+                pipe.sadd(term_key(term), listing_id)
+            pipe.zadd(PRICE_KEY, {listing_id: card["price"]})
+            pipe.zadd(RECENT_KEY, {listing_id: now})
+            pipe.incr(VERSION_KEY)
+            await pipe.execute()
+        self.stats["indexed"] += 1
+        await self.prune(now - self.max_age)
+
+    async def prune(self, older_than: float, batch: int = 100):
+        """Убирает из индекса объявления, опубликованные раньше older_than"""
+        stale = await self.redis.zrangebyscore(RECENT_KEY, "-inf", older_than, start=0, num=batch)
+        if not stale:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for listing_id in stale:
+                pipe.hget(card_key(listing_id), "terms")
+            terms = await pipe.execute()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for listing_id, stored in zip(stale, terms):
+                for term in (stored or "").split():
+                    pipe.srem(term_key(term), listing_id)
+                pipe.delete(card_key(listing_id))
+            pipe.zrem(PRICE_KEY, *stale)
+            pipe.zrem(RECENT_KEY, *stale)
+            pipe.incr(VERSION_KEY)
+            await pipe.execute()
+        self.stats["pruned"] += len(stale)
+
+    async def search(self, query: str, offset: str = "", limit: int = PAGE_SIZE) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """Страница результатов и offset следующей (None — это последняя)"""
+        self.stats["queries"] += 1
+        terms, max_price = parse_query(query)
+        normalized = " ".join(terms) + f"|{max_price or ''}"
+        version, offset = parse_offset(offset)
+        if version is None:
+            version = int(await self.redis.get(VERSION_KEY) or 0)
+        key = cache_key(version, normalized)
+
+        cached = await self.redis.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            ids = json.loads(cached)
+        else:
+            ids = await self._query(terms, max_price)
+            await self.redis.set(key, json.dumps(ids), ex=self.cache_ttl)
+
+        page = ids[offset:offset + limit]
+        if not page:
+            return [], None
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for listing_id in page:
+                pipe.hgetall(card_key(listing_id))
+            cards = await pipe.execute()
+        next_offset = f"{version}:{offset + limit}" if len(ids) > offset + limit else None
+        return [card for card in cards if card], next_offset
+
+    async def _known_terms(self, terms: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Без коротких слов, которых нет в индексе целиком: их префиксы не индексируются, пересечение было бы пустым"""
+        short = [term for term in terms if not term.startswith("#") and len(term) < MIN_PREFIX]
+        if not short:
+            return terms
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for term in short:
+                pipe.exists(term_key(term))
+            missing = {term for term, exists in zip(short, await pipe.execute()) if not exists}
+        return tuple(term for term in terms if term not in missing)
+
+    async def _query(self, terms: Tuple[str, ...], max_price: Optional[int]) -> List[str]:
+        terms = await self._known_terms(terms)
+        if not terms and max_price is None:
+            return await self.redis.zrevrange(RECENT_KEY, 0, MAX_RESULTS - 1)
+        tmp = f"search_tmp_{uuid.uuid4().hex}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # score = цена; множества термов — с весом 0, они только отсекают
+            pipe.zinterstore(tmp, {PRICE_KEY: 1, **{term_key(term): 0 for term in terms}})
+            if max_price is not None:
+                pipe.zremrangebyscore(tmp, f"({max_price}", "+inf")
+            # score = время публикации, чтобы новые были первыми
+            pipe.zinterstore(tmp, {tmp: 0, RECENT_KEY: 1})
+            pipe.zrevrange(tmp, 0, MAX_RESULTS - 1)
+            pipe.delete(tmp)
+            results = await pipe.execute()
+        return results[-2]
+
+
+def build_inline_results(cards: List[Dict[str, str]]) -> List[types.InlineQueryResultArticle]:
+    return [
+        types.InlineQueryResultArticle(
+            id=card["id"],
+            title=card.get("title") or "Объявление",
+            description=(
+                f"{format_number(card.get('price', ''))} ₽ · {card.get('city', '')} · "
+                f"{CATEGORIES.get(card.get('category_idx', ''), '')}"
+            ),
+            input_message_content=types.InputTextMessageContent(
+                card.get("html") or escape_html(card.get("title", "")),
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+            ),
+        )
+        for card in cards
+    ]
@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from tg_bot.metrics import observe_bot_request
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше, тем раньше уходит при конкуренции за токены
+PRIORITY_USER = 0
+PRIORITY_MODERATION = 1
+PRIORITY_CHANNEL = 2
+
+# Методы, которые Telegram считает отправкой сообщений (на них действуют лимиты)
+SEND_METHODS = {
+    "sendMessage",
+    "sendMediaGroup",
+    "sendDocument",
+    "sendVideoNote",
+    "sendPhoto",
+    "sendVideo",
+    "copyMessage",
+    "forwardMessage",
+}
+
+MAX_SEND_ATTEMPTS = 5
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity.
+    Ожидающие получают токены в порядке приоритета, внутри приоритета — по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters = []  # heap: (priority, seq, amount, future)
+        self._seq = itertools.count()
+        self._grant_task: Optional[asyncio.Task] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return not self._waiters and self.tokens >= self.capacity and time.monotonic() >= self.paused_until
+
+    def pause(self, seconds: float):
+        """Ничего не выдаём seconds секунд (ответ 429 от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until  # токены снова начнут копиться только после паузы
+
+    async def acquire(self, priority: int = PRIORITY_USER, amount: float = 1):
+        amount = min(amount, self.capacity)
+        self._refill()
+        if not self._waiters and self.tokens >= amount and time.monotonic() >= self.paused_until:
+            self.tokens -= amount
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), amount, future))
+        if self._grant_task is None or self._grant_task.done():
+            self._grant_task = asyncio.ensure_future(self._grant_loop())
+        await future
+
+    async def _grant_loop(self):
+        while self._waiters:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            priority, seq, amount, future = self._waiters[0]
+            if future.done():  # ожидающего отменили
+                heapq.heappop(self._waiters)
+                continue
+
+            self._refill()
+            if self.tokens >= amount:
+                heapq.heappop(self._waiters)
+                self.tokens -= amount
+                future.set_result(None)
+            else:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class ScheduledBot(Bot):
+    """
+    Bot, у которого все исходящие сообщения проходят через планировщик:
+    общий лимит на бота + лимит на каждый чат, приоритеты
+    (ответы пользователям > модерация > канал) и автоматический повтор после RetryAfter.
+    """
+
+    def __init__(self, *args,
+                 channel_ids: Iterable[int] = (),
+                 moderation_ids: Iterable[int] = (),
+                 global_rate: float = 30,
+                 private_rate: float = 1,
+                 group_rate: float = 20 / 60,
+                 group_burst: float = 5,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channel_ids = {int(c) for c in channel_ids}
+        self.moderation_ids = {int(c) for c in moderation_ids}
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+    def get_priority(self, chat_id: int) -> int:
+        if chat_id in self.channel_ids:
+            return PRIORITY_CHANNEL
+        if chat_id in self.moderation_ids:
+            return PRIORITY_MODERATION
+        return PRIORITY_USER
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: v for k, v in self.chat_buckets.items() if not v.is_idle()}
+            if chat_id < 0:
+                # Группы и каналы: ~20 сообщений в минуту, разрешаем небольшой всплеск
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, 3)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    @staticmethod
+    def _cost(method: str, data: Dict) -> int:
+        """Альбом считается Telegram'ом как несколько сообщений"""
+        if method == "sendMediaGroup":
+            media = data.get("media")
+            if isinstance(media, str):
+                return max(1, len(json.loads(media)))
+        return 1
+
+    async def reserve(self, chat_id: Optional[int], cost: float = 1):
+        """
+        Ждёт токены на отправку в chat_id: лимит чата, затем общий лимит бота.
+        Отдельно нужен для ответов в теле вебхука — они уходят в Telegram мимо request.
+        """
+        priority = self.get_priority(chat_id) if chat_id is not None else PRIORITY_CHANNEL
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire(priority, cost)
+        await self.global_bucket.acquire(priority, cost)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method not in SEND_METHODS or not data or "chat_id" not in data:
+            return await observe_bot_request(method, super().request, method, data, files, **kwargs)
+
+        try:
+            chat_id = int(data["chat_id"])
+        except (TypeError, ValueError):
+            # @username канала — считаем каналом без отдельного лимита на чат
+            chat_id = None
+
+        cost = self._cost(method, data)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            await self.reserve(chat_id, cost)
+            try:
+                return await observe_bot_request(method, super().request, method, data, files, **kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_SEND_ATTEMPTS:
+                    raise
+                logger.warning(f"RetryAfter {e.timeout}s для {method} в чат {chat_id} (попытка {attempt})")
+                if chat_bucket is not None:
+                    chat_bucket.pause(e.timeout)
+                else:
+                    await asyncio.sleep(e.timeout)
+
+
+class ChatPipeline:
+    """
+    Очереди отправки по чатам: внутри одного чата шаги идут строго по порядку,
+    разные чаты отправляются параллельно. submit не ждёт отправки — возвращает задачу.
+    """
+
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, *steps: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Ставит шаги (функции без аргументов, возвращающие корутину) в очередь чата"""
+        previous = self._tails.get(chat_id)
+        task = asyncio.ensure_future(self._run(previous, steps))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._release(chat_id, t))
+        return task
+
+    def _release(self, chat_id: int, task: asyncio.Task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    @staticmethod
+    async def _run(previous: Optional[asyncio.Task], steps) -> List[Any]:
+        if previous is not None:
+            # Ошибка предыдущей партии не должна ломать следующую
+            await asyncio.wait([previous])
+        return [await step() for step in steps]
+
+    async def join(self):
+        """Дожидается всех поставленных отправок (для корректной остановки)"""
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
@@ -0,0 +1,106 @@
+"""
+Сериализация данных FSM и заявок для Redis.
+
+Каждая запись начинается с заголовка: 0xFF, метка кодека (b"j" — JSON, b"m" — msgpack)
+и версия схемы. Кодек для чтения берётся из заголовка, поэтому смена кодека (Config.serialization_codec)
+не ломает уже сохранённые записи, а записи без заголовка (старый json.dumps) читаются как JSON.
+"""
+import json
+from typing import Any, Callable, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен
+    msgpack = None
+
+MAGIC = b"\xff"
+SCHEMA_VERSION = 1
+HEADER_SIZE = 3
+
+
+class JsonCodec:
+    """JSON: orjson, если установлен, иначе стандартный json"""
+
+    tag = b"j"
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    @staticmethod
+    def loads(raw: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+
+
+class MsgpackCodec:
+    """Бинарный msgpack: компактнее JSON на длинных списках file_id и тексте"""
+
+    tag = b"m"
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(raw: bytes) -> Any:
+        return msgpack.unpackb(raw, raw=False)
+
+
+CODECS = {
+    "json": JsonCodec,
+    "msgpack": MsgpackCodec,
+}
+CODECS_BY_TAG = {codec.tag: codec for codec in CODECS.values()}
+
+# Миграции данных между версиями схемы: {старая версия: функция(obj) -> obj новой версии}
+UPGRADES: Dict[int, Callable[[Any], Any]] = {}
+
+
+def upgrade(obj: Any, version: int) -> Any:
+    while version < SCHEMA_VERSION:
+        obj = UPGRADES[version](obj)
+        version += 1
+    return obj
+
+
+class Serializer:
+    """Кодирует значения выбранным кодеком и читает записи любого поддерживаемого формата"""
+
+    def __init__(self, codec: str = "json"):
+        if codec not in CODECS:
+            raise ValueError(f"Неизвестный кодек: {codec}")
+        if codec == "msgpack" and msgpack is None:
+            raise RuntimeError("Для кодека msgpack нужен пакет msgpack")
+        self.codec = CODECS[codec]
+        self._header = MAGIC + self.codec.tag + bytes([SCHEMA_VERSION])
+
+    def encode(self, obj: Any) -> bytes:
+        return self._header + self.codec.dumps(obj)
+
+    def decode(self, raw: Union[bytes, str, None]) -> Any:
+        if raw is None:
+            return None
+        if isinstance(raw, str):
+            raw = raw.encode()
+        if raw[:1] != MAGIC:
+            # Старая запись без заголовка
+            return json.loads(raw)
+        codec = CODECS_BY_TAG.get(raw[1:2])
+        if codec is None:
+            raise ValueError(f"Неизвестная метка кодека в записи: {raw[1:2]!r}")
+        if codec is MsgpackCodec and msgpack is None:
+            raise RuntimeError("Запись в формате msgpack, а пакет msgpack не установлен")
+        return upgrade(codec.loads(raw[HEADER_SIZE:]), raw[2])
+
+
+# Для кода без Config (бенчмарки, утилиты); бот создаёт Serializer(config.serialization_codec)
+default_serializer = Serializer()
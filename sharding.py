@@ -0,0 +1,243 @@
+"""
+Горизонтальное масштабирование: приём апдейтов отдельно от их обработки.
+
+Ingress (BOT_MODE=ingress) получает апдейты обычным polling/webhook и складывает их
+в Redis Streams updates_stream_<N>, где N = user_id % UPDATE_PARTITIONS.
+Воркеры (BOT_MODE=worker) читают свои партиции через consumer group:
+партиция принадлежит ровно одному воркеру, внутри неё апдейты обрабатываются по очереди,
+поэтому апдейты одного пользователя не обгоняют друг друга.
+Запись подтверждается (XACK) после обработки; неподтверждённые записи после падения
+воркера перечитываются при его рестарте или забираются через XAUTOCLAIM.
+"""
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiogram import Bot, Dispatcher, types
+from redis.exceptions import ResponseError
+
+from tg_bot.idempotency import UpdateInProgress
+
+logger = logging.getLogger(__name__)
+
+STREAM_PREFIX = "updates_stream_"
+GROUP = "update_workers"
+PAYLOAD_FIELD = "update"
+
+
+def stream_key(partition: int) -> str:
+    return f"{STREAM_PREFIX}{partition}"
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Автор апдейта (from), для постов в каналах — чат"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        author = event.get("from") or event.get("chat") or {}
+        return int(author.get("id", 0))
+    return 0
+
+
+def worker_partitions(index: int, count: int, partitions: int) -> List[int]:
+    """Партиции воркера index из count (каждая партиция — ровно у одного воркера)"""
+    return [p for p in range(partitions) if p % count == index]
+
+
+class UpdatePublisher:
+    """Складывает апдейты в стримы партиций одним pipeline на пачку"""
+
+    def __init__(self, redis, partitions: int = 64, maxlen: int = 100_000):
+        self.redis = redis
+        self.partitions = partitions
+        self.maxlen = maxlen
+        # Пачки polling'а обрабатываются отдельными задачами — лок сохраняет их порядок
+        self._lock = asyncio.Lock()
+
+    def partition(self, update: Dict[str, Any]) -> int:
+        return update_user_id(update) % self.partitions
+
+    async def publish(self, updates: Iterable[Dict[str, Any]]):
+        async with self._lock:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for update in updates:
+                    pipe.xadd(
+                        stream_key(self.partition(update)),
+                        {PAYLOAD_FIELD: json.dumps(update, ensure_ascii=False)},
+                        maxlen=self.maxlen,
+                        approximate=True,
+                    )
+                await pipe.execute()
+
+
+class IngressDispatcher(Dispatcher):
+    """
+    Dispatcher без хендлеров: вместо обработки публикует апдейты в стримы.
+    Подходит и для start_polling, и для start_webhook (см. tg_bot.webhook.run).
+    """
+
+    def __init__(self, bot: Bot, publisher: UpdatePublisher, **kwargs):
+        super().__init__(bot, **kwargs)
+        self.publisher = publisher
+
+    async def process_updates(self, updates, fast: bool = True):
+        await self.publisher.publish(update.to_python() for update in updates)
+        return []
+
+    async def process_update(self, update: types.Update):
+        await self.publisher.publish([update.to_python()])
+
+
+class ShardWorker:
+    """
+    Обрабатывает апдейты своих партиций хендлерами dp.
+    Партиции обрабатываются параллельно, записи внутри партиции — последовательно.
+    """
+
+    def __init__(self, dp: Dispatcher, redis, partitions: Iterable[int], consumer: str,
+                 group: str = GROUP, batch_size: int = 50, block_ms: int = 1000,
+                 claim_idle_ms: int = 60_000, claim_interval: float = 30.0):
+        self.dp = dp
+        self.redis = redis
+        self.streams = [stream_key(p) for p in partitions]
+        self.consumer = consumer
+        self.group = group
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self._stopping = False  # stop() мог прийти ещё во время on_startup
+
+    async def setup(self):
+        for stream in self.streams:
+            try:
+                await self.redis.xgroup_create(stream, self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def run(self):
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        await self.setup()
+        logger.info(f"Воркер {self.consumer}: партиции {', '.join(self.streams)}")
+        # После рестарта сначала дорабатываем то, что взяли, но не подтвердили
+        for stream in self.streams:
+            await self._drain_pending(stream)
+        next_claim = time.monotonic() + self.claim_interval
+        while not self._stopping:
+            try:
+                if time.monotonic() >= next_claim:
+                    for stream in self.streams:
+                        await self._claim_stale(stream)
+                    next_claim = time.monotonic() + self.claim_interval
+                # Одно блокирующее чтение на все партиции воркера — одно соединение из пула
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer, {stream: ">" for stream in self.streams},
+                    count=self.batch_size, block=self.block_ms,
+                )
+                # Партиции — параллельно, записи внутри партиции — по порядку
+                await asyncio.gather(*(self._handle_entries(stream, entries) for stream, entries in response or []))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Ошибка чтения стримов: {e}")
+                await asyncio.sleep(1)
+
+    def stop(self):
+        self._stopping = True
+
+    async def _drain_pending(self, stream: str):
+        last_id = "0"
+        while True:
+            response = await self.redis.xreadgroup(
+                self.group, self.consumer, {stream: last_id}, count=self.batch_size
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                return
+            logger.warning(f"{stream}: повторная обработка {len(entries)} неподтверждённых апдейтов")
+            await self._handle_entries(stream, entries)
+            # Неподтверждённые (UpdateInProgress) остаются в PEL — идём дальше по id
+            last_id = entries[-1][0]
+
+    async def _claim_stale(self, stream: str):
+        """Забирает записи, зависшие у упавших (или переименованных) потребителей"""
+        start = "0-0"
+        while True:
+            # Redis 7 добавляет третьим элементом удалённые id — они не нужны
+            result = await self.redis.xautoclaim(
+                stream, self.group, self.consumer, self.claim_idle_ms, start_id=start, count=self.batch_size
+            )
+            next_start, entries = result[0], result[1]
+            if entries:
+                logger.warning(f"{stream}: забрано {len(entries)} зависших апдейтов")
+                await self._handle_entries(stream, entries)
+            if not entries or next_start in ("0-0", b"0-0"):
+                return
+            start = next_start
+
+    async def _handle_entries(self, stream: str, entries: List[Any]):
+        for entry_id, fields in entries:
+            if fields is None:
+                # Запись удалена из стрима (MAXLEN), обрабатывать нечего
+                await self.redis.xack(stream, self.group, entry_id)
+                continue
+            try:
+                update = types.Update(**json.loads(fields[PAYLOAD_FIELD]))
+                # Отдельная задача — отдельный контекст: фильтры aiogram кэшируют
+                # состояние FSM в ContextVar, и в общем контексте оно бы протухло
+                await asyncio.create_task(self.dp.updates_handler.notify(update))
+            except UpdateInProgress:
+                # Апдейт держит другой обработчик; не подтверждаем — если тот упал,
+                # запись заберёт XAUTOCLAIM после истечения его аренды
+                logger.warning(f"{stream}/{entry_id}: апдейт уже обрабатывается, откладываем")
+                continue
+            except Exception as e:
+                # Ошибка хендлера не должна крутить апдейт по кругу
+                logger.exception(f"Ошибка обработки {stream}/{entry_id}: {e}")
+            await self.redis.xack(stream, self.group, entry_id)
+
+
+def run_worker(worker: ShardWorker, on_startup: Optional[callable] = None,
+               on_shutdown: Optional[callable] = None):
+    """
+    Запускает воркер до Ctrl+C / SIGTERM (docker stop).
+    Сигнал останавливает чтение стримов: текущая пачка дорабатывается, затем выполняется on_shutdown.
+    """
+    loop = asyncio.get_event_loop()
+
+    async def main():
+        if on_startup is not None:
+            await on_startup(worker.dp)
+        try:
+            await worker.run()
+        finally:
+            if on_shutdown is not None:
+                await on_shutdown(worker.dp)
+
+    def request_stop():
+        logger.warning("Получен сигнал остановки, воркер завершает текущую пачку")
+        worker.stop()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except (NotImplementedError, RuntimeError):  # Windows или не главный поток
+            pass
+
+    task = loop.create_task(main())
+    try:
+        loop.run_until_complete(task)
+    except (KeyboardInterrupt, SystemExit):
+        # Сигнал мимо обработчика: прерываем задачу и всё равно дожидаемся on_shutdown
+        worker.stop()
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+    logger.warning("Воркер остановлен")
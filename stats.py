@@ -0,0 +1,181 @@
+"""
+Статистика использования бота.
+
+Счётчики (сообщения, нажатия, начатые опросы, заявки) копятся в памяти процесса
+и раз в flush_interval секунд уходят в Redis одним pipeline:
+    stats_daily_<YYYYMMDD> — хэш счётчиков за день, stats_total — за всё время.
+Уникальные пользователи — HyperLogLog (12 КБ на ключ при любом числе пользователей,
+погрешность ~0.8%): stats_dau_<YYYYMMDD>, stats_mau_<YYYYMM>.
+Чтение (/stats) — фиксированный набор ключей одним pipeline, без SCAN/KEYS.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+TOTAL_KEY = "stats_total"
+DAILY_TTL = 90 * 24 * 3600
+MONTHLY_TTL = 400 * 24 * 3600
+
+
+def daily_key(day: date) -> str:
+    return f"stats_daily_{day:%Y%m%d}"
+
+
+def dau_key(day: date) -> str:
+    return f"stats_dau_{day:%Y%m%d}"
+
+
+def mau_key(day: date) -> str:
+    return f"stats_mau_{day:%Y%m}"
+
+
+class UsageStats:
+    """
+    incr/seen — только запись в словарь (без await и без запросов к Redis).
+    Счётчики разложены по дням события, чтобы сброс после полуночи не сдвигал их на следующий день.
+    """
+
+    def __init__(self, redis, flush_interval: float = 10.0):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self._counters: Dict[date, Counter] = defaultdict(Counter)
+        self._users: Dict[date, Set[int]] = defaultdict(set)
+        self._task: Optional[asyncio.Task] = None
+
+    def incr(self, name: str, amount: int = 1):
+        self._counters[date.today()][name] += amount
+
+    def seen(self, user_id: int):
+        self._users[date.today()].add(user_id)
+
+    # ---------- жизненный цикл ----------
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Остановка бота не должна обрываться из-за статистики: несохранённое только в лог
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.exception(f"Статистика при остановке не сохранена: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"Не удалось сбросить статистику: {e}")
+
+    async def flush(self):
+        """Всё накопленное — одним pipeline; при ошибке накопленное возвращается в буфер"""
+        counters, users = self._counters, self._users
+        if not counters and not users:
+            return
+        self._counters, self._users = defaultdict(Counter), defaultdict(set)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for day, values in counters.items():
+                    for name, amount in values.items():
+                        pipe.hincrby(daily_key(day), name, amount)
+                        pipe.hincrby(TOTAL_KEY, name, amount)
+                    pipe.expire(daily_key(day), DAILY_TTL)
+                for day, user_ids in users.items():
+                    pipe.pfadd(dau_key(day), *user_ids)
+                    pipe.expire(dau_key(day), DAILY_TTL)
+                    pipe.pfadd(mau_key(day), *user_ids)
+                    pipe.expire(mau_key(day), MONTHLY_TTL)
+                await pipe.execute()
+        except Exception:
+            for day, values in counters.items():
+                self._counters[day].update(values)
+            for day, user_ids in users.items():
+                self._users[day].update(user_ids)
+            raise
+
+    # ---------- чтение ----------
+
+    async def report(self, day: Optional[date] = None) -> Dict[str, Any]:
+        """Сводка за день: счётчики дня и за всё время, DAU, WAU (7 дней), MAU"""
+        day = day or date.today()
+        week = [dau_key(day - timedelta(days=i)) for i in range(7)]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(daily_key(day))
+            pipe.hgetall(TOTAL_KEY)
+            pipe.pfcount(dau_key(day))
+            pipe.pfcount(*week)  # PFCOUNT по нескольким ключам — оценка объединения
+            pipe.pfcount(mau_key(day))
+            today, total, dau, wau, mau = await pipe.execute()
+        return {
+            "day": day,
+            "today": {name: int(value) for name, value in today.items()},
+            "total": {name: int(value) for name, value in total.items()},
+            "dau": dau,
+            "wau": wau,
+            "mau": mau,
+        }
+
+
+class StatsMiddleware(BaseMiddleware):
+    """
+    Считает апдейты и пользователей в pre_process. Ставится до CallbackRouter: неизвестные
+    и устаревшие кнопки роутер отбрасывает (CancelHandler), но нажатие уже посчитано.
+    Найденные кнопки вызывает CallbackRouter.dispatch — обычный хендлер диспетчера.
+    """
+
+    def __init__(self, stats: UsageStats):
+        super().__init__()
+        self.stats = stats
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self.stats.incr("messages")
+        if message.from_user is not None and message.chat.type == types.ChatType.PRIVATE:
+            self.stats.seen(message.from_user.id)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.stats.incr("callbacks")
+        self.stats.seen(callback_query.from_user.id)
+
+    async def on_pre_process_inline_query(self, inline_query: types.InlineQuery, data: dict):
+        self.stats.incr("inline_queries")
+        self.stats.seen(inline_query.from_user.id)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    names = {
+        "messages": "Сообщений",
+        "callbacks": "Нажатий кнопок",
+        "flows_started_sell": "Начато продаж",
+        "flows_started_buy": "Начато покупок",
+        "submissions_sell": "Заявок на продажу",
+        "submissions_buy": "Заявок на покупку",
+        "published": "Опубликовано",
+        "rejected": "Отклонено",
+        "matches": "Совпадений",
+        "inline_queries": "Поисковых запросов",
+    }
+    lines = [
+        f"📊 <b>Статистика на {report['day']:%d.%m.%Y}</b>",
+        f"Пользователей: сегодня {report['dau']}, за 7 дней {report['wau']}, за месяц {report['mau']}",
+        "",
+        "<b>Сегодня / всего</b>",
+    ]
+    for name, title in names.items():
+        lines.append(f"{title}: {report['today'].get(name, 0)} / {report['total'].get(name, 0)}")
+    lines.append(f"\n<i>Обновлено {datetime.now():%H:%M:%S}, данные с задержкой до интервала сброса</i>")
+    return "\n".join(lines)
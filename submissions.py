@@ -0,0 +1,487 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from redis.exceptions import ResponseError
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from tg_bot.models import Submission
+from tg_bot.serialization import Serializer, default_serializer
+
+logger = logging.getLogger(__name__)
+
+# INSERT ... ON CONFLICT DO UPDATE для группового коммита — по диалекту БД
+UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
+UNCONFIRMED_KEY = "submissions_unconfirmed"  # id → сколько операций по заявке ещё не в БД
+
+SUBMISSION_FIELDS = ("id", "user_id", "type", "data", "invited", "rejected_all", "status", "created_at")
+
+# Как текстовые поля хэша submission_<id> превращаются обратно в значения
+FIELD_DECODERS = {
+    "user_id": int,
+    "invited": lambda v: v == "1",
+    "rejected_all": lambda v: v == "1",
+}
+
+def is_transient(error: BaseException) -> bool:
+    """Ошибка БД, которая пройдёт сама: обрыв соединения, блокировка, таймаут"""
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (OperationalError, ConnectionError, asyncio.TimeoutError))
+
+
+# Частичная запись поля только в существующую запись (иначе получится обрывок хэша).
+# Изменённая запись — снова неподтверждённая: без TTL и с отметкой в KEYS[2]
+SET_FIELD_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('PERSIST', KEYS[1])
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+    return 1
+end
+return -1
+"""
+
+# Смена статуса только из ожидаемого: 1 — сменили, 0 — статус другой, -1 — записи нет в кэше
+TRANSITION_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then
+    return -1
+end
+if status ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[2])
+redis.call('PERSIST', KEYS[1])
+redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+return 1
+"""
+
+# Операции записаны в БД: ARGV[1] — TTL кэша, дальше тройки (id, сколько операций, ключ хэша).
+# Заявка, у которой не осталось незаписанных операций, снимается с отметки и получает TTL
+CONFIRM_SCRIPT = """
+for i = 2, #ARGV, 3 do
+    if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        redis.call('EXPIRE', ARGV[i + 2], ARGV[1])
+    end
+end
+return 1
+"""
+
+# После рестарта: всё отмеченное будет дописано одной операцией (upsert из хэша) — счётчик = 1.
+# Отметки без хэша снимаются: дописывать нечего
+REPLAY_SCRIPT = """
+local pending = {}
+for _, id in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if redis.call('EXISTS', ARGV[1] .. id) == 1 then
+        redis.call('HSET', KEYS[1], id, 1)
+        table.insert(pending, id)
+    else
+        redis.call('HDEL', KEYS[1], id)
+    end
+end
+return pending
+"""
+
+
+class SubmissionStore:
+    """
+    Хранилище заявок: SQL — долговременная копия, Redis — кэш с отложенной записью.
+    save/update_status сразу пишут в Redis и ставят запись в очередь,
+    фоновый writer сбрасывает очередь в БД пачками (одна транзакция на пачку).
+
+    В Redis заявка — один хэш submission_<id>: метаданные отдельными полями,
+    черновик целиком в поле data. Смена статуса — запись одного поля,
+    чтение — только нужных хендлеру полей.
+    Пока запись не подтверждена БД, хэш живёт без TTL (и не вытесняется при volatile-lru):
+    другой копии заявки ещё нет. id такой заявки отмечен в submissions_unconfirmed (счётчик
+    незаписанных операций); срок cache_ttl ставится, когда счётчик дошёл до нуля.
+    Отмеченное, но не записанное до остановки (падение, БД недоступна при close),
+    writer при следующем запуске первым делом ставит в очередь заново.
+    Коммит, упавший из-за БД (нет соединения, блокировка), повторяется с экспоненциальной паузой.
+    Ошибка в самих данных (IntegrityError, кривой created_at) не повторяется: пачка делится пополам,
+    пока плохая запись не останется одна, — она пишется в лог и отбрасывается, остальные коммитятся.
+    redis — клиент без decode_responses (RedisClient.raw_client): data хранится через Serializer.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, redis=None,
+                 batch_size: int = 500, flush_interval: float = 0.05, cache_ttl: int = 7 * 24 * 3600,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0,
+                 serializer: Serializer = default_serializer):
+        bind = session_factory.kw.get("bind")
+        dialect = bind.dialect.name if bind is not None else "sqlite"
+        if dialect not in UPSERT_INSERTS:
+            raise ValueError(f"SubmissionStore поддерживает {', '.join(UPSERT_INSERTS)}, а не {dialect}")
+        self._insert = UPSERT_INSERTS[dialect]
+        self.session_factory = session_factory
+        self.redis = redis
+        self.serializer = serializer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        self._set_field_script = redis.register_script(SET_FIELD_IF_EXISTS_SCRIPT) if redis is not None else None
+        self._transition_script = redis.register_script(TRANSITION_SCRIPT) if redis is not None else None
+        self._confirm_script = redis.register_script(CONFIRM_SCRIPT) if redis is not None else None
+        self._replay_script = redis.register_script(REPLAY_SCRIPT) if redis is not None else None
+
+    @staticmethod
+    def _cache_key(submission_id: str) -> str:
+        return f"submission_{submission_id}"
+
+    # ---------- жизненный цикл ----------
+
+    def start(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def flush(self):
+        """Ждёт, пока всё из очереди окажется в БД"""
+        await self._queue.join()
+
+    async def close(self, timeout: float = 30.0):
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            # Незаписанное остаётся в Redis без TTL и с отметкой — допишется при следующем запуске
+            logger.error(
+                f"❌ БД недоступна: не записано {self._queue.qsize()} операций, "
+                f"заявки остаются в Redis и будут дописаны при следующем запуске"
+            )
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    # ---------- запись ----------
+
+    async def save(self, submission: Dict[str, Any]):
+        """Сохраняет новую заявку (id, user_id, type, data, invited, rejected_all, status)"""
+        row = {
+            "id": str(submission["id"]),
+            "user_id": submission["user_id"],
+            "type": submission["type"],
+            "data": submission.get("data", {}),
+            "invited": bool(submission.get("invited", False)),
+            "rejected_all": bool(submission.get("rejected_all", False)),
+            "status": submission.get("status", "pending"),
+            "created_at": submission.get("created_at") or datetime.utcnow().isoformat(),
+        }
+        await self._cache_set(row, confirmed=False)
+        self._queue.put_nowait(("upsert", row))
+
+    async def update_status(self, submission_id: str, status: str):
+        if self._set_field_script is not None:
+            await self._set_field_script(
+                keys=[self._cache_key(submission_id), UNCONFIRMED_KEY], args=["status", status, str(submission_id)]
+            )
+        self._queue.put_nowait(("status", {"id": str(submission_id), "status": status}))
+
+    async def transition(self, submission_id: str, old_status: str, new_status: str) -> bool:
+        """
+        Атомарно меняет статус old_status → new_status (compare-and-set).
+        False — заявки нет или статус уже не old_status: действие сделал кто-то другой.
+        """
+        submission_id = str(submission_id)
+        if self._transition_script is None:
+            # Без Redis: условный UPDATE в БД (сначала дописываем очередь, чтобы не обогнать её)
+            await self.flush()
+            async with self.session_factory() as session:
+                async with session.begin():
+                    result = await session.execute(
+                        update(Submission)
+                        .where(Submission.id == submission_id, Submission.status == old_status)
+                        .values(status=new_status)
+                    )
+            return result.rowcount == 1
+
+        key = self._cache_key(submission_id)
+        changed = await self._transition_script(
+            keys=[key, UNCONFIRMED_KEY], args=[old_status, new_status, submission_id]
+        )
+        if changed == -1:
+            # Не в кэше — прогреваем из БД и пробуем ещё раз
+            if await self.get(submission_id, ("status",)) is None:
+                return False
+            changed = await self._transition_script(
+                keys=[key, UNCONFIRMED_KEY], args=[old_status, new_status, submission_id]
+            )
+        if changed != 1:
+            return False
+        self._queue.put_nowait(("status", {"id": submission_id, "status": new_status}))
+        return True
+
+    # ---------- чтение ----------
+
+    async def get(self, submission_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Заявка целиком или только перечисленные поля (например, ("status", "user_id")).
+        Черновик (data) читается и декодируется, только если он запрошен.
+        """
+        fields = tuple(fields) if fields else SUBMISSION_FIELDS
+        cached = await self._cache_get(submission_id, fields)
+        if cached is not None:
+            return cached
+
+        async with self.session_factory() as session:
+            row = await session.get(Submission, str(submission_id))
+        if row is None:
+            return None
+        submission = self._row_to_dict(row)
+        await self._cache_set(submission)
+        return {field: submission[field] for field in fields}
+
+    async def get_many(self, submission_ids: Iterable[str],
+                       fields: Optional[Iterable[str]] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Несколько заявок за один round-trip к Redis (pipeline из HMGET).
+        Чего нет в кэше, дочитывается по одной через get (из БД с прогревом кэша).
+        """
+        submission_ids = [str(submission_id) for submission_id in submission_ids]
+        fields = tuple(fields) if fields else SUBMISSION_FIELDS
+        result: Dict[str, Optional[Dict[str, Any]]] = {submission_id: None for submission_id in submission_ids}
+        if self.redis is not None and submission_ids:
+            cached_fields = [field for field in fields if field != "id"]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for submission_id in submission_ids:
+                    pipe.hmget(self._cache_key(submission_id), cached_fields)
+                rows = await pipe.execute(raise_on_error=False)
+            for submission_id, values in zip(submission_ids, rows):
+                # Ошибка — старый формат ключа; get сам его удалит и перечитает из БД
+                if isinstance(values, Exception) or all(value is None for value in values):
+                    continue
+                submission = {"id": submission_id}
+                for field, value in zip(cached_fields, values):
+                    submission[field] = self._decode_field(field, value)
+                result[submission_id] = {field: submission[field] for field in fields}
+        for submission_id, submission in result.items():
+            if submission is None:
+                result[submission_id] = await self.get(submission_id, fields)
+        return result
+
+    async def get_status(self, submission_id: str) -> Optional[str]:
+        submission = await self.get(submission_id, ("status",))
+        return submission["status"] if submission else None
+
+    async def list_by_status(self, status: str, limit: int = 20) -> List[Dict[str, Any]]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Submission)
+                .where(Submission.status == status)
+                .order_by(Submission.created_at)
+                .limit(limit)
+            )
+            return [self._row_to_dict(row) for row in result.scalars()]
+
+    async def list_by_user(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Submission)
+                .where(Submission.user_id == user_id)
+                .order_by(Submission.created_at.desc())
+                .limit(limit)
+            )
+            return [self._row_to_dict(row) for row in result.scalars()]
+
+    # ---------- внутреннее ----------
+
+    @staticmethod
+    def _row_to_dict(row: Submission) -> Dict[str, Any]:
+        submission = {field: getattr(row, field) for field in SUBMISSION_FIELDS}
+        submission["data"] = json.loads(submission["data"])
+        if isinstance(submission["created_at"], datetime):
+            submission["created_at"] = submission["created_at"].isoformat()
+        return submission
+
+    async def _cache_get(self, submission_id: str, fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+        if self.redis is None:
+            return None
+        fields = [field for field in fields if field != "id"]
+        key = self._cache_key(submission_id)
+        try:
+            values = await self.redis.hmget(key, fields)
+        except ResponseError:
+            # Старый формат (JSON-строка) — выбрасываем, перечитаем из БД
+            await self.redis.delete(key)
+            return None
+        if all(value is None for value in values):
+            return None
+
+        submission = {"id": str(submission_id)}
+        for field, value in zip(fields, values):
+            submission[field] = self._decode_field(field, value)
+        return submission
+
+    def _decode_field(self, field: str, value: Optional[bytes]) -> Any:
+        if value is None:
+            return None
+        if field == "data":
+            return self.serializer.decode(value)
+        value = value.decode()
+        decoder = FIELD_DECODERS.get(field)
+        return decoder(value) if decoder else value
+
+    async def _cache_set(self, submission: Dict[str, Any], confirmed: bool = True):
+        """confirmed=False — записи ещё нет в БД: хэш без TTL до подтверждения коммита"""
+        if self.redis is None:
+            return
+        mapping = {
+            "user_id": submission["user_id"],
+            "type": submission["type"],
+            "data": self.serializer.encode(submission["data"]),
+            "invited": int(bool(submission["invited"])),
+            "rejected_all": int(bool(submission["rejected_all"])),
+            "status": submission["status"],
+            "created_at": submission["created_at"],
+        }
+        key = self._cache_key(submission["id"])
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            if confirmed:
+                pipe.expire(key, self.cache_ttl)
+            else:
+                pipe.hincrby(UNCONFIRMED_KEY, submission["id"], 1)
+            await pipe.execute()
+
+    async def _confirm_cached(self, batch: List[tuple]):
+        """Операции пачки есть в БД (или отброшены) — снимаем их с учёта в submissions_unconfirmed"""
+        if self.redis is None:
+            return
+        counts: Dict[str, int] = {}
+        for op, row in batch:
+            counts[row["id"]] = counts.get(row["id"], 0) + 1
+        args = [self.cache_ttl]
+        for submission_id, count in counts.items():
+            args += [submission_id, count, self._cache_key(submission_id)]
+        try:
+            await self._confirm_script(keys=[UNCONFIRMED_KEY], args=args)
+        except Exception as e:
+            # Останутся отмеченными без TTL — это безопасно: при рестарте их перезапишут тем же upsert
+            logger.warning(f"Не удалось подтвердить в Redis {len(counts)} заявок: {e}")
+
+    async def _replay_unconfirmed(self):
+        """Ставит в очередь заявки, операции по которым не дошли до БД в прошлый запуск"""
+        if self.redis is None:
+            return
+        try:
+            pending = await self._replay_script(keys=[UNCONFIRMED_KEY], args=[self._cache_key("")])
+            for submission_id in pending:
+                if isinstance(submission_id, bytes):
+                    submission_id = submission_id.decode()
+                submission = await self._cache_get(submission_id, SUBMISSION_FIELDS)
+                if submission is not None:
+                    self._queue.put_nowait(("upsert", submission))
+        except Exception as e:
+            logger.exception(f"❌ Не удалось поднять незаписанные заявки из Redis: {e}")
+            return
+        if pending:
+            logger.warning(f"Дописываем в БД {len(pending)} заявок, не записанных в прошлый запуск")
+
+    async def _next_batch(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write_loop(self):
+        await self._replay_unconfirmed()
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write_with_retry(batch)
+                await self._confirm_cached(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_with_retry(self, batch: List[tuple]) -> List[tuple]:
+        """
+        Повторяет ту же пачку, пока ошибка временная: в очередь её не возвращаем,
+        иначе более новые смены статуса записались бы раньше неё.
+        При постоянной ошибке пишет половины по очереди (порядок сохраняется).
+        Возвращает отброшенные операции.
+        """
+        delay = self.retry_delay
+        attempt = 1
+        while True:
+            try:
+                await self._write_batch(batch)
+                return []
+            except Exception as e:
+                if not is_transient(e):
+                    error = e
+                    break
+                logger.exception(
+                    f"❌ Ошибка группового коммита ({len(batch)} записей, попытка {attempt}), "
+                    f"повтор через {delay:.1f} с: {e}"
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+            attempt += 1
+
+        if len(batch) == 1:
+            op, row = batch[0]
+            logger.error(f"❌ Операция {op} заявки {row.get('id')} не записана в БД и отброшена: {error!r}")
+            return batch
+        middle = len(batch) // 2
+        return await self._write_with_retry(batch[:middle]) + await self._write_with_retry(batch[middle:])
+
+    async def _write_batch(self, batch: List[tuple]):
+        upserts: Dict[str, Dict[str, Any]] = {}
+        statuses: Dict[str, Dict[str, Any]] = {}
+        for op, row in batch:
+            if op == "upsert":
+                upserts[row["id"]] = {
+                    **row,
+                    "data": json.dumps(row["data"], ensure_ascii=False),
+                    "created_at": datetime.fromisoformat(row["created_at"]),
+                }
+                statuses.pop(row["id"], None)
+            else:
+                if row["id"] in upserts:
+                    upserts[row["id"]]["status"] = row["status"]
+                else:
+                    statuses[row["id"]] = row
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                if upserts:
+                    stmt = self._insert(Submission).values(list(upserts.values()))
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[Submission.id],
+                        set_={
+                            "data": stmt.excluded.data,
+                            "invited": stmt.excluded.invited,
+                            "rejected_all": stmt.excluded.rejected_all,
+                            "status": stmt.excluded.status,
+                        },
+                    )
+                    await session.execute(stmt)
+                if statuses:
+                    await session.execute(update(Submission), list(statuses.values()))
@@ -0,0 +1,17 @@
+"""
+Модули бота импортируются как tg_bot.* (в проде каталог репозитория называется tg_bot).
+Если пакет не установлен, регистрируем корень репозитория под этим именем.
+"""
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if "tg_bot" not in sys.modules:
+    try:
+        import tg_bot  # noqa: F401
+    except ImportError:
+        package = types.ModuleType("tg_bot")
+        package.__path__ = [str(ROOT)]
+        sys.modules["tg_bot"] = package
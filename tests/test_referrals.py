@@ -0,0 +1,69 @@
+import asyncio
+
+import fakeredis
+
+from tg_bot.redis_db import ADD_REFERRAL_SCRIPT, CLAIM_REFERRALS_SCRIPT, RedisClient
+
+REFERRER = 1001
+KEYS = RedisClient._referral_keys(REFERRER)
+
+
+def run_with_scripts(scenario):
+    async def main():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        add = redis.register_script(ADD_REFERRAL_SCRIPT)
+        claim = redis.register_script(CLAIM_REFERRALS_SCRIPT)
+        await scenario(
+            redis,
+            lambda user_id: add(keys=KEYS, args=[user_id]),
+            lambda threshold: claim(keys=KEYS, args=[threshold]),
+        )
+
+    asyncio.run(main())
+
+
+def test_add_referral_counts_each_friend_once():
+    async def scenario(redis, add, claim):
+        assert await add(1) == [1, 1]
+        assert await add(2) == [1, 2]
+        assert await add(1) == [0, 2]
+
+    run_with_scripts(scenario)
+
+
+def test_claim_resets_round_but_keeps_members():
+    async def scenario(redis, add, claim):
+        for user_id in range(3):
+            await add(user_id)
+        assert await claim(5) == 0
+        await add(3)
+        await add(4)
+        assert await claim(5) == 1
+        assert await claim(5) == 0  # раунд уже засчитан
+
+        # уже приглашённые в новом раунде не считаются
+        assert await add(0) == [0, 0]
+        assert await add(5) == [1, 1]
+        assert await redis.scard(KEYS[0]) == 6
+
+    run_with_scripts(scenario)
+
+
+def test_parallel_claims_win_once():
+    async def scenario(redis, add, claim):
+        for user_id in range(5):
+            await add(user_id)
+        results = await asyncio.gather(*(claim(5) for _ in range(10)))
+        assert sorted(results) == [0] * 9 + [1]
+
+    run_with_scripts(scenario)
+
+
+def test_legacy_invite_list_is_migrated():
+    async def scenario(redis, add, claim):
+        await redis.rpush(KEYS[2], 10, 11, 11)
+        assert await add(12) == [1, 3]
+        assert not await redis.exists(KEYS[2])
+        assert await add(10) == [0, 3]
+
+    run_with_scripts(scenario)
@@ -0,0 +1,72 @@
+import asyncio
+
+import fakeredis
+
+from tg_bot.matching import parse_budget
+from tg_bot.search import ListingSearch, parse_offset, parse_query
+
+
+def test_parse_budget():
+    assert parse_budget("до 2 млн") == 2_000_000
+    assert parse_budget("1,5м") == 1_500_000
+    assert parse_budget("800к") == 800_000
+    assert parse_budget("от 500 000 до 1 200 000") == 1_200_000
+    assert parse_budget("договорная") is None
+    assert parse_budget(None) is None
+
+
+def test_parse_query_price_and_words():
+    assert parse_query("Кафе Новосибирск до 2млн") == (("кафе", "новосибирск"), 2_000_000)
+    assert parse_query("пекарня Томск до 1 500 000") == (("пекарня", "томск"), 1_500_000)
+    # маленькое число — часть названия, а не цена
+    assert parse_query("кофейня 24") == (("24", "кофейня"), None)
+
+
+def test_parse_query_hashtags_and_stop_words():
+    assert parse_query("#бьюти #до5млн") == (("#бьюти", "#до5млн"), None)
+    assert parse_query("салон в центре за 900 тыс") == (("салон", "центре"), 900_000)
+    assert parse_query("Ёлки") == (("елки",), None)
+    assert parse_query("") == ((), None)
+
+
+def test_parse_offset():
+    assert parse_offset("") == (None, 0)
+    assert parse_offset("7:40") == (7, 40)
+    assert parse_offset("20") == (None, 0)  # старый формат — с первой страницы
+
+
+def add_listings(search: ListingSearch, titles):
+    return asyncio.gather(*(
+        search.add(f"l{i}", {"title": title, "price": "1000000", "city": "Томск", "category_idx": "0"}, title)
+        for i, title in enumerate(titles)
+    ))
+
+
+def test_pages_keep_index_version():
+    async def scenario():
+        search = ListingSearch(fakeredis.FakeAsyncRedis(decode_responses=True))
+        await add_listings(search, [f"кафе {i}" for i in range(25)])
+        first, next_offset = await search.search("кафе")
+        assert len(first) == 20 and next_offset is not None
+
+        # новое объявление между страницами не сдвигает вторую
+        await search.add("new", {"title": "кафе новое", "price": "1000000", "city": "Томск"}, "")
+        second, last = await search.search("кафе", offset=next_offset)
+        assert last is None
+        assert len(second) == 5
+        assert not {card["id"] for card in first} & {card["id"] for card in second}
+
+        fresh, _ = await search.search("кафе")
+        assert fresh[0]["id"] == "new"
+
+    asyncio.run(scenario())
+
+
+def test_short_words_match_only_whole_terms():
+    async def scenario():
+        search = ListingSearch(fakeredis.FakeAsyncRedis(decode_responses=True))
+        await add_listings(search, ["кафе у дома", "ип салон"])
+        assert [card["title"] for card in (await search.search("кафе ка"))[0]] == ["кафе у дома"]
+        assert [card["title"] for card in (await search.search("ип сал"))[0]] == ["ип салон"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from tg_bot.db import create_engine, create_session_factory, init_db
+from tg_bot.submissions import UNCONFIRMED_KEY, SubmissionStore
+
+
+def make_submission(submission_id: str, **fields):
+    return {"id": submission_id, "user_id": 42, "type": "sell", "data": {"title": "Кафе"}, **fields}
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path / 'submissions.db'}"
+
+
+def run_with_store(database_url, scenario, redis=None):
+    async def main():
+        engine = create_engine(database_url)
+        await init_db(engine)
+        store = SubmissionStore(create_session_factory(engine), redis=redis, flush_interval=0.01)
+        store.start()
+        try:
+            await scenario(store)
+        finally:
+            await store.close()
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_transition_has_one_winner(database_url):
+    async def scenario(store):
+        await store.save(make_submission("s1"))
+        results = await asyncio.gather(*(store.transition("s1", "pending", "published") for _ in range(10)))
+        assert results.count(True) == 1
+        assert not await store.transition("s1", "pending", "rejected")
+        assert await store.transition("s1", "published", "pending")  # откат после ошибки публикации
+        await store.flush()
+        assert (await store.get("s1"))["status"] == "pending"
+
+    run_with_store(database_url, scenario, redis=fakeredis.FakeAsyncRedis())
+
+
+def test_transition_warms_cache_from_db(database_url):
+    redis = fakeredis.FakeAsyncRedis()
+
+    async def scenario(store):
+        await store.save(make_submission("s1"))
+        await store.flush()
+        await redis.delete(store._cache_key("s1"))
+        assert await store.transition("s1", "pending", "published")
+        assert not await store.transition("missing", "pending", "published")
+        await store.flush()
+        assert not await redis.hlen(UNCONFIRMED_KEY)
+        assert await redis.ttl(store._cache_key("s1")) > 0
+
+    run_with_store(database_url, scenario, redis=redis)
+
+
+def test_transition_without_redis(database_url):
+    async def scenario(store):
+        await store.save(make_submission("s1"))
+        results = await asyncio.gather(*(store.transition("s1", "pending", "published") for _ in range(5)))
+        assert results.count(True) == 1
+        assert (await store.get("s1"))["status"] == "published"
+
+    run_with_store(database_url, scenario)
+
+
+def test_bad_row_is_dropped_and_batch_commits(database_url):
+    async def scenario(store):
+        await store.save(make_submission("good1"))
+        await store.save(make_submission("bad", created_at="вчера"))
+        await store.save(make_submission("good2"))
+        await store.flush()
+        assert {row["id"] for row in await store.list_by_user(42)} == {"good1", "good2"}
+        assert await store.get("bad") is None
+
+    run_with_store(database_url, scenario)
+
+
+def test_unconfirmed_submissions_are_replayed_on_start(database_url):
+    redis = fakeredis.FakeAsyncRedis()
+
+    async def crashed(store):
+        # writer не успел записать: имитируем падение до коммита
+        store._writer.cancel()
+        await store.save(make_submission("s1"))
+        await store.save(make_submission("s2"))
+        store._queue = asyncio.Queue()
+        assert await store.list_by_user(42) == []
+
+    async def restarted(store):
+        await asyncio.sleep(0.05)
+        await store.flush()
+        assert not await redis.hlen(UNCONFIRMED_KEY)
+        assert {row["id"] for row in await store.list_by_user(42)} == {"s1", "s2"}
+
+    run_with_store(database_url, crashed, redis=redis)
+    run_with_store(database_url, restarted, redis=redis)
@@ -1,4 +1,14 @@
-# какой-то мусор
+import html
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+
 # ✅ ФУНКЦИИ ПОМОЩНИКИ
 def escape_html(text: str) -> str:
     """Экранирует HTML для Telegram"""
@@ -44,12 +54,127 @@ def is_subscribed_status(status: str) -> bool:
     """Проверяет, является ли статус подпиской"""
     return status not in ("left", "kicked")
 
-async def check_subscription(user_id: int) -> bool:
-    """Проверяет подписку пользователя в канале"""
+class SubscriptionCache:
+    """
+    Кэш статусов подписки на канал.
+    Первый уровень — LRU в памяти процесса, второй — общий для всех процессов Redis.
+    Положительный и отрицательный статусы живут разное время: отписку мы узнаём
+    из chat_member, а вот только что подписавшегося пользователя нельзя долго держать "неподписанным".
+    """
+
+    def __init__(self, channel_id: int, redis=None, positive_ttl: int = 600,
+                 negative_ttl: int = 30, max_size: int = 10000):
+        self.channel_id = channel_id
+        self.redis = redis
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._local: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "api_calls": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"subscription_status_{user_id}"
+
+    def _ttl(self, subscribed: bool) -> int:
+        return self.positive_ttl if subscribed else self.negative_ttl
+
+    def _remember(self, user_id: int, subscribed: bool):
+        self._local[user_id] = (subscribed, time.monotonic() + self._ttl(subscribed))
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[bool]:
+        """Возвращает закэшированный статус или None"""
+        entry = self._local.get(user_id)
+        if entry is not None:
+            subscribed, expires_at = entry
+            if expires_at > time.monotonic():
+                self._local.move_to_end(user_id)
+                self.stats["local_hits"] += 1
+                return subscribed
+            del self._local[user_id]
+
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(self._key(user_id))
+            except Exception as e:
+                logger.warning(f"Кэш подписок недоступен в Redis: {e}")
+                value = None
+            if value is not None:
+                subscribed = value == "1"
+                self._remember(user_id, subscribed)
+                self.stats["redis_hits"] += 1
+                return subscribed
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, user_id: int, subscribed: bool):
+        """Сохраняет статус в оба уровня кэша"""
+        self._remember(user_id, subscribed)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._key(user_id), "1" if subscribed else "0", ex=self._ttl(subscribed))
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить статус подписки в Redis: {e}")
+
+    async def invalidate(self, user_id: int):
+        """Сбрасывает статус пользователя"""
+        self.stats["invalidations"] += 1
+        self._local.pop(user_id, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self._key(user_id))
+            except Exception as e:
+                logger.warning(f"Не удалось сбросить статус подписки в Redis: {e}")
+
+    def hit_ratio(self) -> float:
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+
+subscription_cache: Optional[SubscriptionCache] = None
+
+
+def init_subscription_cache(channel_id: int, redis=None, **kwargs) -> SubscriptionCache:
+    """Создаёт кэш подписок, которым пользуется check_subscription"""
+    global subscription_cache
+    subscription_cache = SubscriptionCache(channel_id, redis=redis, **kwargs)
+    return subscription_cache
+
+
+async def update_subscription_status(user_id: int, status: str):
+    """Обновляет кэш по апдейту chat_member"""
+    if subscription_cache is not None:
+        await subscription_cache.set(user_id, is_subscribed_status(status))
+
+
+async def check_subscription(user_id: int, force_refresh: bool = False) -> bool:
+    """Проверяет подписку пользователя в канале (через кэш, force_refresh — мимо кэша)"""
+    cache = subscription_cache
+    if cache is None:
+        raise RuntimeError("Кэш подписок не инициализирован: вызовите init_subscription_cache()")
+
+    if not force_refresh:
+        cached = await cache.get(user_id)
+        if cached is not None:
+            return cached
+
     try:
-        member = await bot.get_chat_member(CHANNEL_ID, user_id)
+        cache.stats["api_calls"] += 1
+        member = await Bot.get_current().get_chat_member(cache.channel_id, user_id)
         is_subscribed = is_subscribed_status(member.status)
         logger.info(f"User {user_id} subscription check: status={member.status}, subscribed={is_subscribed}")
+        await cache.set(user_id, is_subscribed)
         return is_subscribed
     except Exception as e:
         logger.exception(f"Ошибка при проверке подписки для {user_id}: {e}")
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+from aiohttp import web
+from aiogram import Dispatcher, executor, types
+from aiogram.dispatcher.webhook import SendMessage
+
+from tg_bot.sender import ScheduledBot
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Включается в run_webhook: только в этом режиме ответ можно вернуть в теле HTTP-ответа
+WEBHOOK_ACTIVE = False
+
+
+def make_secret_token_middleware(webhook_path: str, secret_token: str):
+    """Отбрасывает запросы на вебхук без правильного секретного заголовка"""
+
+    @web.middleware
+    async def secret_token_middleware(request: web.Request, handler):
+        if request.path == webhook_path and request.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+            logger.warning(f"Запрос на вебхук с неверным секретом от {request.remote}")
+            raise web.HTTPForbidden()
+        return await handler(request)
+
+    return secret_token_middleware
+
+
+async def answer_inline(message: types.Message, text: str, **kwargs):
+    """
+    Ответ на сообщение без отдельного запроса к Bot API.
+    В режиме вебхука возвращает SendMessage, который уходит в теле ответа Telegram
+    (хендлер должен вернуть результат и больше ничего не отправлять после него).
+    Это тоже сообщение для лимитов Telegram: токены чата и общего лимита ScheduledBot берём заранее.
+    В режиме polling просто отправляет сообщение.
+    """
+    if WEBHOOK_ACTIVE:
+        if isinstance(message.bot, ScheduledBot):
+            await message.bot.reserve(message.chat.id)
+        return SendMessage(message.chat.id, text, **kwargs)
+    await message.answer(text, **kwargs)
+
+
+def run_polling(dp: Dispatcher, allowed_updates: Optional[List[str]] = None,
+                on_startup: Optional[Callable] = None, on_shutdown: Optional[Callable] = None):
+    executor.start_polling(
+        dispatcher=dp,
+        allowed_updates=allowed_updates,
+        on_startup=on_startup,
+        on_shutdown=on_shutdown,
+    )
+
+
+def run_webhook(dp: Dispatcher, webhook_host: str, webhook_path: str, secret_token: str,
+                webapp_host: str, webapp_port: int, allowed_updates: Optional[List[str]] = None,
+                on_startup: Optional[Callable] = None, on_shutdown: Optional[Callable] = None):
+    """
+    Поднимает aiohttp-сервер для вебхука. Если зарегистрировать вебхук не удалось —
+    откатывается на polling (start_polling сам снимет вебхук).
+    """
+    global WEBHOOK_ACTIVE
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(dp.bot.set_webhook(
+            webhook_host.rstrip("/") + webhook_path,
+            allowed_updates=allowed_updates,
+            secret_token=secret_token,
+        ))
+    except Exception as e:
+        logger.exception(f"Не удалось установить вебхук, переключаемся на polling: {e}")
+        run_polling(dp, allowed_updates, on_startup, on_shutdown)
+        return
+
+    WEBHOOK_ACTIVE = True
+    web_app = web.Application(middlewares=[make_secret_token_middleware(webhook_path, secret_token)])
+
+    async def on_webhook_shutdown(dispatcher: Dispatcher):
+        await dispatcher.bot.delete_webhook()
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+
+    logger.info(f"Вебхук {webhook_path} слушает {webapp_host}:{webapp_port}")
+    executor.start_webhook(
+        dispatcher=dp,
+        webhook_path=webhook_path,
+        web_app=web_app,
+        on_startup=on_startup,
+        on_shutdown=on_webhook_shutdown,
+        skip_updates=False,
+        host=webapp_host,
+        port=webapp_port,
+    )
+
+
+def run(dp: Dispatcher, mode: str, webhook_host: Optional[str], webhook_path: str, secret_token: Optional[str],
+        webapp_host: str, webapp_port: int, allowed_updates: Optional[List[str]] = None,
+        on_startup: Optional[Callable] = None, on_shutdown: Optional[Callable] = None):
+    """Запускает бота в выбранном режиме (webhook/polling)"""
+    if mode == "webhook":
+        if webhook_host and secret_token:
+            run_webhook(dp, webhook_host, webhook_path, secret_token, webapp_host, webapp_port,
+                        allowed_updates, on_startup, on_shutdown)
+            return
+        logger.error("BOT_MODE=webhook, но не заданы WEBHOOK_HOST/WEBHOOK_SECRET — запускаем polling")
+    run_polling(dp, allowed_updates, on_startup, on_shutdown)